@@ -90,6 +90,9 @@ class Instrument(CostCalculator, EodMarketData):
     def get_premium(self, qty, px, ts=None):
         return -qty * px * self.multiplier
 
+    def get_premiums(self, qtys, pxs, tss=None):
+        return -np.asarray(qtys) * pxs * self.multiplier
+
     def get_eod_frame(self):
         """Return the eod market data frame for pricing"""
         close = self.pxs.close
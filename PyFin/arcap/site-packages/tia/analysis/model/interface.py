@@ -1,3 +1,6 @@
+import numpy as np
+
+
 __all__ = ['CostCalculator', 'EodMarketData', 'MarketDataColumns', 'TxnColumns', 'PositionColumns', 'PlColumns',
            'TxnPlColumns']
 
@@ -8,6 +11,11 @@ class CostCalculator(object):
     def get_premium(self, qty, px, ts=None):
         raise NotImplementedError()
 
+    def get_premiums(self, qtys, pxs, tss=None):
+        """Return the array of premiums for the arrays of quantities, prices, and timestamps. Override to vectorize."""
+        tss = [None] * len(qtys) if tss is None else tss
+        return np.array([self.get_premium(qty, px, ts=ts) for qty, px, ts in zip(qtys, pxs, tss)], dtype=float)
+
     def get_mkt_val(self, qty, px, ts=None):
         raise NotImplementedError()
 
@@ -4,12 +4,12 @@ import pandas as pd
 import numpy as np
 
 from tia.analysis.model.interface import TxnColumns as TC, MarketDataColumns as MC, PlColumns as PL, TxnPlColumns as TPL
-from tia.analysis.perf import periods_in_year, guess_freq
+from tia.analysis.perf import periods_in_year, guess_freq, drawdown_info
 from tia.util.decorator import lazy_property
 from tia.util.fmt import new_dynamic_formatter
 
 
-__all__ = ['ProfitAndLoss']
+__all__ = ['ProfitAndLoss', 'BatchOpenAverageProfitAndLossCalculator']
 
 
 def _dly_to_ltd(frame, dly_cols):
@@ -35,114 +35,223 @@ def _ltd_to_dly(frame, ltd_cols):
     return pl
 
 
+def _empty_ltd_frame(pl):
+    """Return the ltd frame for a merged frame which contains no transactions"""
+    ltd_frame = pd.DataFrame(index=pl.index)
+    ltd_frame[TPL.DT] = pl[PL.DT]
+    ltd_frame[TPL.POS] = 0
+    ltd_frame[TPL.PID] = 0
+    ltd_frame[TPL.TID] = 0
+    ltd_frame[TPL.TXN_QTY] = np.nan
+    ltd_frame[TPL.TXN_PX] = np.nan
+    ltd_frame[TPL.TXN_FEES] = 0
+    ltd_frame[TPL.TXN_PREMIUM] = 0
+    ltd_frame[TPL.TXN_INTENT] = 0
+    ltd_frame[TPL.TXN_ACTION] = 0
+    ltd_frame[TPL.CLOSE_PX] = pl[TPL.CLOSE_PX]
+    ltd_frame[TPL.OPEN_VAL] = 0
+    ltd_frame[TPL.MKT_VAL] = 0
+    ltd_frame[TPL.TOT_VAL] = 0
+    ltd_frame[TPL.DVDS] = 0
+    ltd_frame[TPL.FEES] = 0
+    ltd_frame[TPL.RPL_GROSS] = 0
+    ltd_frame[TPL.RPL] = 0
+    ltd_frame[TPL.UPL] = 0
+    ltd_frame[TPL.PL] = 0
+    return ltd_frame
+
+
+def _check_missing_pxs(pl, by=None, names=None):
+    """Raise an exception if any row with an open position can not be priced"""
+    has_position = pl[TC.PID] > 0
+    missing_pxs = pl[MC.CLOSE].isnull()
+    mask = has_position & missing_pxs
+    if mask.any():
+        msg = 'insufficient price data: {0} prices missing for dates {1}'
+        if by is not None:
+            # only report the first instrument with missing prices
+            code = by[mask].iloc[0]
+            mask &= by == code
+            msg = 'insufficient price data for {2}: {0} prices missing for dates {1}'
+        missing = pl[TC.DT][mask]
+        mdates = ','.join([_.strftime('%Y-%m-%d') for _ in set(missing[:5])])
+        mdates += (len(missing) > 5 and '...' or '')
+        raise Exception(msg.format(len(missing), mdates, by is not None and names[code] or None))
+
+
+def _ffill(s, by=None, seed=None):
+    s = s.ffill() if by is None else s.groupby(by).ffill()
+    return s if seed is None else s.fillna(seed)
+
+
+def _cumsum(s, by=None, seed=None):
+    if by is not None:
+        return s.groupby(by).cumsum()
+    elif seed is None:
+        return s.cumsum()
+    else:
+        # prepend the seed so values are accumulated in the same order as a calculation from the first row
+        return pd.Series(np.append(seed, s.values).cumsum()[1:], index=s.index, name=s.name)
+
+
+def _ltd_frame(pl, by=None, seed=None):
+    """Compute the live-to-date transaction level profit and loss from the sorted frame of merged transaction and
+    market data. If by is specified, then pl contains multiple instruments which are identified by the by Series (rows
+    of an instrument must be contiguous) and all fills and cumulative sums are restricted to each instrument. If seed
+    is specified, it is the last ltd row prior to pl and its position and running totals are carried forward.
+    """
+    seed = {} if seed is None else seed
+    # Now there is a row for every timestamp. Now compute the pl and fill in where missing data should be
+    cols = [TC.DT, TC.POS, TC.PID, TC.TID, TC.INTENT, TC.ACTION, TC.FEES, TC.QTY, TC.PX, TC.PREMIUM, TC.OPEN_VAL]
+    dts, pos_qtys, pids, tids, intents, sides, txn_fees, txn_qtys, txn_pxs, premiums, open_vals = [pl[c] for c in cols]
+
+    dvds, closing_pxs, mkt_vals = [pl[c] for c in [MC.DVDS, MC.CLOSE, MC.MKT_VAL]]
+    # Ensure only end of day is kept for dividends (join will match dvd to any transaction during day
+    eod = dts != dts.shift(-1)
+    if by is not None:
+        eod |= by != by.shift(-1)
+    dvds = dvds.where(eod, 0)
+    # fill in pl dates
+    open_vals = _ffill(open_vals, by, seed.get(TPL.OPEN_VAL)).fillna(0)
+    pos_qtys = _ffill(pos_qtys, by, seed.get(TPL.POS)).fillna(0)
+    # pid is the only tricky one, copy only while position is open
+    inpos = intents.notnull() | (pos_qtys != 0)
+    pids = np.where(inpos, _ffill(pids, by, seed.get(TPL.PID)), 0)
+    # Zero fill missing
+    dvds = dvds.fillna(0).astype(float)
+    tids = tids.fillna(0).astype(int)
+    intents = intents.fillna(0).astype(int)
+    sides = sides.fillna(0).astype(int)
+    txn_fees = txn_fees.fillna(0)
+    premiums = premiums.fillna(0)
+    # LTD p/l calculation
+    fees = _cumsum(txn_fees, by, seed.get(TPL.FEES))
+    total_vals = _cumsum(premiums, by, seed.get(TPL.TOT_VAL))
+    mkt_vals = mkt_vals * pos_qtys
+    dvds = _cumsum(dvds * pos_qtys, by, seed.get(TPL.DVDS))
+    rpl_gross = total_vals - open_vals
+    rpl = rpl_gross + fees + dvds
+    upl = mkt_vals + open_vals
+    tpl = upl + rpl
+    # build the result
+    data = OrderedDict()
+    data[TPL.DT] = dts
+    data[TPL.POS] = pos_qtys
+    data[TPL.PID] = pids
+    data[TPL.TID] = tids
+    data[TPL.TXN_QTY] = txn_qtys
+    data[TPL.TXN_PX] = txn_pxs
+    data[TPL.TXN_FEES] = txn_fees
+    data[TPL.TXN_PREMIUM] = premiums
+    data[TPL.TXN_INTENT] = intents
+    data[TPL.TXN_ACTION] = sides
+    data[TPL.CLOSE_PX] = closing_pxs
+    data[TPL.OPEN_VAL] = open_vals
+    data[TPL.MKT_VAL] = mkt_vals
+    data[TPL.TOT_VAL] = total_vals
+    data[TPL.DVDS] = dvds
+    data[TPL.FEES] = fees
+    data[TPL.RPL_GROSS] = rpl_gross
+    data[TPL.RPL] = rpl
+    data[TPL.UPL] = upl
+    data[TPL.PL] = tpl
+    ltd_frame = pd.DataFrame(data, columns=data.keys())
+    return ltd_frame
+
+
 class OpenAverageProfitAndLossCalculator(object):
     def compute(self, txns):
         """Compute the long/short live-to-date transaction level profit and loss. Uses an open average calculation"""
-        txndata = txns.frame
-        mktdata = txns.pricer.get_eod_frame()
+        return self.compute_frame(txns.frame, txns.pricer.get_eod_frame())
+
+    def compute_frame(self, txndata, mktdata, seed=None):
+        """Compute the live-to-date transaction level profit and loss from the transaction frame and the end of day
+        market data frame. If seed is specified, it is the last ltd row prior to the data and the calculation continues
+        from it rather than from a flat position."""
         if not isinstance(mktdata.index, pd.DatetimeIndex):
             mktdata.to_timestamp(freq='B')
 
         # get the set of all txn dts and mkt data dts
         pl = pd.merge(txndata, mktdata.reset_index(), how='outer', on=TPL.DT)
-        if pl[TC.PID].isnull().all():
-            ltd_frame = pd.DataFrame(index=pl.index)
-            ltd_frame[TPL.DT] = pl[PL.DT]
-            ltd_frame[TPL.POS] = 0
-            ltd_frame[TPL.PID] = 0
-            ltd_frame[TPL.TID] = 0
-            ltd_frame[TPL.TXN_QTY] = np.nan
-            ltd_frame[TPL.TXN_PX] = np.nan
-            ltd_frame[TPL.TXN_FEES] = 0
-            ltd_frame[TPL.TXN_PREMIUM] = 0
-            ltd_frame[TPL.TXN_INTENT] = 0
-            ltd_frame[TPL.TXN_ACTION] = 0
-            ltd_frame[TPL.CLOSE_PX] = pl[TPL.CLOSE_PX]
-            ltd_frame[TPL.OPEN_VAL] = 0
-            ltd_frame[TPL.MKT_VAL] = 0
-            ltd_frame[TPL.TOT_VAL] = 0
-            ltd_frame[TPL.DVDS] = 0
-            ltd_frame[TPL.FEES] = 0
-            ltd_frame[TPL.RPL_GROSS] = 0
-            ltd_frame[TPL.RPL] = 0
-            ltd_frame[TPL.UPL] = 0
-            ltd_frame[TPL.PL] = 0
-            return ltd_frame
+        if seed is None and pl[TC.PID].isnull().all():
+            return _empty_ltd_frame(pl)
         else:
             pl.sort([TC.DT, TC.PID, TC.TID], inplace=1)
             pl.reset_index(inplace=1, drop=1)
             # check that all days can be priced
-            has_position = pl[TC.PID] > 0
-            missing_pxs = pl[MC.CLOSE].isnull()
-            missing = pl[TC.DT][has_position & missing_pxs]
-            if len(missing) > 0:
-                msg = 'insufficient price data: {0} prices missing for dates {1}'
-                mdates = ','.join([_.strftime('%Y-%m-%d') for _ in set(missing[:5])])
-                mdates += (len(missing) > 5 and '...' or '')
-                raise Exception(msg.format(len(missing), mdates))
-
-            # Now there is a row for every timestamp. Now compute the pl and fill in where missing data should be
-            cols = [TC.DT, TC.POS, TC.PID, TC.TID, TC.INTENT, TC.ACTION, TC.FEES, TC.QTY, TC.PX, TC.PREMIUM,
-                    TC.OPEN_VAL]
-            dts, pos_qtys, pids, tids, intents, sides, txn_fees, txn_qtys, txn_pxs, premiums, open_vals = [pl[c] for c
-                                                                                                           in
-                                                                                                           cols]
-
-            dvds, closing_pxs, mkt_vals = [pl[c] for c in [MC.DVDS, MC.CLOSE, MC.MKT_VAL]]
-            # Ensure only end of day is kept for dividends (join will match dvd to any transaction during day
-            dvds = dvds.where(dts != dts.shift(-1), 0)
-            # fill in pl dates
-            open_vals.ffill(inplace=1)
-            open_vals.fillna(0, inplace=1)
-            pos_qtys.ffill(inplace=1)
-            pos_qtys.fillna(0, inplace=1)
-            # pid is the only tricky one, copy only while position is open
-            inpos = intents.notnull() | (pos_qtys != 0)
-            pids = np.where(inpos, pids.ffill(), 0)
-            pl['pid'] = pids.astype(int)
-            # Zero fill missing
-            dvds.fillna(0, inplace=1)
-            tids.fillna(0, inplace=1)
-            tids = tids.astype(int)
-            intents.fillna(0, inplace=1)
-            intents = intents.astype(int)
-            sides.fillna(0, inplace=1)
-            sides = sides.astype(int)
-            txn_fees.fillna(0, inplace=1)
-            premiums.fillna(0, inplace=1)
-            # LTD p/l calculation
-            fees = txn_fees.cumsum()
-            total_vals = premiums.cumsum()
-            mkt_vals *= pos_qtys
-            dvds = (dvds * pos_qtys).cumsum()
-            rpl_gross = total_vals - open_vals
-            rpl = rpl_gross + fees + dvds
-            upl = mkt_vals + open_vals
-            tpl = upl + rpl
-            # build the result
-            data = OrderedDict()
-            data[TPL.DT] = dts
-            data[TPL.POS] = pos_qtys
-            data[TPL.PID] = pids
-            data[TPL.TID] = tids
-            data[TPL.TXN_QTY] = txn_qtys
-            data[TPL.TXN_PX] = txn_pxs
-            data[TPL.TXN_FEES] = txn_fees
-            data[TPL.TXN_PREMIUM] = premiums
-            data[TPL.TXN_INTENT] = intents
-            data[TPL.TXN_ACTION] = sides
-            data[TPL.CLOSE_PX] = closing_pxs
-            data[TPL.OPEN_VAL] = open_vals
-            data[TPL.MKT_VAL] = mkt_vals
-            data[TPL.TOT_VAL] = total_vals
-            data[TPL.DVDS] = dvds
-            data[TPL.FEES] = fees
-            data[TPL.RPL_GROSS] = rpl_gross
-            data[TPL.RPL] = rpl
-            data[TPL.UPL] = upl
-            data[TPL.PL] = tpl
-            ltd_frame = pd.DataFrame(data, columns=data.keys())
-            return ltd_frame
+            _check_missing_pxs(pl)
+            return _ltd_frame(pl, seed=seed)
+
+
+class BatchOpenAverageProfitAndLossCalculator(object):
+    """Compute the open average live-to-date transaction level profit and loss for many instruments at once. The
+    transaction and market data for all instruments are stacked into a single frame (keyed by instrument) so the merge,
+    fills and cumulative sums are each done once for the entire book rather than once per instrument. The results are
+    identical to those of the OpenAverageProfitAndLossCalculator.
+    """
+    KEY = '_key'
+
+    def compute(self, txns):
+        """
+        :param txns: dict-like of key to Txns object
+        :return: OrderedDict of key to ltd transaction level profit and loss frame
+        """
+        keys = list(txns.keys())
+        txn_frames = OrderedDict([(k, txns[k].frame) for k in keys])
+        mkt_frames = OrderedDict([(k, txns[k].pricer.get_eod_frame()) for k in keys])
+        return self.compute_frames(txn_frames, mkt_frames)
+
+    def compute_frames(self, txn_frames, mkt_frames):
+        """
+        :param txn_frames: dict-like of key to transaction frame (Txns.frame)
+        :param mkt_frames: dict-like of key to end of day market data frame (EodMarketData.get_eod_frame)
+        :return: OrderedDict of key to ltd transaction level profit and loss frame
+        """
+        KEY = self.KEY
+        keys = list(txn_frames.keys())
+        results = OrderedDict([(k, None) for k in keys])
+        # Instruments without transactions are trivial, so only stack the others
+        batch = []
+        for key in keys:
+            if txn_frames[key].empty:
+                results[key] = OpenAverageProfitAndLossCalculator().compute_frame(txn_frames[key], mkt_frames[key])
+            else:
+                batch.append(key)
+
+        if batch:
+            txnpieces = [txn_frames[k] for k in batch]
+            mktpieces = [mkt_frames[k].reset_index() for k in batch]
+            codes = np.arange(len(batch))
+            txndata = pd.concat(txnpieces, ignore_index=True)
+            txndata[KEY] = np.repeat(codes, [len(f.index) for f in txnpieces])
+            mktdata = pd.concat(mktpieces, ignore_index=True)
+            mktdata[KEY] = np.repeat(codes, [len(f.index) for f in mktpieces])
+
+            pl = pd.merge(txndata, mktdata, how='outer', on=[KEY, TPL.DT])
+            pl.sort([KEY, TC.DT, TC.PID, TC.TID], inplace=1)
+            pl.reset_index(inplace=1, drop=1)
+            by = pl[KEY]
+            _check_missing_pxs(pl, by, batch)
+            ltd = _ltd_frame(pl, by)
+
+            # split the stacked result back into a frame per instrument
+            bounds = np.searchsorted(by.values, np.append(codes, len(batch)))
+            haspid = pl[TC.PID].notnull().groupby(by).all()
+            for code, key in enumerate(batch):
+                frame = ltd.iloc[bounds[code]:bounds[code + 1]].reset_index(drop=True)
+                if haspid[code]:
+                    # the single instrument merge leaves pids as ints if every row has a transaction
+                    frame[TPL.PID] = frame[TPL.PID].astype(txn_frames[key][TC.PID].dtype)
+                results[key] = frame
+        return results
+
+    def attach(self, txns):
+        """Compute the profit and loss for the dict-like of key to Txns object and set it on each Txns object, so the
+        per instrument profit and loss is not recomputed when accessed"""
+        for key, ltd in self.compute(txns).iteritems():
+            txn = txns[key]
+            txn._pl = TxnProfitAndLoss(txn, TxnProfitAndLossDetails(txn, ltd_frame=ltd))
+        return txns
 
 
 class TxnProfitAndLossDetails(object):
@@ -176,6 +285,46 @@ class TxnProfitAndLossDetails(object):
             self._frame = _ltd_to_dly(ltd, self.ltd_cols)
         return self._frame
 
+    def _split(self, txns):
+        """Return the number of leading rows which are unchanged when extending to txns (see Txns.extend) and the date
+        from which rows must be recomputed (the last date or the date of the first new transaction, whichever is
+        earlier)."""
+        ltd = self.ltd_frame
+        if self.txns is None or ltd.empty:
+            return 0, None
+        cutoff = ltd[TPL.DT].iloc[-1]
+        nprev = len(self.txns.frame.index)
+        txndata = txns.frame
+        if nprev < len(txndata.index):
+            cutoff = min(cutoff, txndata[TC.DT].iloc[nprev])
+        cutoff = cutoff.to_datetime64()
+        return ltd[TPL.DT].values.searchsorted(cutoff), cutoff
+
+    def carried_rows(self, txns):
+        """Return the number of leading rows which are unchanged when extending to txns (see Txns.extend)"""
+        return self._split(txns)[0]
+
+    def extend(self, txns):
+        """Return the details for txns, which extends the Txns object of this instance (see Txns.extend). The carried
+        rows are reused and only the remaining rows are computed, starting from the state of the last carried row."""
+        n, cutoff = self._split(txns)
+        if n == 0:
+            return TxnProfitAndLossDetails(txns)
+
+        ltd = self.ltd_frame
+        head = ltd.iloc[:n]
+        txndata = txns.frame
+        txndata = txndata.iloc[txndata[TC.DT].values.searchsorted(cutoff):]
+        mktdata = txns.pricer.get_eod_frame()
+        mktdata = mktdata.iloc[mktdata.index.values.searchsorted(cutoff):]
+        tail = OpenAverageProfitAndLossCalculator().compute_frame(txndata, mktdata, seed=head.iloc[-1])
+        tail.index = tail.index + n
+        result = TxnProfitAndLossDetails(txns, ltd_frame=pd.concat([head, tail]))
+        if self._frame is not None:
+            dly = _ltd_to_dly(result._ltd_frame.iloc[n - 1:], self.ltd_cols).iloc[1:]
+            result._frame = pd.concat([self._frame.iloc[:n], dly])
+        return result
+
     def asfreq(self, freq):
         frame = self.frame
         pl = frame[PL.ALL].set_index(PL.DT)
@@ -270,24 +419,7 @@ class ProfitAndLossDetails(object):
             resampled = frame.resample(freq, how='sum')
             return ProfitAndLossDetails(resampled)
 
-    @lazy_property
-    def drawdown_info(self):
-        dd = self.drawdowns.to_frame()
-        last = dd.index[-1]
-        dd.columns = ['vals']
-        dd['nonzero'] = (dd.vals != 0).astype(int)
-        dd['gid'] = (dd.nonzero.shift(1) != dd.nonzero).astype(int).cumsum()
-        ixs = dd.reset_index().groupby(['nonzero', 'gid'])[dd.index.name or 'index'].apply(lambda x: np.array(x))
-        rows = []
-        if 1 in ixs:
-            for ix in ixs[1]:
-                sub = dd.ix[ix]
-                # need to get t+1 since actually draw down ends on the 0 value
-                end = dd.index[dd.index.get_loc(sub.index[-1]) + (last != sub.index[-1] and 1 or 0)]
-                rows.append([sub.index[0], end, sub.vals.min(), sub.vals.idxmin()])
-        f = pd.DataFrame.from_records(rows, columns=['dd start', 'dd end', 'maxdd', 'maxdd dt'])
-        f['days'] = (f['dd end'] - f['dd start']).astype('timedelta64[D]')
-        return f
+    drawdown_info = lazy_property(lambda self: drawdown_info(dd=self.drawdowns), 'drawdown_info')
 
     @lazy_property
     def drawdowns(self):
@@ -525,3 +657,7 @@ class TxnProfitAndLoss(ProfitAndLoss):
     def get_pid_mask(self, pid):
         return self.txn_details.get_pid_mask(pid)
 
+    def extend(self, txns):
+        """Return the profit and loss for txns, which extends the Txns object of this instance (see Txns.extend)"""
+        return TxnProfitAndLoss(txns, self.txn_details.extend(txns))
+
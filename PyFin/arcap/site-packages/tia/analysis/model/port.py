@@ -1,16 +1,19 @@
 from collections import OrderedDict
 
 import pandas as pd
+import numpy as np
 
-from tia.analysis.model.interface import CostCalculator, EodMarketData, PositionColumns as PC
+from tia.analysis.model.interface import CostCalculator, EodMarketData, PositionColumns as PC, TxnPlColumns as TPL
+from tia.analysis.model.pl import TxnProfitAndLoss, TxnProfitAndLossDetails
 from tia.analysis.model.pos import Positions
-from tia.analysis.model.ret import RoiiRetCalculator
+from tia.analysis.model.ret import RoiiRetCalculator, Performance
+from tia.analysis.model.trd import TradeStore
 from tia.analysis.model.txn import Txns
 from tia.analysis.util import insert_level
 from tia.util.decorator import lazy_property
 
 
-__all__ = ['SingleAssetPortfolio', 'PortfolioPricer', 'PortfolioSubset', 'PortfolioSummary']
+__all__ = ['SingleAssetPortfolio', 'PortfolioPricer', 'PortfolioView', 'PortfolioSubset', 'PortfolioSummary']
 
 
 class PortfolioPricer(CostCalculator, EodMarketData):
@@ -46,6 +49,9 @@ class PortfolioPricer(CostCalculator, EodMarketData):
     def get_premium(self, qty, px, ts=None):
         return -qty * px * self.multiplier
 
+    def get_premiums(self, qtys, pxs, tss=None):
+        return -np.asarray(qtys) * pxs * self.multiplier
+
     def get_eod_frame(self):
         close = self.get_closing_pxs()
         mktval = self.get_mkt_val(close)
@@ -60,9 +66,9 @@ class SingleAssetPortfolio(object):
     def __init__(self, pricer, trades, ret_calc=None):
         """
         :param pricer: PortfolioPricer
-        :param trades: list of Trade objects
+        :param trades: list of Trade objects, TradeStore or columnar trades (see columnar_txn_frame)
         """
-        self.trades = tuple(trades)
+        self.trades = trades if isinstance(trades, (pd.DataFrame, np.ndarray, TradeStore)) else tuple(trades)
         self.pricer = pricer
         self._ret_calc = ret_calc or RoiiRetCalculator()
 
@@ -149,6 +155,103 @@ class SingleAssetPortfolio(object):
         return SingleAssetPortfolio(pricer, trds, ret_calc=self.ret_calc)
 
 
+class PortfolioView(object):
+    """Subset of a SingleAssetPortfolio defined by a set of pids which shares the profit and loss and returns of the
+    root portfolio. Rather than splitting the trades and recomputing the subset, the transaction level rows of the
+    excluded positions are cleared and reduced to a single mark row per date, as the subset would have. This is only
+    valid when a position's returns do not depend on the other positions (see supports), otherwise use
+    SingleAssetPortfolio.subset.
+    """
+
+    def __init__(self, port, pids=None):
+        """
+        :param port: SingleAssetPortfolio
+        :param pids: pids to include, if None then all positions are included
+        """
+        self.root = port
+        self._pids = None if pids is None else np.asarray(pids)
+
+    @staticmethod
+    def supports(port):
+        return isinstance(port, SingleAssetPortfolio) and isinstance(port.ret_calc, RoiiRetCalculator)
+
+    pricer = property(lambda self: self.root.pricer)
+    ret_calc = property(lambda self: self.root.ret_calc)
+    pids = property(lambda self: self.root.positions.frame.index.values if self._pids is None else self._pids)
+
+    @lazy_property
+    def row_mask(self):
+        """boolean mask of the root's transaction level rows which belong to the view"""
+        return self.root.pl.txn_frame[TPL.PID].isin(self.pids).values
+
+    @lazy_property
+    def keep_mask(self):
+        """boolean mask of the root's transaction level rows kept by the view, the rows of the view and the first row
+        of any date on which the view has none"""
+        dts = self.root.pl.txn_frame[TPL.DT]
+        included = self.row_mask
+        return included | (~dts.duplicated().values & ~dts.isin(dts[included]).values)
+
+    @lazy_property
+    def pl(self):
+        if self._pids is None:
+            return self.root.pl
+        frame = self.root.pl.txn_details.frame
+        excluded = ~self.row_mask
+        cleared = frame.copy()
+        for col in frame.columns:
+            if col in (TPL.TXN_QTY, TPL.TXN_PX):
+                cleared[col] = np.where(excluded, np.nan, frame[col].values)
+            elif col not in (TPL.DT, TPL.CLOSE_PX):
+                cleared[col] = np.where(excluded, 0, frame[col].values)
+        cleared = cleared[self.keep_mask].reset_index(drop=True)
+        return TxnProfitAndLoss(txnpl_details=TxnProfitAndLossDetails(frame=cleared))
+
+    @lazy_property
+    def performance(self):
+        if self._pids is None:
+            return self.root.performance
+        rets = self.root.performance.txn
+        rets = pd.Series(np.where(self.row_mask, rets.values, 0.), index=rets.index, name=rets.name)
+        return Performance(rets[self.keep_mask])
+
+    @lazy_property
+    def positions(self):
+        if self._pids is None:
+            return self.root.positions
+        positions = Positions(self.root.txns, self._pids)
+        frame = self.root.positions.frame
+        positions._frame = frame.ix[self._pids]
+        positions._frame.index.name = frame.index.name
+        return positions
+
+    txns = property(lambda self: self.to_portfolio().txns)
+    trades = property(lambda self: self.to_portfolio().trades)
+
+    dly_pl = property(lambda self: self.pl.dly)
+    monthly_pl = property(lambda self: self.pl.monthly)
+    dly_rets = property(lambda self: self.performance.dly)
+    monthly_rets = property(lambda self: self.performance.monthly)
+
+    def to_portfolio(self):
+        """Return the SingleAssetPortfolio for the view"""
+        return self.root if self._pids is None else self.root.subset(self._pids)
+
+    def subset(self, pids):
+        return PortfolioView(self.root, pids)
+
+    @lazy_property
+    def long(self):
+        return PortfolioSubset.longs(self)
+
+    @lazy_property
+    def short(self):
+        return PortfolioSubset.shorts(self)
+
+    winner = property(lambda self: PortfolioSubset.winners(self))
+    loser = property(lambda self: PortfolioSubset.losers(self))
+
+
 class PortfolioSubset(object):
     @staticmethod
     def longs(port):
@@ -219,29 +322,20 @@ class PortfolioSummary(object):
 
         analyze_fct = self.analyze_returns if analyze_fct is None else analyze_fct
 
-        def _iter_all_lvls(lvl, keys, parent, results):
+        def _iter_all_lvls(lvl, keys, parent, keyed):
             if lvl < (lvls - 1):
                 # exhaust combinations
                 for key, child in iter_fcts[lvl](parent):
-                    _iter_all_lvls(lvl + 1, keys + [key], child, results)
+                    _iter_all_lvls(lvl + 1, keys + [key], child, keyed)
             else:
                 # at the bottom
                 for key, child in iter_fcts[lvl](parent):
-                    idx_names = ['lvl{0}'.format(i + 1) for i in range(lvls)]
-                    idx_vals = [[k] for k in keys + [key]]
-                    idx = pd.MultiIndex.from_arrays(idx_vals, names=idx_names)
                     res = analyze_fct(child)
                     if isinstance(res, pd.Series):
-                        res = res.to_frame().T
-                        res.index = idx
-                        results.append(res)
+                        keyed.append((tuple(keys + [key]), res))
                     else:
                         for k, v in res.iteritems():
-                            # prepend current levels to key name
-                            v = v.to_frame().T
-                            idx = pd.MultiIndex.from_arrays(idx_vals + [k], names=idx_names + ['lvl%s' % lvls])
-                            v.index = idx
-                            results.append(v)
+                            keyed.append((tuple(keys + [key, k]), v))
 
         if lvls == 0:
             def _get_res(p):
@@ -261,20 +355,26 @@ class PortfolioSummary(object):
             else:
                 return _get_res(port)
         else:
+            # the built-in analyses and splits only need the pl, performance and positions, so they can use views
+            # which share the root calculations rather than recomputing every subset. Others get the portfolios.
+            use_views = analyze_fct in (self.analyze_returns, self.analyze_pl) and \
+                all(getattr(fct, 'supports_view', 0) for fct in iter_fcts)
+            as_view = lambda p: PortfolioView(p) if use_views and PortfolioView.supports(p) else p
+            keyed = []
             if hasattr(port, 'iteritems'):
-                pieces = []
                 for k, p in port.iteritems():
-                    results = []
-                    _iter_all_lvls(0, [], p, results)
-                    tmp = pd.concat(results)
-                    tmp.index.names = ['lvl%s' % (i + 2) for i in range(len(tmp.index.names))]
-                    tmp = insert_level(tmp, k, level_name='lvl1', axis=1)
-                    pieces.append(tmp)
-                return pd.concat(pieces)
+                    pkeyed = []
+                    _iter_all_lvls(0, [], as_view(p), pkeyed)
+                    keyed.extend([((k,) + key, res) for key, res in pkeyed])
             else:
-                results = []
-                _iter_all_lvls(0, [], port, results)
-                return pd.concat(results)
+                _iter_all_lvls(0, [], as_view(port), keyed)
+
+            # build the result with a single concat
+            keys = [key for key, _ in keyed]
+            result = pd.concat([res for _, res in keyed], axis=1, keys=range(len(keyed))).T
+            nlvls = max(len(key) for key in keys)
+            result.index = pd.MultiIndex.from_tuples(keys, names=['lvl%s' % (i + 1) for i in range(nlvls)])
+            return result
 
     def add_iter_fct(self, siter):
         self.iter_fcts.append(siter)
@@ -287,6 +387,7 @@ class PortfolioSummary(object):
             yield 'winner', PortfolioSubset.winners(port)
             yield 'loser', PortfolioSubset.losers(port)
 
+        _split_port.supports_view = 1
         self.add_iter_fct(_split_port)
         return self
 
@@ -297,6 +398,7 @@ class PortfolioSummary(object):
             yield 'long', port.long
             yield 'short', port.short
 
+        _split_port.supports_view = 1
         self.add_iter_fct(_split_port)
         return self
 
@@ -63,14 +63,16 @@ class Position(object):
 
 
 class Positions(object):
-    def __init__(self, txns):
+    def __init__(self, txns, pids=None):
         """
         TODO: possibly cache positions and share with subset
         :param txns: Txns object
+        :param pids: optional array of pids to restrict the positions of txns to
         """
         self.txns = txns
+        self._pids = pids
 
-    pids = property(lambda self: self.txns.pids)
+    pids = property(lambda self: self.txns.pids if self._pids is None else self._pids)
     sides = property(lambda self: self.frame[PC.SIDE])
     long_pids = property(lambda self: self.frame[self.frame[PC.SIDE] == Side.Long].index)
     short_pids = property(lambda self: self.frame[self.frame[PC.SIDE] == Side.Short].index)
@@ -103,29 +105,59 @@ class Positions(object):
                 result._frame.index.name = self._frame.index.name
         return result
 
+    @lazy_property
+    def ltd_txn_frame(self):
+        """The transaction level rows of all positions (ordered by pid) with the live-to-date position pl and return.
+        Equivalent to the ltd_txn series of each Position's pl and performance, but computed in one pass."""
+        txns = self.txns
+        txnpl = txns.pl.txn_frame
+        pids = txnpl[TPL.PID].values
+        rows = (pids != 0).nonzero()[0]
+        # stable sort keeps the rows of each position in order
+        rows = rows[pids[rows].argsort(kind='mergesort')]
+        frame = txnpl.iloc[rows].reset_index(drop=True)
+        frame[TPL.PID] = by = frame[TPL.PID].astype(int)
+        frame['ltd_pl'] = frame[TPL.PL].groupby(by).cumsum()
+        rets = pd.Series(txns.performance.txn.values[rows])
+        frame['ltd_ret'] = (1. + rets).groupby(by).cumprod() - 1.
+        return frame
+
     @lazy_property
     def frame(self):
-        vals = []
-        for pos in iter(self):
-            vals.append([
-                pos.pid,
-                pos.side,
-                pos.open_dt,
-                pos.close_dt,
-                pos.open_qty,
-                pos.open_px,
-                pos.close_px,
-                pos.open_premium,
-                pos.pl.ltd_txn.iloc[-1],
-                pos.performance.ltd_txn.iloc[-1],
-                pos.duration,
-                pos.ntxns,
-                pos.state
-            ])
-        cols = [PC.PID, PC.SIDE, PC.OPEN_DT, PC.CLOSE_DT, PC.OPEN_QTY, PC.OPEN_PX, PC.CLOSE_PX, PC.OPEN_PREMIUM, \
-                PC.PL, PC.RET, PC.DURATION, PC.NUM_TXNS, PC.STATE]
-        f = pd.DataFrame.from_records(vals, columns=cols)
-        f[PC.PID] = f[PC.PID].astype(int)
+        if self._pids is not None:
+            frame = Positions(self.txns).frame
+            sub = frame.ix[self._pids]
+            sub.index.name = frame.index.name
+            return sub
+
+        ltd = self.ltd_txn_frame
+        pids = ltd[TPL.PID].values
+        n = len(pids)
+        starts = np.append(True, pids[1:] != pids[:-1])[:n]
+        ends = np.append(starts[1:], True)[:n]
+        first = ltd.iloc[starts.nonzero()[0]]
+        last = ltd.iloc[ends.nonzero()[0]]
+        # rows are in date order within a position, so each date change is a new day
+        dts = ltd[TPL.DT].values
+        newdt = starts | np.append(True, dts[1:] != dts[:-1])[:n]
+        duration = np.add.reduceat(newdt.astype(int), starts.nonzero()[0]) if n else np.array([], dtype=int)
+        ntxns = self.txns.frame.groupby(TPL.PID).size().reindex(first[TPL.PID].values).values
+
+        data = OrderedDict()
+        data[PC.PID] = first[TPL.PID].values
+        data[PC.SIDE] = np.where(first[TPL.TXN_ACTION].values == Action.Buy, Side.Long, Side.Short)
+        data[PC.OPEN_DT] = first[TPL.DT].values
+        data[PC.CLOSE_DT] = last[TPL.DT].values
+        data[PC.OPEN_QTY] = first[TPL.TXN_QTY].values
+        data[PC.OPEN_PX] = first[TPL.TXN_PX].values
+        data[PC.CLOSE_PX] = last[TPL.TXN_PX].values
+        data[PC.OPEN_PREMIUM] = first[TPL.TXN_PREMIUM].values
+        data[PC.PL] = last['ltd_pl'].values
+        data[PC.RET] = last['ltd_ret'].values
+        data[PC.DURATION] = duration
+        data[PC.NUM_TXNS] = ntxns
+        data[PC.STATE] = np.where(last[TPL.TXN_INTENT].values == Intent.Close, State.Closed, State.Open)
+        f = pd.DataFrame(data, columns=data.keys())
         return f.set_index(PC.PID)
 
     @lazy_property
@@ -182,8 +214,9 @@ class Positions(object):
         frame = self.frame
         pids = frame.index
 
-        min_rets = pd.Series([self[pid].performance.ltd_txn.min() for pid in pids], index=pids)
-        max_rets = pd.Series([self[pid].performance.ltd_txn.max() for pid in pids], index=pids)
+        ltd = self.ltd_txn_frame
+        min_rets = ltd['ltd_ret'].groupby(ltd[TPL.PID]).min()
+        max_rets = ltd['ltd_ret'].groupby(ltd[TPL.PID]).max()
 
         if not ls:
             s = frame.duration + 20 if dur else 20
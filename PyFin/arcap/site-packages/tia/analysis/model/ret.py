@@ -30,6 +30,11 @@ class RetCalculator(object):
     def compute(self, txns):
         raise NotImplementedError()
 
+    def extend(self, perf, pl, txns):
+        """Return the Performance for txns, which extends the transactions with profit and loss pl and Performance
+        perf (see Txns.extend). By default, the returns are recomputed."""
+        return self.compute(txns)
+
 
 class RoiiRetCalculator(RetCalculator):
     def __init__(self, leverage=None):
@@ -37,39 +42,91 @@ class RoiiRetCalculator(RetCalculator):
         :param leverage: {None, scalar, Series}, number to scale the position returns
         :return:
         """
-        get_lev = None
-        if leverage is None:
+        if leverage is None or isinstance(leverage, pd.Series):
             pass
         elif np.isscalar(leverage):
             if leverage <= 0:
                 raise ValueError('leverage must be a positive non-zero number, not %s' % leverage)
-            else:
-                get_lev = lambda ts: leverage
-        elif isinstance(leverage, pd.Series):
-            get_lev = lambda ts: leverage.asof(ts)
         else:
             raise ValueError(
                 'leverage must be {None, positive scalar, Datetime/Period indexed Series} not %s' % type(leverage))
 
         self.leverage = leverage
-        self.get_lev = get_lev
+
+    def get_levs(self, dts):
+        """Return the array of leverage for the array of dates, resolving a leverage Series with a single as-of join"""
+        leverage = self.leverage
+        if leverage is None:
+            return np.ones(len(dts))
+        elif np.isscalar(leverage):
+            return np.repeat(float(leverage), len(dts))
+        else:
+            leverage = leverage.dropna()
+            index = leverage.index
+            if isinstance(index, pd.PeriodIndex):
+                index = index.to_timestamp()
+            locs = index.searchsorted(dts, side='right') - 1
+            return np.where(locs >= 0, leverage.values[locs], np.nan)
+
+    def _txn_rets(self, txnpl):
+        """Compute return_on_initial_capital for every position at once with segmented scans over the pid array"""
+        pids = txnpl[TPL.PID].values
+        rets = np.zeros(len(pids))
+        rows = (pids != 0).nonzero()[0]
+        if len(rows):
+            # stable sort keeps the rows of each position in order
+            rows = rows[pids[rows].argsort(kind='mergesort')]
+            ppids = pids[rows]
+            starts = np.append(True, ppids[1:] != ppids[:-1])
+            firsts = starts.nonzero()[0]
+            segs = starts.cumsum() - 1
+            costs = np.abs(txnpl[TPL.OPEN_VAL].values[rows[firsts]])
+            if (costs <= 0).any():
+                raise ValueError('cost must be a positive number not %s' % costs[costs <= 0][0])
+            levs = self.get_levs(txnpl[TPL.DT].values[rows[firsts]])
+            ltd_pl = pd.Series(txnpl[TPL.PL].values[rows]).groupby(segs).cumsum().values
+            cost = costs[segs]
+            eod = cost + (levs[segs] * ltd_pl)
+            ltd_rets = (eod / cost) - 1.
+            gross = 1. + ltd_rets
+            prev = np.append(np.nan, gross[:-1])
+            rets[rows] = np.where(starts, ltd_rets, gross / prev - 1.)
+
+        return pd.Series(rets, index=txnpl[TPL.DT], name='ret')
 
     def compute(self, txns):
-        txnpl = txns.pl.txn_frame
-        txnrets = pd.Series(0, index=txnpl.index, name='ret')
-        get_lev = self.get_lev
-        for pid, pframe in txnpl[[TPL.OPEN_VAL, TPL.PID, TPL.PL, TPL.DT]].groupby(TPL.PID):
-            if pid != 0:
-                cost = abs(pframe[TPL.OPEN_VAL].iloc[0])
-                ppl = pframe[TPL.PL]
-                lev = None if get_lev is None else get_lev(pframe[TPL.DT].iloc[0])
-                ret = return_on_initial_capital(cost, ppl, lev)
-                txnrets[ppl.index] = ret
-
-        txnrets.index = txnpl[TPL.DT]
+        txnrets = self._txn_rets(txns.pl.txn_frame)
         crets = CumulativeRets(txnrets)
         return Performance(crets)
 
+    def extend(self, perf, pl, txns):
+        """Position returns only depend on the rows of the position, so reuse the returns of all rows prior to the first
+        position which is not entirely carried forward"""
+        n = pl.txn_details.carried_rows(txns)
+        if n == 0:
+            return self.compute(txns)
+
+        txnpl = txns.pl.txn_frame
+        pids = txnpl[TPL.PID].values
+        start = n
+        if pids[n - 1] != 0:
+            # rows of a position are contiguous, so back up to its first row
+            prior = (pids[:n] != pids[n - 1]).nonzero()[0]
+            start = prior[-1] + 1 if len(prior) else 0
+        head = perf.txn.iloc[:start]
+        tail = self._txn_rets(txnpl.iloc[start:])
+        crets = CumulativeRets(pd.concat([head, tail]))
+        return Performance(crets)
+
+
+def _period_segments(ltd, freq):
+    """Return the period labels and the start and end (exclusive) row of each non-empty period of the date ordered ltd
+    Series when grouped by the freq"""
+    sizes = ltd.groupby(pd.TimeGrouper(freq)).size()
+    sizes = sizes[sizes > 0]
+    ends = sizes.values.cumsum()
+    return sizes.index, ends - sizes.values, ends
+
 
 class FixedAumRetCalculator(RetCalculator):
     def __init__(self, aum, reset_freq='M'):
@@ -80,22 +137,14 @@ class FixedAumRetCalculator(RetCalculator):
 
     def compute(self, txns):
         ltd = txns.pl.ltd_txn
-        grouper = pd.TimeGrouper(self.reset_freq)
-        period_rets = pd.Series(np.nan, index=ltd.index)
+        keys, starts, ends = _period_segments(ltd, self.reset_freq)
         aum = self.aum
-        at = 0
-        cf = OrderedDict()
-        for key, grp in ltd.groupby(grouper):
-            if grp.empty:
-                continue
-            eod = aum + grp
-            sod = eod.shift(1)
-            sod.iloc[0] = aum
-            period_rets.iloc[at:at + len(grp.index)] = eod / sod - 1.
-            at += len(grp.index)
-            # get aum back to fixed amount
-            cf[key] = eod.iloc[-1] - aum
-        self.external_cash_flows = pd.Series(cf)
+        eod = aum + ltd.values
+        sod = np.append(np.nan, eod)[:-1]
+        sod[starts] = aum
+        period_rets = pd.Series(eod / sod - 1., index=ltd.index)
+        # get aum back to fixed amount
+        self.external_cash_flows = pd.Series(eod[ends - 1] - aum, index=keys)
         crets = CumulativeRets(period_rets)
         return Performance(crets)
 
@@ -108,21 +157,16 @@ class AumRetCalculator(RetCalculator):
 
     def compute(self, txns):
         ltd = txns.pl.ltd_txn
-        grouper = pd.TimeGrouper(self.freq)
-        period_rets = pd.Series(np.nan, index=ltd.index)
-        self.txn_aum = txn_aum = pd.Series(np.nan, index=ltd.index)
-        sop = self.starting_aum
-        at = 0
-        for key, grp in ltd.groupby(grouper):
-            if grp.empty:
-                continue
-            eod = sop + grp
-            sod = eod.shift(1)
-            sod.iloc[0] = sop
-            period_rets.iloc[at:at + len(grp.index)] = eod / sod - 1.
-            txn_aum.iloc[at:at + len(grp.index)] = sod
-            at += len(grp.index)
-            sop = eod.iloc[-1]
+        keys, starts, ends = _period_segments(ltd, self.freq)
+        vals = ltd.values
+        # the start of period aum is the prior period's end of day aum
+        sops = np.append(self.starting_aum, vals[ends[:-1] - 1]).cumsum()
+        segs = np.repeat(np.arange(len(starts)), ends - starts)
+        eod = sops[segs] + vals
+        sod = np.append(np.nan, eod)[:-1]
+        sod[starts] = sops
+        period_rets = pd.Series(eod / sod - 1., index=ltd.index)
+        self.txn_aum = pd.Series(sod, index=ltd.index)
         crets = CumulativeRets(period_rets)
         return Performance(crets)
 
@@ -186,7 +230,7 @@ class CumulativeRets(object):
     ltd_ann = lazy_property(lambda self: self.ltd_rets_ann.iloc[-1], name='ltd_ann')
     std = lazy_property(lambda self: self.rets.std(), 'std')
     std_ann = lazy_property(lambda self: self.std * np.sqrt(self.pds_per_year), 'std_ann')
-    drawdown_info = lazy_property(lambda self: drawdown_info(self.rets), 'drawdown_info')
+    drawdown_info = lazy_property(lambda self: drawdown_info(dd=self.drawdowns), 'drawdown_info')
     drawdowns = lazy_property(lambda self: drawdowns(self.rets), 'drawdowns')
     maxdd = lazy_property(lambda self: self.drawdown_info['maxdd'].min(), 'maxdd')
     dd_avg = lazy_property(lambda self: self.drawdown_info['maxdd'].mean(), 'dd_avg')
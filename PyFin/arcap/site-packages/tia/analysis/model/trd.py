@@ -4,11 +4,12 @@ import pandas as pd
 import numpy as np
 
 
-__all__ = ['Trade', 'TradeBlotter']
+__all__ = ['Trade', 'TradeStore', 'TradeBlotter']
 
 
 class Trade(object):
     """Simple Trade Model"""
+    __slots__ = ('tid', 'ts', 'qty', 'px', 'fees', '_kwargs')
 
     def __init__(self, tid, ts, qty, px, fees=0., **kwargs):
         self.tid = tid
@@ -16,7 +17,25 @@ class Trade(object):
         self.qty = qty
         self.px = px
         self.fees = fees
-        self.kwargs = kwargs
+        # only keep a dict for trades which have extra attributes
+        self._kwargs = kwargs or None
+
+    @property
+    def kwargs(self):
+        if self._kwargs is None:
+            self._kwargs = {}
+        return self._kwargs
+
+    @kwargs.setter
+    def kwargs(self, kwargs):
+        self._kwargs = kwargs
+
+    def __getstate__(self):
+        return tuple(getattr(self, _) for _ in self.__slots__)
+
+    def __setstate__(self, state):
+        for attr, val in zip(self.__slots__, state):
+            setattr(self, attr, val)
 
     def split(self, amt):
         """ return 2 trades, 1 with specific amt and the other with self.quantity - amt """
@@ -30,14 +49,102 @@ class Trade(object):
         return '<%s(%s, qty=%s, px=%s, ts=%s)>' % (self.__class__.__name__, self.tid, self.qty, self.px, self.ts)
 
 
+class TradeStore(object):
+    """Growable struct-of-arrays storage for trades. The core trade fields are each held in a numpy array (timestamps as
+    int64 nanoseconds) and the kwargs of a trade are only kept in a sidecar dict for trades which define them. Iterating
+    or indexing the store returns Trade objects.
+    """
+
+    def __init__(self, capacity=1024):
+        self._n = 0
+        self._tid = np.empty(capacity, dtype=np.int64)
+        self._ts = np.empty(capacity, dtype=np.int64)
+        self._qty = np.empty(capacity, dtype=float)
+        self._px = np.empty(capacity, dtype=float)
+        self._fees = np.empty(capacity, dtype=float)
+        self._kwargs = {}
+
+    @classmethod
+    def from_arrays(cls, tids, tss, qtys, pxs, fees=None):
+        """Build the store from arrays of the trade fields"""
+        n = len(qtys)
+        store = cls(capacity=max(n, 1))
+        store._tid[:n] = tids
+        store._ts[:n] = np.asarray(pd.DatetimeIndex(tss).values, dtype='M8[ns]').view(np.int64)
+        store._qty[:n] = qtys
+        store._px[:n] = pxs
+        store._fees[:n] = 0. if fees is None else fees
+        store._n = n
+        return store
+
+    def _grow(self):
+        capacity = max(2 * len(self._tid), 1)
+        for attr in ['_tid', '_ts', '_qty', '_px', '_fees']:
+            arr = getattr(self, attr)
+            grown = np.empty(capacity, dtype=arr.dtype)
+            grown[:self._n] = arr[:self._n]
+            setattr(self, attr, grown)
+
+    def append(self, tid, ts, qty, px, fees=0., **kwargs):
+        n = self._n
+        if n == len(self._tid):
+            self._grow()
+        self._tid[n] = tid
+        self._ts[n] = pd.Timestamp(ts).value
+        self._qty[n] = qty
+        self._px[n] = px
+        self._fees[n] = fees
+        if kwargs:
+            self._kwargs[n] = kwargs
+        self._n = n + 1
+
+    def add(self, trade):
+        """Append the Trade object"""
+        self.append(trade.tid, trade.ts, trade.qty, trade.px, trade.fees, **trade.kwargs)
+
+    tid = property(lambda self: self._tid[:self._n])
+    ts = property(lambda self: self._ts[:self._n].view('M8[ns]'))
+    qty = property(lambda self: self._qty[:self._n])
+    px = property(lambda self: self._px[:self._n])
+    fees = property(lambda self: self._fees[:self._n])
+    has_kwargs = property(lambda self: len(self._kwargs) > 0)
+
+    @property
+    def frame(self):
+        """Return the columnar trades (see columnar_txn_frame). Any kwargs are not included."""
+        return pd.DataFrame({'tid': self.tid, 'ts': self.ts, 'qty': self.qty, 'px': self.px, 'fees': self.fees},
+                            columns=['tid', 'ts', 'qty', 'px', 'fees'])
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self._n
+        if idx < 0 or idx >= self._n:
+            raise IndexError('trade index out of range')
+        kwargs = self._kwargs.get(idx, {})
+        return Trade(self._tid[idx], pd.Timestamp(self._ts[idx]), self._qty[idx], self._px[idx], self._fees[idx],
+                     **kwargs)
+
+    def __iter__(self):
+        for idx in xrange(self._n):
+            yield self[idx]
+
+
 class TradeBlotter(object):
     """TradeBlotter class provides a way to ensure that a trade never causes a position to cross zero (and later need
     split for long/short accouting). The methods provide the intent so the blotter can verify the expected state."""
 
-    def __init__(self, tidgen=None):
+    def __init__(self, tidgen=None, store=None):
+        """
+        :param tidgen: trade id generator or starting trade id
+        :param store: optional TradeStore to emit trades into rather than a list of Trade objects
+        """
         self.ts = None
         self._live_qty = 0
-        self.trades = []
+        self._last_qty = 0
+        self.trades = [] if store is None else store
         if tidgen is None or isinstance(tidgen, int):
             tidgen = itertools.count(tidgen or 1, 1)
         self.tidgen = tidgen
@@ -51,9 +158,12 @@ class TradeBlotter(object):
     def _order(self, qty, px, fees=0, **kwargs):
         if not self.ts:
             raise Exception('no timestamp has been set in the blotter')
-        trd = Trade(self.next_tid(), self.ts, qty, px, fees=fees, **kwargs)
-        self.trades.append(trd)
+        if isinstance(self.trades, TradeStore):
+            self.trades.append(self.next_tid(), self.ts, qty, px, fees=fees, **kwargs)
+        else:
+            self.trades.append(Trade(self.next_tid(), self.ts, qty, px, fees=fees, **kwargs))
         self._live_qty += qty
+        self._last_qty = qty
 
     def open(self, qty, px, fees=0, **kwargs):
         if self.is_open():
@@ -65,7 +175,7 @@ class TradeBlotter(object):
     def close(self, px, fees=0, **kwargs):
         if not self.is_open():
             raise Exception('close position failed: no position currently open')
-        qty = -self.trades[-1].qty
+        qty = -self._last_qty
         self._order(qty, px, fees, **kwargs)
 
     def try_close(self, px, fees=0, **kwargs):
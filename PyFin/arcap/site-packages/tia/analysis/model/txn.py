@@ -1,13 +1,17 @@
+from collections import OrderedDict
+
 import pandas as pd
+import numpy as np
 
 from tia.util.decorator import lazy_property
 from tia.analysis.model.interface import TxnColumns as TC
+from tia.analysis.model.trd import Trade, TradeStore
 from tia.analysis.model.pl import TxnProfitAndLoss
 from tia.analysis.model.ret import RoiiRetCalculator
 from tia.analysis.util import is_decrease, is_increase, crosses_zero
 
 
-__all__ = ['Intent', 'Action', 'iter_txns', 'Txns']
+__all__ = ['Intent', 'Action', 'iter_txns', 'columnar_txn_frame', 'Txns']
 
 
 class Intent(object):
@@ -38,9 +42,11 @@ class Action(object):
     }
 
 
-def iter_txns(trds):
-    """ iterator of trades which splits trades to ensure proper long/short accounting"""
-    pos = 0
+def iter_txns(trds, pos=0):
+    """ iterator of trades which splits trades to ensure proper long/short accounting
+
+    :param pos: the position held prior to the first trade
+    """
     for trd in trds:
         if pos != 0 and is_decrease(pos, trd.qty) and crosses_zero(pos, trd.qty):
             # Split to make accounting for long/short possible
@@ -55,17 +61,103 @@ def iter_txns(trds):
             yield trd
 
 
+def columnar_txn_frame(trades, pricer, pos=0, open_val=0., pid=0):
+    """Vectorized version of splitting the trades (see iter_txns) and building the transaction frame (see Txns.frame)
+    for columnar trades.
+
+    :param trades: DataFrame or structured array with ts, qty, px and optional tid, fees fields. If tid is missing, the
+                   trades are numbered from 1.
+    :param pricer: provides the interface to get the premiums for arrays of quantities, prices, and timestamps.
+    :param pos: the position held prior to the first trade
+    :param open_val: the open value of the position held prior to the first trade
+    :param pid: the position id of the position held prior to the first trade
+    :return: DataFrame
+    """
+    if isinstance(trades, np.ndarray):
+        trades = pd.DataFrame(trades)
+    n = len(trades.index)
+    tids = trades['tid'].values if 'tid' in trades else np.arange(1, n + 1)
+    tss = pd.DatetimeIndex(trades['ts']).values
+    qtys = trades['qty'].values
+    pxs = trades['px'].values
+    fees = trades['fees'].values if 'fees' in trades else np.zeros(n)
+
+    # Split trades which cross zero into a closing and an opening trade to make accounting for long/short possible
+    pos0 = pos
+    pos = pos0 + qtys.cumsum()
+    prev = np.append(pos0, pos)[:-1]
+    cross = is_decrease(prev, qtys) & crosses_zero(prev, qtys)
+    if cross.any():
+        rows = np.repeat(np.arange(n), 1 + cross)
+        closing = np.append(True, rows[1:] != rows[:-1]) & cross[rows]
+        opening = np.append(False, rows[1:] == rows[:-1])
+        amts = -prev[rows]
+        ratios = np.abs(np.true_divide(amts, qtys[rows]))
+        tids, tss, pxs = tids[rows], tss[rows], pxs[rows]
+        qtys, fees, pos = qtys[rows], fees[rows], pos[rows]
+        qtys = np.where(closing, amts, np.where(opening, qtys - amts, qtys))
+        fees = np.where(closing, ratios * fees, np.where(opening, (1. - ratios) * fees, fees))
+        pos = np.where(closing, 0, pos)
+        prev = np.append(pos0, pos)[:-1]
+
+    opens = prev == 0
+    closes = ~opens & (prev + qtys == 0)
+    increases = ~opens & ~closes & is_increase(prev, qtys)
+    intents = np.select([opens, closes, increases], [Intent.Open, Intent.Close, Intent.Increase], Intent.Decrease)
+    buys = qtys > 0
+    actions = np.where(opens | increases, np.where(buys, Action.Buy, Action.SellShort),
+                       np.where(buys, Action.Cover, Action.Sell))
+    pids = pid + opens.cumsum()
+    premiums = np.asarray(pricer.get_premiums(qtys, pxs, tss=tss), dtype=float)
+
+    # Open value follows ov[i] = scale[i] * ov[i - 1] + add[i]: it is reset to the premium on open, grows by the premium
+    # on increase and is scaled by the remaining position on decrease. Within a position this is
+    # ov[i] = A[i] * sum(add[j] / A[j], j <= i) where A is the product of the scales since the open, computed as a
+    # cumulative sum of logs per position. A leading row carries the open value held prior to the first trade.
+    decreases = ~opens & ~closes & ~increases
+    scales = np.ones(len(qtys) + 1)
+    scales[1:][decreases] = np.true_divide(pos[decreases], prev[decreases])
+    adds = np.append(open_val, np.where(opens | increases, premiums, 0.))
+    segs = np.append(0, pids - pid)
+    acum = np.exp(pd.Series(np.log(scales)).groupby(segs).cumsum().values)
+    open_vals = acum * pd.Series(adds / acum).groupby(segs).cumsum().values
+    open_vals = open_vals[1:]
+    open_vals[closes] = 0.
+
+    data = OrderedDict()
+    data[TC.DT] = pd.DatetimeIndex(tss).to_period('B').to_timestamp()
+    data[TC.TS] = tss
+    data[TC.PID] = pids
+    data[TC.TID] = tids
+    data[TC.QTY] = qtys
+    data[TC.PX] = pxs
+    data[TC.FEES] = fees
+    data[TC.PREMIUM] = premiums
+    data[TC.OPEN_VAL] = open_vals
+    data[TC.POS] = pos
+    data[TC.INTENT] = intents
+    data[TC.ACTION] = actions
+    df = pd.DataFrame(data, columns=data.keys())
+    df.index.name = 'seq'
+    return df
+
+
 class Txns(object):
     def __init__(self, trades, pricer, ret_calc=None):
         """
         #TODO - rethink if user should split trades prior to calling this method...
-        :param trades: list of Trade objects
+        :param trades: list of Trade objects, TradeStore or columnar trades (see columnar_txn_frame)
         :param pricer:
         """
-        # split into l/s positions
-        self.trades = tuple(iter_txns(trades))
         self.pricer = pricer
         self._ret_calc = ret_calc or RoiiRetCalculator()
+        if isinstance(trades, TradeStore) and not trades.has_kwargs:
+            trades = trades.frame
+        if isinstance(trades, (pd.DataFrame, np.ndarray)):
+            self._frame = columnar_txn_frame(trades, pricer)
+        else:
+            # split into l/s positions
+            self._trades = tuple(iter_txns(trades))
 
     pids = property(lambda self: self.frame[TC.PID].unique())
     pl = lazy_property(lambda self: TxnProfitAndLoss(self), 'pl')
@@ -81,6 +173,13 @@ class Txns(object):
         if hasattr(self, '_performance'):
             delattr(self, '_performance')
 
+    @lazy_property
+    def trades(self):
+        """The split trades, only built on demand when constructed from columnar trades"""
+        frame = self.frame
+        cols = [frame[c].values for c in [TC.TID, TC.TS, TC.QTY, TC.PX, TC.FEES]]
+        return tuple(Trade(tid, ts, qty, px, fees) for tid, ts, qty, px, fees in zip(*cols))
+
     @lazy_property
     def frame(self):
         """Convert the trades to transaction level details necessary for long/short accouting.
@@ -89,10 +188,14 @@ class Txns(object):
         :param pricer: provides the interface to get premium for a specified quanity, price, and timestamp.
         :return:
         """
+        return self._build_frame(self.trades)
+
+    def _build_frame(self, trades, pos=0, open_val=0, pid=0, seq=0):
+        """Build the transaction frame for the trades, starting from the specified position, open value and position id.
+        The resulting index begins at seq."""
         rows = []
         pricer = self.pricer
-        pos = open_val = pid = 0
-        for txn in self.trades:
+        for txn in trades:
             # These values always get copied
             qty = txn.qty
             premium = pricer.get_premium(qty, txn.px, ts=txn.ts)
@@ -128,9 +231,57 @@ class Txns(object):
 
         df = pd.DataFrame.from_records(rows, columns=[TC.DT, TC.TS, TC.PID, TC.TID, TC.QTY, TC.PX, TC.FEES, TC.PREMIUM,
                                                       TC.OPEN_VAL, TC.POS, TC.INTENT, TC.ACTION])
+        if seq:
+            df.index = df.index + seq
         df.index.name = 'seq'
         return df
 
+    def extend(self, trades=None, pricer=None):
+        """Return a new Txns object with the trades appended and/or the pricer replaced by one with more recent market
+        data. The state of the last transaction (position, open value, position id) is carried forward, so only the new
+        trades are processed. If the profit and loss or performance of this object has already been computed, it is
+        extended rather than recomputed from the first trade.
+
+        :param trades: list of Trade objects, none of which occur before the last trade of this object
+        :param pricer: pricer to use in place of the current one, must agree with the current one on past dates
+        :return: Txns
+        """
+        frame = self.frame
+        if frame.empty:
+            pos = open_val = pid = 0
+        else:
+            last = frame.iloc[-1]
+            pos, open_val, pid = last[TC.POS], last[TC.OPEN_VAL], int(last[TC.PID])
+
+        trades = list(trades or [])
+        if trades and not frame.empty and trades[0].ts < frame[TC.TS].iloc[-1]:
+            raise ValueError('trades can only be appended, %s is prior to the last trade %s' % (trades[0].ts,
+                                                                                              frame[TC.TS].iloc[-1]))
+
+        result = Txns([], pricer or self.pricer, self.ret_calc)
+        if hasattr(self, '_trades'):
+            result._trades = self._trades + tuple(iter_txns(trades, pos=pos))
+        else:
+            # built from columnar trades, leave the trades to be built on demand from the frame
+            del result._trades
+
+        if trades:
+            cols = pd.DataFrame({'tid': [t.tid for t in trades], 'ts': [t.ts for t in trades],
+                                 'qty': [t.qty for t in trades], 'px': [t.px for t in trades],
+                                 'fees': [t.fees for t in trades]})
+            tail = columnar_txn_frame(cols, result.pricer, pos, open_val, pid)
+            tail.index = tail.index + len(frame.index)
+            tail.index.name = 'seq'
+            result._frame = tail if frame.empty else pd.concat([frame, tail])
+        else:
+            result._frame = frame
+
+        if hasattr(self, '_pl'):
+            result._pl = self._pl.extend(result)
+            if hasattr(self, '_performance'):
+                result._performance = self.ret_calc.extend(self._performance, self._pl, result)
+        return result
+
     def get_pid_txns(self, pid):
         pmask = self.frame[TC.PID] == pid
         assert len(pmask.index) == len(self.trades), 'assume 1-1 ratio of trade to row in frame'
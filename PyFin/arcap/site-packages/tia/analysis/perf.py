@@ -6,7 +6,7 @@ from collections import OrderedDict
 import pandas as pd
 import numpy as np
 
-from tia.analysis.util import per_series
+from tia.analysis.util import _pack, _unpack
 
 
 PER_YEAR_MAP = {
@@ -232,21 +232,55 @@ def drawdowns(returns, geometric=True):
     """
     wealth = 1. + returns_cumulative(returns, geometric=geometric, expanding=True)
     values = wealth.values
-    if values.ndim == 2:
-        ncols = values.shape[-1]
-        values = np.vstack(([1.] * ncols, values))
-        maxwealth = pd.expanding_max(values)[1:]
-        dds = wealth / maxwealth - 1.
-        dds[dds > 0] = 0  # Can happen if first returns are positive
-        return dds
-    elif values.ndim == 1:
-        values = np.hstack(([1.], values))
-        maxwealth = pd.expanding_max(values)[1:]
-        dds = wealth / maxwealth - 1.
-        dds[dds > 0] = 0  # Can happen if first returns are positive
-        return dds
-    else:
+    if values.ndim not in (1, 2):
         raise ValueError('unable to process array with %s dimensions' % values.ndim)
+    # high water mark of the wealth, which starts at 1 (NaNs are skipped)
+    maxwealth = np.fmax.accumulate(np.fmax(values, 1.), axis=0)
+    dds = wealth / maxwealth - 1.
+    dds[dds > 0] = 0  # Can happen if first returns are positive
+    return dds
+
+
+def _drawdown_episodes(dd):
+    """Find every drawdown episode, a run of non-zero drawdown values, down each column of the 2-D drawdown values
+    in a single pass. Return the arrays (col, start, trough, end, depth) with an item per episode ordered by column and
+    start. start, trough and end are row positions where end is the row the drawdown is recovered on (or the last
+    row) and depth is the minimum drawdown of the episode."""
+    nrows, ncols = dd.shape
+    flat = np.ascontiguousarray(np.asarray(dd, dtype=float).T).ravel()
+    inside = flat != 0
+    prev = np.append(False, inside[:-1])
+    prev[::nrows] = False
+    nxt = np.append(inside[1:], False)
+    nxt[nrows - 1::nrows] = False
+    firsts = np.flatnonzero(inside & ~prev)
+    lasts = np.flatnonzero(inside & ~nxt)
+    if not len(firsts):
+        empty = np.array([], dtype=int)
+        return empty, empty, empty, empty, np.array([], dtype=float)
+
+    depth = np.fmin.reduceat(np.append(flat, 0.), np.vstack((firsts, lasts + 1)).T.ravel())[::2]
+    # trough is the first occurrence of the depth in the episode (the start if the episode is all NaN)
+    episode = np.cumsum(inside & ~prev) - 1
+    hits = np.flatnonzero(inside & (flat == depth[episode]))
+    trough = firsts.copy()
+    hit_episodes, first_hit = np.unique(episode[hits], return_index=True)
+    trough[hit_episodes] = hits[first_hit]
+
+    col, start = np.divmod(firsts, nrows)
+    last = lasts % nrows
+    end = last + (last != nrows - 1)
+    return col, start, trough % nrows, end, depth
+
+
+def _max_episodes(col, depth, ncols):
+    """Return the index of the deepest (first if tied) episode of each column, -1 if the column has none"""
+    order = np.lexsort((np.arange(len(col)), depth, col))
+    cols, first = np.unique(col[order], return_index=True)
+    result = np.empty(ncols, dtype=int)
+    result.fill(-1)
+    result[cols] = order[first]
+    return result
 
 
 def max_drawdown(returns=None, geometric=True, dd=None, inc_date=False):
@@ -261,26 +295,35 @@ def max_drawdown(returns=None, geometric=True, dd=None, inc_date=False):
     if returns is not None:
         dd = drawdowns(returns, geometric=geometric)
 
+    values = dd.values if isinstance(dd, pd.DataFrame) else dd.values[:, None]
+    col, start, trough, end, depth = _drawdown_episodes(values)
+    imax = _max_episodes(col, depth, values.shape[1])
+    # a column without a drawdown has a max drawdown of 0 on the first date
+    mdds = np.where(imax >= 0, depth[imax] if len(depth) else 0., 0.)
+    dts = dd.index[np.where(imax >= 0, trough[imax] if len(trough) else 0, 0)]
+
     if isinstance(dd, pd.DataFrame):
-        vals = [max_drawdown(dd=dd[c], inc_date=inc_date) for c in dd.columns]
-        cols = ['maxxdd'] + (inc_date and ['maxdd_dt'] or [])
+        vals = list(zip(mdds, dts)) if inc_date else mdds
+        cols = ['maxdd'] + (inc_date and ['maxdd_dt'] or [])
         res = pd.DataFrame(vals, columns=cols, index=dd.columns)
         return res if inc_date else res.maxdd
     else:
-        mddidx = dd.idxmin()
-        # if mddidx == dd.index[0]:
-        # # no maxff
-        #    return 0 if not inc_date else (0, None)
-        #else:
-        sub = dd[:mddidx]
-        start = sub[::-1].idxmax()
-        mdd = dd[mddidx]
-        # return start, mddidx, mdd
-        return mdd if not inc_date else (mdd, mddidx)
-
-
-@per_series(result_is_frame=1)
-def drawdown_info(returns, geometric=True):
+        return mdds[0] if not inc_date else (mdds[0], dts[0])
+
+
+def _drawdown_days(tss, start, end):
+    """Whole days from the start to the end of each drawdown"""
+    return np.floor((tss[end] - tss[start]) / np.timedelta64(1, 'D'))
+
+
+def _drawdown_info_frame(index, start, trough, end, depth):
+    f = pd.DataFrame({'dd start': index[start], 'dd end': index[end], 'maxdd': depth, 'maxdd dt': index[trough]},
+                     columns=['dd start', 'dd end', 'maxdd', 'maxdd dt'])
+    f['days'] = _drawdown_days(index.values, start, end)
+    return f
+
+
+def drawdown_info(returns=None, geometric=True, dd=None):
     """Return a DataFrame containing information about ALL the drawdowns for the rets. The frame
     contains the columns:
     'dd start': drawdown start date
@@ -288,24 +331,46 @@ def drawdown_info(returns, geometric=True):
     'maxdd': maximium drawdown
     'maxdd dt': maximum drawdown
     'days': duration of drawdown
+
+    dd: drawdown Series or DataFrame (mutually exclusive with returns)
+    For a DataFrame the columns are (column, field) with a row per drawdown of the column.
     """
-    dd = drawdowns(returns, geometric=True).to_frame()
-    last = dd.index[-1]
-    dd.columns = ['vals']
-    dd['nonzero'] = (dd.vals != 0).astype(int)
-    dd['gid'] = (dd.nonzero.shift(1) != dd.nonzero).astype(int).cumsum()
-    idxname = dd.index.name or 'index'
-    ixs = dd.reset_index().groupby(['nonzero', 'gid'])[idxname].apply(lambda x: np.array(x))
-    rows = []
-    if 1 in ixs:
-        for ix in ixs[1]:
-            sub = dd.ix[ix]
-            # need to get t+1 since actually draw down ends on the 0 value
-            end = dd.index[dd.index.get_loc(sub.index[-1]) + (last != sub.index[-1] and 1 or 0)]
-            rows.append([sub.index[0], end, sub.vals.min(), sub.vals.idxmin()])
-    f = pd.DataFrame.from_records(rows, columns=['dd start', 'dd end', 'maxdd', 'maxdd dt'])
-    f['days'] = (f['dd end'] - f['dd start']).astype('timedelta64[D]')
-    return f
+    if (returns is None and dd is None) or (returns is not None and dd is not None):
+        raise ValueError('returns and drawdowns are mutually exclusive')
+
+    if returns is not None:
+        dd = drawdowns(returns, geometric=geometric)
+
+    if isinstance(dd, pd.Series):
+        return _drawdown_info_frame(dd.index, *_drawdown_episodes(dd.values[:, None])[1:])
+    elif not isinstance(dd, pd.DataFrame):
+        raise ValueError("Expected argument to be Series or DataFrame not %s" % type(dd))
+
+    col, start, trough, end, depth = _drawdown_episodes(dd.values)
+    ncols = len(dd.columns)
+    counts = np.bincount(col, minlength=ncols)
+    row = np.arange(len(col)) - np.append(0, np.cumsum(counts))[col]
+    nrows = counts.max() if ncols else 0
+    tss = dd.index.values
+    days = _drawdown_days(tss, start, end)
+    fields = [('dd start', tss[start]), ('dd end', tss[end]), ('maxdd', depth), ('maxdd dt', tss[trough]),
+              ('days', days)]
+    # a block per field with a row per drawdown, then interleave the columns as (column, field)
+    blocks = []
+    for name, vals in fields:
+        block = np.empty((nrows, ncols), dtype=vals.dtype)
+        block.fill(np.nan if vals.dtype.kind == 'f' else np.datetime64('NaT'))
+        block[row, col] = vals
+        blocks.append(pd.DataFrame(block, columns=dd.columns))
+    perm = (np.arange(len(fields)) * ncols + np.arange(ncols)[:, None]).ravel()
+    res = pd.concat(blocks, axis=1).iloc[:, perm]
+    if dd.columns.nlevels == 1:
+        arrs = [np.repeat(np.asarray(dd.columns, dtype=object), len(fields))]
+    else:
+        arrs = [np.repeat(dd.columns.get_level_values(i), len(fields)) for i in range(dd.columns.nlevels)]
+    arrs.append([name for name, _ in fields] * ncols)
+    res.columns = pd.MultiIndex.from_arrays(arrs)
+    return res
 
 
 def std_annualized(returns, scale=None, expanding=0):
@@ -412,38 +477,89 @@ def upside_potential_ratio(rets, mar=0, full=0, expanding=0):
             return pd.Series(vals)
 
 
-@per_series()
-def rolling_percentileofscore(series, window, min_periods=None):
-    """Computue the score percentile for the specified window."""
-    import scipy.stats as stats
-
-    def _percentile(arr):
-        score = arr[-1]
-        vals = arr[:-1]
-        return stats.percentileofscore(vals, score)
-
-    notnull = series.dropna()
-    min_periods = min_periods or window
-    if notnull.empty:
-        return pd.Series(np.nan, index=series.index)
+def _prior_rank_counts(packed, counts, window=None):
+    """For each row of the packed 2-D values (see _pack) return the number of the prior values in its column which
+    are less than, and less than or equal to, the row value. Only the window - 1 prior values are counted if window
+    is given. A binary indexed tree over the column ranks is updated for every column at once, so each row costs
+    O(log n) per column."""
+    nrows, ncols = packed.shape
+    cols = np.arange(ncols)
+    rows = np.arange(nrows)[:, None]
+    # rank of each value among its column as the count of values less than (lo) or less than or equal (hi) to it
+    order = np.argsort(packed, axis=0, kind='mergesort')
+    svals = packed[order, cols]
+    first = np.ones(packed.shape, dtype=bool)
+    first[1:] = svals[1:] != svals[:-1]
+    last = np.ones(packed.shape, dtype=bool)
+    last[:-1] = first[1:]
+    lo = np.empty(packed.shape, dtype=np.int64)
+    hi = np.empty(packed.shape, dtype=np.int64)
+    lo[order, cols] = np.maximum.accumulate(np.where(first, rows, 0), axis=0)
+    hi[order, cols] = np.minimum.accumulate(np.where(last, rows, nrows)[::-1], axis=0)[::-1] + 1
+
+    # tree nodes 1..nrows are read, updates past nrows are parked on the last node
+    nbits = (nrows + 1).bit_length()
+    width = 1 << nbits
+    tree = np.zeros(width * ncols, dtype=np.int64)
+
+    def _update(idx, delta):
+        for _ in range(nbits + 1):
+            tree[idx * ncols + cols] += delta
+            idx = np.minimum(idx + (idx & -idx), width - 1)
+
+    less = np.zeros(packed.shape, dtype=np.int64)
+    less_eq = np.zeros(packed.shape, dtype=np.int64)
+    qcols = np.concatenate([cols, cols])
+    for i in range(nrows):
+        if window and i >= window:
+            out = i - window
+            _update(lo[out] + 1, -(out < counts).astype(np.int64))
+        idx = np.concatenate([lo[i], hi[i]])
+        total = np.zeros(2 * ncols, dtype=np.int64)
+        for _ in range(nbits):
+            total += tree[idx * ncols + qcols]
+            idx -= idx & -idx
+        less[i], less_eq[i] = total[:ncols], total[ncols:]
+        _update(lo[i] + 1, (i < counts).astype(np.int64))
+    return less, less_eq
+
+
+def _percentileofscore(arg, window, min_periods):
+    """scipy.stats.percentileofscore (kind='rank') of each value against the prior window - 1 values of its column
+    (all prior values if window is None), NaNs are skipped."""
+    if isinstance(arg, pd.Series):
+        values = arg.values.astype(float)[:, None]
+    elif isinstance(arg, pd.DataFrame):
+        values = arg.values.astype(float)
     else:
-        return pd.rolling_apply(notnull, window, _percentile, min_periods=min_periods).reindex(series.index)
+        raise ValueError("Expected argument to be Series or DataFrame not %s" % type(arg))
+
+    packed, order, counts = _pack(values)
+    less, less_eq = _prior_rank_counts(packed, counts, window)
+    nprior = np.arange(len(packed), dtype=float)
+    nobs = nprior + 1
+    if window:
+        nprior = np.minimum(nprior, window - 1)
+        nobs = np.minimum(nobs, window)
+    nprior = nprior[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = (less + less_eq + (less_eq > less)) * 50. / nprior
+    pct[(nprior == 0) | (nobs < min_periods)[:, None] | np.isnan(packed)] = np.nan
+    result = _unpack(pct, order, counts)
+
+    if isinstance(arg, pd.Series):
+        return pd.Series(result[:, 0], index=arg.index)
+    else:
+        return pd.DataFrame(result, index=arg.index, columns=arg.columns)
 
 
-@per_series()
-def expanding_percentileofscore(series, min_periods=None):
-    import scipy.stats as stats
+def rolling_percentileofscore(series, window, min_periods=None):
+    """Computue the score percentile for the specified window."""
+    return _percentileofscore(series, window, min_periods or window)
 
-    def _percentile(arr):
-        score = arr[-1]
-        vals = arr[:-1]
-        return stats.percentileofscore(vals, score)
 
-    notnull = series.dropna()
-    if notnull.empty:
-        return pd.Series(np.nan, index=series.index)
-    else:
-        return pd.expanding_apply(notnull, _percentile, min_periods=min_periods).reindex(series.index)
+def expanding_percentileofscore(series, min_periods=None):
+    return _percentileofscore(series, None, min_periods or 1)
 
 
 def hurst_exponent(px, lags=range(2, 100)):
@@ -464,58 +580,110 @@ def hurst_exponent(px, lags=range(2, 100)):
     return poly[0] * 2.0
 
 
+def _summary_stats(rets, bins, ret_method, ppy):
+    """Summary statistics down each column of the 2-D period returns (sorted by date). If bins is not None, the
+    returns are first rolled up into the periods starting at the row positions in bins. Return the list of stat
+    arrays (avg, cum, stdev, stdev_ann, sharpe_ann, sortino, maxdd, maxdd row position). As with sortino_ratio, the
+    sortino is NaN when there are no negative returns as the downside deviation is then 0 / 0."""
+    valid = ~np.isnan(rets)
+    if bins is None:
+        resampled = rets
+    else:
+        cnt = np.add.reduceat(valid.astype(int), bins, axis=0)
+        if ret_method == 'simple':
+            rolled = np.add.reduceat(np.where(valid, rets, 0.), bins, axis=0)
+        elif ret_method == 'compound':
+            rolled = np.multiply.reduceat(np.where(valid, 1. + rets, 1.), bins, axis=0) - 1.
+        else:
+            raise Exception('ret_method must be on of [simple, compound]')
+        resampled = np.where(cnt > 0, rolled, np.nan)
+
+    ok = ~np.isnan(resampled)
+    n = ok.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg = np.where(ok, resampled, 0.).sum(axis=0) / n
+        std = np.sqrt((np.where(ok, resampled - avg, 0.) ** 2).sum(axis=0) / (n - 1))
+        growth = np.where(ok, 1. + resampled, 1.).prod(axis=0)
+        std_ann = np.sqrt(ppy) * std
+        sharpe = ppy * avg / std_ann
+        below = ok & (resampled < 0)
+        downside = np.sqrt(np.where(below, resampled ** 2, 0.).sum(axis=0) / below.sum(axis=0)) * np.sqrt(ppy)
+        sortino = (growth ** (ppy / n) - 1.) / downside
+
+        # max drawdown of the (un-resampled) returns, see drawdowns
+        wealth = 1. + (np.where(valid, 1. + rets, 1.).cumprod(axis=0) - 1.)
+        dd = wealth / np.fmax.accumulate(np.fmax(wealth, 1.), axis=0) - 1.
+    dd[dd > 0] = 0
+    dd[~valid] = np.nan
+    maxdd = np.fmin.reduce(dd, axis=0)
+    maxdd_pos = np.argmax(dd == maxdd, axis=0)
+
+    stats = [avg, growth - 1., std, std_ann, sharpe, sortino, maxdd]
+    for stat in stats:
+        stat[n == 0] = np.nan
+    return stats + [maxdd_pos]
+
+
 def summarize_returns(period_rets, rollup='M', prefix=1, ret_method='compound', yearly=1, ltd=1):
+    """Summarize the period returns for each year and life to date (LTD), rolled up to the rollup frequency.
+    A DataFrame is summarized in a single pass over all the columns and the result is indexed by
+    (period, column)."""
     # TODO - should be able to handle DateTimeIndex
     if not isinstance(period_rets.index, pd.PeriodIndex):
         raise Exception('expected periodic return series')
 
-    def _analyze(rets):
-        rets = rets.dropna()
-        if rollup != rets.index.freqstr:
-            if ret_method == 'simple':
-                resampled = rets.resample(rollup, 'sum')
-            elif ret_method == 'compound':
-                resampled = (1. + rets).resample(rollup, 'prod') - 1.
-            else:
-                raise Exception('ret_method must be on of [simple, compound]')
-        else:
-            resampled = rets
-
-        rfreq = rollup.lower().replace('b', 'd')
-        pfreq = period_rets.index.freqstr.lower().replace('b', 'd')
-        fmap = {'d': 'daily', 'm': 'monthly', 'w': 'weekly', 'q': 'quarterly'}
-        rfreq = fmap.get(rfreq, pfreq)
-        pfreq = fmap.get(pfreq, pfreq)
-
-        pds_per_yr = periodicity(resampled)
-        d = OrderedDict()
-        d['{0}_ret_avg'.format(rfreq)] = ret_avg = resampled.mean()
-        d['{0}_ret_cum'.format(rfreq)] = returns_cumulative(resampled)
-        d['{0}_stdev'.format(rfreq)] = resampled.std()
-        d['{0}_stdev_ann'.format(rfreq)] = std_ann = std_annualized(resampled)
-        d['{0}_sharpe_ann'.format(rfreq)] = pds_per_yr * ret_avg / std_ann
-        d['{0}_sortino'.format(rfreq)] = sortino_ratio(resampled, full=0)
-        mdd = max_drawdown(rets, inc_date=1)
-        d['{0}_maxdd'.format(pfreq)] = mdd[0]
-        d['{0}_maxdd_dt'.format(pfreq)] = mdd[1]
-        return d
-
-    if isinstance(period_rets, pd.DataFrame):
-        # Multi-indexed data frame needed to show multiple rows per year
-        arr = []
-        for c in period_rets:
-            res = summarize_returns(period_rets[c], rollup=rollup, yearly=yearly, ltd=ltd)
-            names = list(res.index.names)
-            names.append(period_rets.index.name)
-            res.index = pd.MultiIndex.from_arrays([res.index, [c] * len(res.index)], names=names)
-            arr.append(res)
-        return pd.concat(arr).sortlevel()
+    rfreq = rollup.lower().replace('b', 'd')
+    pfreq = period_rets.index.freqstr.lower().replace('b', 'd')
+    fmap = {'d': 'daily', 'm': 'monthly', 'w': 'weekly', 'q': 'quarterly'}
+    rfreq = fmap.get(rfreq, pfreq)
+    pfreq = fmap.get(pfreq, pfreq)
+    names = ['{0}_ret_avg'.format(rfreq), '{0}_ret_cum'.format(rfreq), '{0}_stdev'.format(rfreq),
+             '{0}_stdev_ann'.format(rfreq), '{0}_sharpe_ann'.format(rfreq), '{0}_sortino'.format(rfreq),
+             '{0}_maxdd'.format(pfreq), '{0}_maxdd_dt'.format(pfreq)]
+
+    is_frame = isinstance(period_rets, pd.DataFrame)
+    frame = period_rets if is_frame else period_rets.to_frame()
+    order = np.argsort(frame.index.asi8, kind='mergesort')
+    index = frame.index[order]
+    # columns in label order, as the per column summaries were sorted by (period, column)
+    corder = np.argsort(np.asarray(frame.columns, dtype=object), kind='mergesort') if is_frame else [0]
+    values = np.asarray(frame.values, dtype=float)[order][:, corder]
+
+    resample = rollup != period_rets.index.freqstr
+    ppy = periodicity(index.asfreq(rollup).freq if resample else index.freq)
+    rkeys = index.asfreq(rollup).asi8 if resample else None
+    years = np.asarray(index.year)
+
+    def _bins(sl):
+        # row positions where a new rollup period starts
+        if resample:
+            keys = rkeys[sl]
+            return np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+
+    blocks = []
+    if yearly and len(years):
+        starts = np.flatnonzero(np.append(True, years[1:] != years[:-1]))
+        # roll up within each year so that periods spanning the year end are split
+        for start, end in zip(starts, np.append(starts[1:], len(years))):
+            blocks.append((years[start], slice(start, end), _bins(slice(start, end))))
+    if ltd:
+        blocks.append(('LTD', slice(None), _bins(slice(None))))
+
+    periods, data = [], [[] for _ in names]
+    for period, sl, bins in blocks:
+        block = values[sl]
+        stats = _summary_stats(block, bins, ret_method, ppy)
+        dts = index[sl][stats[-1]]
+        stats[-1] = [None if mdd != mdd else dt for mdd, dt in zip(stats[-2], dts)]
+        periods.append(period)
+        for vals, stat in zip(data, stats):
+            vals.extend(stat)
+
+    ncols = values.shape[1]
+    if is_frame:
+        cols = np.asarray(frame.columns, dtype=object)[corder]
+        idx = pd.MultiIndex.from_arrays([np.repeat(np.asarray(periods, dtype=object), ncols),
+                                         np.tile(cols, len(periods))], names=['period', period_rets.index.name])
     else:
-        arrs = []
-        if yearly:
-            arrs.append(period_rets.groupby(lambda k: k.year).apply(lambda tmp: _analyze(tmp.sort_index())).unstack(1))
-        if ltd:
-            arrs.append(pd.DataFrame(_analyze(period_rets), index=['LTD']))
-        summary = pd.concat(arrs)
-        summary.index.name = 'period'
-        return summary
+        idx = pd.Index(periods, name='period')
+    return pd.DataFrame(OrderedDict(zip(names, data)), index=idx, columns=names)
@@ -0,0 +1,316 @@
+"""
+Streaming counterparts of the tia.analysis.ta indicators for live or replayed bar feeds.
+
+Each indicator is updated one bar at a time with update(bar) in constant time and, once warmed up, produces the same
+values as the batch function over the full history. snapshot() returns a copy of the state which restore() puts back,
+so a feed can be checkpointed or rewound without replaying history.
+"""
+import copy
+import math
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+
+__all__ = ['StreamingIndicator', 'Sma', 'Ema', 'WilderMa', 'Macd', 'Rsi', 'TrueRange', 'Dmi', 'CrossSignal',
+           'replay']
+
+
+def _div(a, b):
+    """Divide as numpy does for arrays: x / 0 is +/-inf and 0 / 0 is NaN"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.float64(a) / np.float64(b)
+
+
+class StreamingIndicator(object):
+    # names of the outputs when update returns a tuple
+    columns = None
+
+    def update(self, bar):
+        raise NotImplementedError('update must be implemented by the indicator')
+
+    def snapshot(self):
+        """Return a copy of the indicator state which can be passed to restore"""
+        return copy.deepcopy(self.__dict__)
+
+    def restore(self, state):
+        self.__dict__.clear()
+        self.__dict__.update(copy.deepcopy(state))
+
+
+class Sma(StreamingIndicator):
+    """Streaming ta.sma. If n is 0 then the ltd mean is computed."""
+
+    def __init__(self, n):
+        self.n = int(n)
+        self.window = deque()
+        self.total = 0.
+        self.nobs = 0
+        self.nneg = 0
+        self.value = np.nan
+
+    def _add(self, x, sign):
+        if x == x:
+            self.total += sign * x
+            self.nobs += sign
+            if math.copysign(1., x) < 0:
+                self.nneg += sign
+
+    def update(self, x):
+        x = float(x)
+        self._add(x, 1)
+        if self.n:
+            self.window.append(x)
+            if len(self.window) > self.n:
+                self._add(self.window.popleft(), -1)
+
+        value = np.nan
+        if self.nobs and self.nobs >= self.n:
+            value = self.total / self.nobs
+            # running sums can leave a tiny residual of the wrong sign
+            if self.nneg == 0 and value < 0:
+                value = 0.
+            elif self.nneg == self.nobs and value > 0:
+                value = 0.
+        self.value = value
+        return value
+
+
+class Ema(StreamingIndicator):
+    """Streaming ta.ema, the adjusted exponentially weighted mean with a span of n"""
+
+    def __init__(self, n):
+        if n == 0:
+            raise ValueError('ema with n=0 uses the full history length as the span and cannot be streamed')
+        self.n = n
+        com = (n - 1) / 2.
+        self.decay = 1. - 1. / (1. + com)
+        self.avg = np.nan
+        self.old_wt = 1.
+        self.nobs = 0
+        self.value = np.nan
+
+    def update(self, x):
+        x = float(x)
+        is_obs = x == x
+        self.nobs += is_obs
+        if self.avg == self.avg:
+            # missing values still decay the weight of prior observations
+            self.old_wt *= self.decay
+            if is_obs:
+                if self.avg != x:
+                    self.avg = ((self.old_wt * self.avg) + x) / (self.old_wt + 1.)
+                self.old_wt += 1.
+        elif is_obs:
+            self.avg = x
+        self.value = self.avg if self.nobs >= self.n else np.nan
+        return self.value
+
+
+class WilderMa(StreamingIndicator):
+    """Streaming ta.wilderma. Missing values are skipped."""
+
+    def __init__(self, n):
+        self.n = n
+        self.pm = 1. / n
+        self.wm = 1. - self.pm
+        self.seed = []
+        self.value = np.nan
+
+    def update(self, x):
+        x = float(x)
+        if x != x:
+            return np.nan
+        if self.seed is not None:
+            self.seed.append(x)
+            if len(self.seed) < self.n:
+                return np.nan
+            self.value = np.array(self.seed).mean()
+            self.seed = None
+        else:
+            self.value = self.pm * x + self.wm * self.value
+        return self.value
+
+
+class Macd(StreamingIndicator):
+    """Streaming ta.macd"""
+    columns = ['MACD_FAST', 'MACD_SLOW', 'MACD', 'MACD_SIGNAL', 'MACD_HIST']
+
+    def __init__(self, nslow=26, nfast=12, nsignal=9):
+        self.fast = Ema(int(nfast))
+        self.slow = Ema(int(nslow))
+        self.signal = Ema(int(nsignal))
+
+    def update(self, x):
+        emafast = self.fast.update(x)
+        emaslow = self.slow.update(x)
+        line = emafast - emaslow
+        signal = self.signal.update(line)
+        return emafast, emaslow, line, signal, line - signal
+
+
+class Rsi(StreamingIndicator):
+    """Streaming ta.rsi. Missing values are skipped."""
+
+    def __init__(self, n):
+        n = int(n)
+        self.last = np.nan
+        self.gain = WilderMa(n)
+        self.loss = WilderMa(n)
+
+    def update(self, x):
+        x = float(x)
+        if x != x:
+            return np.nan
+        change = x - self.last
+        self.last = x
+        avg_gain = self.gain.update(change if change > 0 else 0.)
+        avg_loss = self.loss.update(abs(change) if change < 0 else 0.)
+        rs = _div(avg_gain, avg_loss)
+        if rs == np.inf:
+            rs = 100.  # divide by zero
+        return 100. - (100. / (1. + rs))
+
+
+class TrueRange(StreamingIndicator):
+    """Streaming ta.true_range, each bar is a mapping with the high, low and close columns"""
+
+    def __init__(self, high_col='high', low_col='low', close_col='close', skipna=0):
+        self.high_col = high_col
+        self.low_col = low_col
+        self.close_col = close_col
+        self.skipna = skipna
+        self.yclose = np.nan
+
+    def update(self, bar):
+        high, low = float(bar[self.high_col]), float(bar[self.low_col])
+        yclose = self.yclose
+        self.yclose = float(bar[self.close_col])
+        if yclose != yclose:
+            mx, mn = (high, low) if self.skipna else (np.nan, np.nan)
+        elif self.skipna:
+            mx = yclose if high != high else max(high, yclose)
+            mn = yclose if low != low else min(low, yclose)
+        else:
+            mx = np.nan if high != high else max(high, yclose)
+            mn = np.nan if low != low else min(low, yclose)
+        return mx - mn
+
+
+class Dmi(StreamingIndicator):
+    """Streaming ta.dmi, each bar is a mapping with the high, low and close columns"""
+    columns = ['DI+', 'DI-', 'DX', 'ADX']
+
+    def __init__(self, n, high_col='high', low_col='low', close_col='close'):
+        self.high_col = high_col
+        self.low_col = low_col
+        self.tr = TrueRange(high_col, low_col, close_col)
+        self.atr = WilderMa(n)
+        self.up = WilderMa(n)
+        self.dn = WilderMa(n)
+        self.adx = WilderMa(n)
+        self.yhigh = np.nan
+        self.ylow = np.nan
+
+    def update(self, bar):
+        high, low = float(bar[self.high_col]), float(bar[self.low_col])
+        up_mv = high - self.yhigh
+        dn_mv = -1 * (low - self.ylow)
+        self.yhigh, self.ylow = high, low
+        if not (up_mv > 0 and up_mv > dn_mv):
+            up_mv = 0.
+        if not (dn_mv > 0 and dn_mv > up_mv):
+            dn_mv = 0.
+
+        atr = self.atr.update(self.tr.update(bar))
+        di_pos = _div(100. * self.up.update(up_mv), atr)
+        di_neg = _div(100. * self.dn.update(dn_mv), atr)
+        dx = _div(100. * np.abs(di_pos - di_neg), di_pos + di_neg)
+        return di_pos, di_neg, dx, self.adx.update(dx)
+
+
+class CrossSignal(StreamingIndicator):
+    """Streaming ta.cross_signal.
+
+    s1, s2: bar key, number, tuple of numbers (constant lower and upper bound) or list of bar keys (band between the
+            min and max of the values)
+    continuous: bool, if true then once the signal starts it is always 1 or -1. The signal starts once both s1 and s2
+                have had a value.
+    """
+
+    def __init__(self, s1, s2, continuous=0):
+        self.s1 = s1
+        self.s2 = s2
+        self.continuous = continuous
+        # forward filled lower1, upper1, lower2, upper2
+        self.bounds = [np.nan] * 4
+        self.nbars = 0
+        self.started = 0
+        self.last_upper = np.nan
+        self.last = np.nan
+
+    @staticmethod
+    def _bounds(src, bar):
+        if isinstance(src, (int, long, float)):
+            return float(src), float(src)
+        elif isinstance(src, (tuple, list)):
+            if all(isinstance(v, (int, long, float)) for v in src):
+                return float(min(src)), float(max(src))
+            vals = [float(bar[k]) for k in src]
+            if any(v != v for v in vals):
+                return np.nan, np.nan
+            return min(vals), max(vals)
+        else:
+            val = float(bar[src])
+            return val, val
+
+    def update(self, bar):
+        current = self._bounds(self.s1, bar) + self._bounds(self.s2, bar)
+        self.bounds = [cur if cur == cur else prev for cur, prev in zip(current, self.bounds)]
+        lower1, upper1, lower2, upper2 = self.bounds
+
+        signal = np.nan
+        if upper1 > upper2:
+            signal = 1.
+        if lower1 < lower2:
+            signal = -1.
+
+        if self.continuous:
+            if signal != signal:
+                signal = self.last
+            if not self.started and upper1 == upper1 and upper2 == upper2:
+                self.started = 1
+                if signal != signal:
+                    signal = 0.
+            self.last = signal
+        else:
+            if upper1 < upper2 and lower1 > lower2:
+                signal = 0.
+            # equal values take the prior signal, the upper equality is resolved before the lower equality
+            if self.nbars and upper1 == upper2:
+                ps = self.last_upper
+                signal = ps if (upper2 == lower2 or ps == 1.) else 0.
+            self.last_upper = signal
+            if self.nbars and lower1 == lower2:
+                ps = self.last
+                signal = ps if (upper2 == lower2 or ps == -1.) else 0.
+            self.last = signal
+        self.nbars += 1
+        return signal
+
+
+def replay(indicator, arg):
+    """Feed each value (Series) or row (DataFrame) of arg to the indicator and return the outputs indexed like arg"""
+    if isinstance(arg, pd.DataFrame):
+        cols = list(arg.columns)
+        values = [indicator.update(dict(zip(cols, row))) for row in zip(*[arg[c].values for c in cols])]
+    elif isinstance(arg, pd.Series):
+        values = [indicator.update(x) for x in arg.values]
+    else:
+        raise ValueError("Expected argument to be Series or DataFrame not %s" % type(arg))
+
+    if indicator.columns:
+        return pd.DataFrame(values, index=arg.index, columns=indicator.columns)
+    else:
+        return pd.Series(values, index=arg.index, dtype=float)
@@ -0,0 +1,173 @@
+"""
+Parameter sweeps of signal driven backtests over a universe of instruments.
+
+Each (instrument, parameters) run is evaluated in a process pool. The instrument price frames are copied once into
+shared memory before the pool starts so workers read them in place rather than having them pickled with every task;
+a task is only the (sid, parameter index) pair. Workers get a copy of each instrument without its prices, to which the
+shared frame is reattached, so instrument subclasses price the same as they do in process.
+"""
+import copy
+import ctypes
+import itertools
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+import pandas as pd
+
+from tia.analysis.model.ins import Instrument
+from tia.analysis.model.port import SingleAssetPortfolio, PortfolioSummary
+from tia.analysis.ta import Signal
+
+
+__all__ = ['param_grid', 'SharedPrices', 'run_signal', 'sweep']
+
+
+def param_grid(**params):
+    """Return the list of parameter dicts for the cartesian product of the parameter values.
+    param_grid(fast=[12, 20], slow=[26, 50]) -> [{'fast': 12, 'slow': 26}, {'fast': 12, 'slow': 50}, ...]
+    """
+    names = sorted(params.keys())
+    return [dict(zip(names, vals)) for vals in itertools.product(*[params[name] for name in names])]
+
+
+class SharedPrices(object):
+    """Numeric price frame held in shared memory so that pool workers can read it without it being pickled"""
+
+    def __init__(self, frame):
+        values = np.asarray(frame.values, dtype=float)
+        self.columns = list(frame.columns)
+        self.shape = values.shape
+        self.index_name = frame.index.name
+        self._values = RawArray(ctypes.c_double, int(values.size))
+        self._index = RawArray(ctypes.c_int64, len(frame.index))
+        np.frombuffer(self._values, dtype=float)[:] = values.ravel()
+        tss = np.asarray(frame.index.values, dtype='M8[ns]')
+        np.frombuffer(self._index, dtype=np.int64)[:] = tss.view(np.int64)
+
+    @property
+    def frame(self):
+        values = np.frombuffer(self._values, dtype=float).reshape(self.shape)
+        index = pd.DatetimeIndex(np.frombuffer(self._index, dtype=np.int64).view('M8[ns]'), name=self.index_name)
+        return pd.DataFrame(values, index=index, columns=self.columns)
+
+
+def run_signal(ins, signal_fct, params, trade='close_to_close', summary_fct=None, ret_calc=None):
+    """Run a single backtest of the signal generated by signal_fct(ins.pxs.frame, **params) and summarize it.
+
+    :param ins: Instrument
+    :param signal_fct: function(price frame, **params) which returns a signal Series or a Signal
+    :param params: dict of keyword arguments for signal_fct
+    :param trade: {'close_to_close', 'open_to_close'}
+    :param summary_fct: function(port) which returns a Series, defaults to PortfolioSummary.analyze_returns
+    :param ret_calc: RetCalculator to use for the portfolio
+    :return: Series
+    """
+    summary_fct = summary_fct or PortfolioSummary.analyze_returns
+    pxs = ins.pxs
+    sig = signal_fct(pxs.frame, **params)
+    sig = sig if isinstance(sig, Signal) else Signal(sig)
+    if trade == 'close_to_close':
+        trds = sig.close_to_close(pxs.close, as_store=1)
+    elif trade == 'open_to_close':
+        trds = sig.open_to_close(pxs.open, pxs.close, as_store=1)
+    else:
+        raise ValueError('trade must be one of close_to_close, open_to_close not %s' % trade)
+    port = SingleAssetPortfolio(ins, trds, ret_calc=ret_calc)
+    return summary_fct(port)
+
+
+# state of the current (worker) process, set once by _init_worker
+_WORKER = {}
+
+
+def _init_worker(shared, instruments, signal_fct, params, trade, summary_fct, ret_calc):
+    _WORKER.clear()
+    _WORKER.update(shared=shared, instruments=dict(instruments or {}), signal_fct=signal_fct, params=params,
+                   trade=trade, summary_fct=summary_fct, ret_calc=ret_calc)
+
+
+def _share_instrument(ins):
+    """Return the (SharedPrices, instrument without prices) pair used to rebuild the instrument in a worker"""
+    pxs = copy.copy(ins.pxs)
+    pxs.frame = None
+    template = copy.copy(ins)
+    template.pxs = pxs
+    return SharedPrices(ins.pxs.frame), template
+
+
+def _get_instrument(sid):
+    instruments = _WORKER['instruments']
+    if sid not in instruments:
+        shared, ins = _WORKER['shared'][sid]
+        ins.pxs.frame = shared.frame
+        instruments[sid] = ins
+    return instruments[sid]
+
+
+def _run_task(task):
+    sid, pidx = task
+    ins = _get_instrument(sid)
+    res = run_signal(ins, _WORKER['signal_fct'], _WORKER['params'][pidx], trade=_WORKER['trade'],
+                     summary_fct=_WORKER['summary_fct'], ret_calc=_WORKER['ret_calc'])
+    return sid, pidx, res
+
+
+def _iter_instruments(instruments):
+    if isinstance(instruments, Instrument):
+        yield instruments.sid, instruments
+    elif hasattr(instruments, 'iteritems'):
+        for sid, ins in instruments.iteritems():
+            yield sid, ins
+    else:
+        for ins in instruments:
+            yield ins.sid, ins
+
+
+def sweep(instruments, signal_fct, params, trade='close_to_close', summary_fct=None, ret_calc=None, processes=None,
+          chunksize=1):
+    """Backtest the signal for every combination of instrument and parameters.
+
+    :param instruments: Instrument, Instruments, list of Instrument or dict of sid to Instrument
+    :param signal_fct: function(price frame, **params) which returns a signal Series or a Signal. Must be defined at
+                       module level when the pool has to pickle it.
+    :param params: list of parameter dicts (see param_grid) or dict of parameter name to list of values
+    :param trade: {'close_to_close', 'open_to_close'}
+    :param summary_fct: function(port) which returns a Series, defaults to PortfolioSummary.analyze_returns
+    :param ret_calc: RetCalculator to use for each portfolio
+    :param processes: number of worker processes, None for the cpu count and 0 to run in the current process
+    :param chunksize: number of tasks sent to a worker at a time
+    :return: DataFrame with a row per (sid, parameters) and a column per summary field
+    """
+    if isinstance(params, dict):
+        params = param_grid(**params)
+    params = list(params)
+    names = []
+    for p in params:
+        names.extend(k for k in sorted(p.keys()) if k not in names)
+
+    instruments = list(_iter_instruments(instruments))
+    tasks = [(sid, pidx) for sid, _ in instruments for pidx in range(len(params))]
+    if processes == 0:
+        _init_worker(None, instruments, signal_fct, params, trade, summary_fct, ret_calc)
+        results = [_run_task(task) for task in tasks]
+    else:
+        shared = dict((sid, _share_instrument(ins)) for sid, ins in instruments)
+        pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                    initargs=(shared, None, signal_fct, params, trade, summary_fct, ret_calc))
+        try:
+            results = list(pool.imap_unordered(_run_task, tasks, chunksize=chunksize))
+        finally:
+            pool.close()
+            pool.join()
+
+    if not results:
+        return pd.DataFrame()
+
+    # results arrive in completion order, put them back in (instrument, parameter) order
+    order = dict((task, i) for i, task in enumerate(tasks))
+    results.sort(key=lambda r: order[(r[0], r[1])])
+    keys = [(sid,) + tuple(params[pidx].get(name) for name in names) for sid, pidx, _ in results]
+    frame = pd.concat([r[2] for r in results], axis=1, keys=range(len(results))).T
+    frame.index = pd.MultiIndex.from_tuples(keys, names=['sid'] + names)
+    return frame
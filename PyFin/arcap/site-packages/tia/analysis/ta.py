@@ -1,15 +1,15 @@
 import pandas as pd
 import numpy as np
 
-from tia.analysis.model.trd import TradeBlotter
-from tia.analysis.util import per_level, per_series
+from tia.analysis.model.trd import Trade, TradeStore
+from tia.analysis.util import per_level, per_series, _pack, _unpack
 
 
 __all__ = ['per_level', 'per_series', 'sma', 'ema', 'wilderma', 'ma', 'macd', 'rsi', 'true_range', 'dmi',
-           'cross_signal', 'Signal']
+           'rolling_argmax', 'rolling_argmin', 'cross_signal', 'cross_signals', 'IndicatorPipeline', 'Signal']
 
 
-@per_series()
+@per_series(array_capable=1)
 def sma(arg, n):
     """ If n is 0 then return the ltd mean; else return the n day mean """
     if n == 0:
@@ -18,7 +18,7 @@ def sma(arg, n):
         return pd.rolling_mean(arg, n, min_periods=n)
 
 
-@per_series()
+@per_series(array_capable=1)
 def ema(arg, n):
     if n == 0:
         return pd.ewma(arg, span=len(arg), min_periods=1)
@@ -26,24 +26,54 @@ def ema(arg, n):
         return pd.ewma(arg, span=n, min_periods=n)
 
 
-@per_series()
-def wilderma(arg, n):
-    converted = arg.dropna()
-    values = converted.values
+def _wilder_smooth(values, n):
+    """Wilder smoothing down each column of the packed 2-D values: the mean of the first n values followed by
+    result[i] = values[i] / n + (1 - 1 / n) * result[i - 1]. A NaN in the first n values makes the column NaN."""
+    nrows = len(values)
+    result = np.empty(values.shape)
+    result.fill(np.nan)
+    if nrows < n:
+        return result
+    pm = 1. / n
+    wm = 1. - pm
+    # contiguous rows so the mean is summed the same way as for a 1-D array
+    result[n - 1] = np.ascontiguousarray(values[:n].T).mean(axis=1)
+    if nrows > n:
+        try:
+            from scipy.signal import lfilter
+        except ImportError:
+            lfilter = None
+
+        rest = values[n:]
+        # the filter carries the state as 0 * x + wm * y which differs from the recursion for infinite values
+        if lfilter is not None and not np.isinf(rest).any():
+            # filter along contiguous rows of the transpose
+            zi = (wm * result[n - 1])[:, None]
+            result[n:] = lfilter([pm], [1., -wm], np.ascontiguousarray(rest.T), axis=1, zi=zi)[0].T
+        else:
+            for i in xrange(n, nrows):
+                result[i] = pm * rest[i - n] + wm * result[i - 1]
+    return result
 
-    if len(values) < n:
-        return pd.Series(np.nan, index=arg.index)
+
+def _wilderma(values, n):
+    values = np.asarray(values, dtype=float)
+    values2d = values if values.ndim == 2 else values[:, None]
+    packed, order, counts = _pack(values2d)
+    return _unpack(_wilder_smooth(packed, n), order, counts).reshape(values.shape)
+
+
+def wilderma(arg, n):
+    """Wilder's moving average. NaN values are skipped; a DataFrame or 2-D array has all of its columns smoothed in a
+    single pass."""
+    if isinstance(arg, pd.DataFrame):
+        return pd.DataFrame(_wilderma(arg.values, n), index=arg.index, columns=arg.columns)
+    elif isinstance(arg, pd.Series):
+        return pd.Series(_wilderma(arg.values, n), index=arg.index)
+    elif isinstance(arg, np.ndarray):
+        return _wilderma(arg, n)
     else:
-        result = np.empty(len(values), dtype=float)
-        result[:n - 1] = np.nan
-        result[n - 1] = values[:n].mean()
-        i, sz = n, len(values)
-        pm = 1. / n
-        wm = 1. - pm
-        while i < sz:
-            result[i] = pm * values[i] + wm * result[i - 1]
-            i += 1
-        return pd.Series(result, index=converted.index).reindex(arg.index)
+        raise ValueError("Expected argument to be Series or DataFrame not %s" % type(arg))
 
 
 def ma(arg, n, matype='sma'):
@@ -93,16 +123,24 @@ def dmi(arg, n, high_col='high', low_col='low', close_col='close'):
     converted = arg[[close_col, high_col, low_col]]
     converted.columns = ['close', 'high', 'low']
 
-    up_mv = converted.high.diff()
-    dn_mv = -1 * converted.low.diff()
+    up_mv, dn_mv = _directional_moves(converted.high, converted.low)
+    tr = true_range(converted, 'high', 'low', 'close')
+    smoothed = wilderma(pd.DataFrame({'tr': tr, 'up': up_mv, 'dn': dn_mv}), n)
+    return _dmi_frame(smoothed['up'], smoothed['dn'], smoothed['tr'], n)
+
+
+def _directional_moves(high, low):
+    up_mv = high.diff()
+    dn_mv = -1 * low.diff()
     up_mv[~((up_mv > 0) & (up_mv > dn_mv))] = 0
     dn_mv[~((dn_mv > 0) & (dn_mv > up_mv))] = 0
+    return up_mv, dn_mv
 
-    tr = true_range(converted, 'high', 'low', 'close')
-    atr = wilderma(tr, n)
 
-    di_pos = 100. * wilderma(up_mv, n) / atr
-    di_neg = 100. * wilderma(dn_mv, n) / atr
+def _dmi_frame(up, dn, atr, n):
+    """Build the dmi frame from the smoothed directional moves and average true range"""
+    di_pos = 100. * up / atr
+    di_neg = 100. * dn / atr
     dx = 100. * np.abs(di_pos - di_neg) / (di_pos + di_neg)
     adx = wilderma(dx, n)
 
@@ -115,6 +153,74 @@ def dmi(arg, n, high_col='high', low_col='low', close_col='close'):
     return pd.DataFrame.from_items(data)
 
 
+def _rolling_argext(values, window, ufunc):
+    """Van Herk/Gil-Werman rolling arg max (ufunc=np.maximum) or arg min (ufunc=np.minimum) of a 1-D array without
+    NaN values. The array is cut in blocks of the window size so that every window is the suffix of one block plus the
+    prefix of the next, and both are found with a single accumulate over the blocks."""
+    n, w = len(values), int(window)
+    if w < 1:
+        raise ValueError('window must be a positive integer not %s' % window)
+    result = np.empty(n)
+    result.fill(np.nan)
+    if n < w:
+        return result
+
+    better = np.greater if ufunc is np.maximum else np.less
+    pad = np.inf if ufunc is np.minimum else -np.inf
+    nblocks = -(-n // w)
+    blocks = np.append(np.asarray(values, dtype=float), np.repeat(pad, nblocks * w - n)).reshape(nblocks, w)
+    offsets = np.arange(w)
+    starts = np.arange(nblocks)[:, None] * w
+
+    # prefix extremes, ties resolve to the latest value
+    prefix = ufunc.accumulate(blocks, axis=1)
+    prefix_pos = np.maximum.accumulate(np.where(blocks == prefix, offsets, -1), axis=1) + starts
+
+    # suffix extremes scanning each block backwards, ties resolve to the latest value so only a strictly better
+    # value moves the position
+    rblocks = blocks[:, ::-1]
+    suffix = ufunc.accumulate(rblocks, axis=1)
+    moved = np.ones(rblocks.shape, dtype=bool)
+    moved[:, 1:] = better(rblocks[:, 1:], suffix[:, :-1])
+    suffix_pos = (w - 1 - np.maximum.accumulate(np.where(moved, offsets, -1), axis=1))[:, ::-1] + starts
+    suffix = suffix[:, ::-1]
+
+    prefix, prefix_pos = prefix.ravel()[w - 1:n], prefix_pos.ravel()[w - 1:n]
+    suffix, suffix_pos = suffix.ravel()[:n - w + 1], suffix_pos.ravel()[:n - w + 1]
+    wstart = np.arange(n - w + 1)
+    use_prefix = (wstart % w == 0) | ~better(suffix, prefix)
+    result[w - 1:] = np.where(use_prefix, prefix_pos, suffix_pos) - wstart
+    return result
+
+
+def _rolling_arg(arg, window, ufunc):
+    if isinstance(arg, pd.Series):
+        converted = arg.dropna()
+        result = _rolling_argext(converted.values, window, ufunc)
+        return pd.Series(result, index=converted.index).reindex(arg.index)
+    else:
+        values = np.asarray(arg, dtype=float)
+        valid = ~np.isnan(values)
+        result = np.empty(len(values))
+        result.fill(np.nan)
+        result[valid] = _rolling_argext(values[valid], window, ufunc)
+        return result
+
+
+@per_series()
+def rolling_argmax(arg, window):
+    """Return the position of the maximum within each trailing window of `window` values, 0 being the oldest value
+    in the window. Ties resolve to the most recent value and NaN values are skipped. Linear in the length of arg."""
+    return _rolling_arg(arg, window, np.maximum)
+
+
+@per_series()
+def rolling_argmin(arg, window):
+    """Return the position of the minimum within each trailing window of `window` values, 0 being the oldest value
+    in the window. Ties resolve to the most recent value and NaN values are skipped. Linear in the length of arg."""
+    return _rolling_arg(arg, window, np.minimum)
+
+
 def aroon(arg, n, up_col='close', dn_col='close'):
     """
     TODO - need to verify that the dropna does not take away too many entries (ie maybe set to all? ) This function assumes that
@@ -136,12 +242,9 @@ def aroon(arg, n, up_col='close', dn_col='close'):
         dnvals = upvals
 
     n = int(n)
-    up, dn = np.empty(len(upvals), 'd'), np.empty(len(upvals), 'd')
-    up[:n] = np.nan
-    dn[:n] = np.nan
-    for i in range(n, len(upvals)):
-        up[i] = 100. * (n - upvals[i - n:i + 1][::-1].argmax()) / n
-        dn[i] = 100. * (n - dnvals[i - n:i + 1][::-1].argmin()) / n
+    # windows span the current value and the n before it
+    up = 100. * _rolling_argext(upvals, n + 1, np.maximum) / n
+    dn = 100. * _rolling_argext(dnvals, n + 1, np.minimum) / n
 
     osc = up - dn
     data = [
@@ -170,29 +273,99 @@ def macd(arg, nslow=26, nfast=12, nsignal=9):
     return pd.DataFrame.from_items(data)
 
 
-@per_series()
+def _rsi_moves(values):
+    """Return the (gains, losses, order, counts) of the packed 2-D values, see _pack"""
+    packed, order, counts = _pack(values)
+    change = np.empty(packed.shape)
+    change[:1] = np.nan
+    change[1:] = packed[1:] - packed[:-1]
+    gain = np.where(change > 0, change, 0.)
+    loss = np.where(change < 0, np.abs(change), 0.)
+    if order is not None:
+        tail = np.arange(len(packed))[:, None] >= counts
+        gain[tail] = loss[tail] = np.nan
+    return gain, loss, order, counts
+
+
+def _rsi_from_moves(moves, n):
+    gain, loss, order, counts = moves
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = _wilder_smooth(gain, n) / _wilder_smooth(loss, n)
+        result[result == np.inf] = 100.  # divide by zero
+        result = 100. - (100. / (1. + result))
+    return _unpack(result, order, counts)
+
+
+def _rsi(values, n):
+    values = np.asarray(values, dtype=float)
+    values2d = values if values.ndim == 2 else values[:, None]
+    return _rsi_from_moves(_rsi_moves(values2d), n).reshape(values.shape)
+
+
 def rsi(arg, n):
     """ compute RSI for the given arg
 
-    arg: Series or DataFrame
+    arg: Series, DataFrame or ndarray. The columns of a DataFrame or 2-D array are computed in a single pass.
     """
+    n = int(n)
     if isinstance(arg, pd.DataFrame):
-        cols = [(name, rsi(arg[name], n)) for name in arg.columns]
-        return pd.DataFrame.from_items(cols)
+        return pd.DataFrame(_rsi(arg.values, n), index=arg.index, columns=arg.columns)
+    elif isinstance(arg, pd.Series):
+        return pd.Series(_rsi(arg.values, n), index=arg.index)
+    elif isinstance(arg, np.ndarray):
+        return _rsi(arg, n)
     else:
-        assert isinstance(arg, pd.Series)
-        n = int(n)
-        converted = arg.dropna()
-        change = converted.diff()
-        gain = change.apply(lambda c: c > 0 and c or 0)
-        avgGain = wilderma(gain, n)
-        loss = change.apply(lambda c: c < 0 and abs(c) or 0)
-        avgLoss = wilderma(loss, n)
-
-        result = avgGain / avgLoss
-        result[result == np.inf] = 100.  # divide by zero
-        result = 100. - (100. / (1. + result))
-        return pd.Series(result, index=converted.index).reindex(arg.index)
+        raise ValueError("Expected argument to be Series or DataFrame not %s" % type(arg))
+
+
+def _ffill(values):
+    """Forward fill the NaN values down each column of the 2-D values"""
+    pos = np.where(np.isnan(values), 0, np.arange(len(values))[:, None])
+    np.maximum.accumulate(pos, axis=0, out=pos)
+    return values[pos, np.arange(values.shape[1])]
+
+
+def _resolve_equal(signal, eq, keep, carry):
+    """Set the eq rows of each column of signal to the signal of the row before, which may itself be an eq row. A
+    prior signal which is not the carry value becomes 0 from the first eq row which is not a keep row."""
+    nrows, ncols = signal.shape
+    eq = eq.copy()
+    eq[:1] = False
+    cols = np.arange(ncols)
+    # last row which is not an eq row, its signal is the start of the chain of equal rows which follows
+    last = np.maximum.accumulate(np.where(eq, -1, np.arange(nrows)[:, None]), axis=0)
+    prior = signal[last, cols]
+    breaks = np.cumsum(eq & ~keep, axis=0)
+    broken = breaks - breaks[last, cols] > 0
+    return np.where(eq, np.where((prior == carry) | ~broken, prior, 0.), signal)
+
+
+def _cross_values(lower1, upper1, lower2, upper2, continuous=0):
+    """cross_signal of 2-D arrays of bounds, each column is computed independently"""
+    lower1, upper1, lower2, upper2 = [_ffill(np.asarray(v, dtype=float)) for v in (lower1, upper1, lower2, upper2)]
+    signal = np.empty(upper1.shape)
+    signal.fill(np.nan)
+    with np.errstate(invalid='ignore'):
+        signal[upper1 > upper2] = 1
+        signal[lower1 < lower2] = -1
+
+        if continuous:
+            # Just roll with 1, -1 and start at 0 once both have a value
+            signal = _ffill(signal)
+            nrows = len(signal)
+            first1 = np.where(~np.isnan(upper1).all(axis=0), (~np.isnan(upper1)).argmax(axis=0), nrows)
+            first2 = np.where(~np.isnan(upper2).all(axis=0), (~np.isnan(upper2)).argmax(axis=0), nrows)
+            fv = np.where(first1 == nrows, first2, np.where(first2 == nrows, first1, np.maximum(first1, first2)))
+            signal[(np.arange(nrows)[:, None] >= fv) & np.isnan(signal)] = 0
+        else:
+            signal[(upper1 < upper2) & (lower1 > lower2)] = 0
+            # special handling when equal, determine where it previously was
+            point = upper2 == lower2
+            # Line coming from above upper bound if prior signal is 1
+            signal = _resolve_equal(signal, upper1 == upper2, point, 1.)
+            # Line coming from below lower bound if prior signal is -1
+            signal = _resolve_equal(signal, lower1 == lower2, point, -1.)
+    return signal
 
 
 def cross_signal(s1, s2, continuous=0):
@@ -228,53 +401,200 @@ def cross_signal(s1, s2, continuous=0):
     lower2, upper2 = _convert(s2, s1)
 
     df = pd.DataFrame({'upper1': upper1, 'lower1': lower1, 'upper2': upper2, 'lower2': lower2})
-    df.ffill(inplace=True)
-
-    signal = pd.Series(np.nan, index=df.index)
-    signal[df.upper1 > df.upper2] = 1
-    signal[df.lower1 < df.lower2] = -1
-
-    if continuous:
-        # Just roll with 1, -1
-        signal = signal.fillna(method='ffill')
-        m1, m2 = df.upper1.first_valid_index(), df.upper2.first_valid_index()
-        if m1 is not None or m2 is not None:
-            m1 = m2 if m1 is None else m1
-            m2 = m1 if m2 is None else m2
-            fv = max(m1, m2)
-            if np.isnan(signal[fv]):
-                signal[fv] = 0
-                signal.ffill(inplace=1)
+    values = _cross_values(*[df[[c]].values for c in ['lower1', 'upper1', 'lower2', 'upper2']],
+                           continuous=continuous)
+    return pd.Series(values[:, 0], index=df.index)
+
+
+def cross_signals(s1, s2, continuous=0):
+    """ return the cross_signal of each column of s1 against the same column of s2, all computed in a single pass
+
+    s1: DataFrame
+    s2: DataFrame with the columns of s1, Series, float, int, or tuple(float|int) applied to every column of s1
+    continous: bool, if true then once the signal starts it is always 1 or -1
+    """
+    if not isinstance(s1, pd.DataFrame):
+        raise ValueError('s1 expected to be DataFrame not %s' % type(s1))
+
+    index = s1.index
+    if isinstance(s2, (pd.DataFrame, pd.Series)):
+        index = index.union(s2.index)
+    values1 = s1.reindex(index).values
+    if isinstance(s2, pd.DataFrame):
+        missing = s1.columns.difference(s2.columns)
+        if len(missing):
+            raise ValueError('s2 missing columns: %s' % ','.join([str(c) for c in missing]))
+        lower2 = upper2 = s2[s1.columns].reindex(index).values
+    elif isinstance(s2, pd.Series):
+        lower2 = upper2 = np.repeat(s2.reindex(index).values[:, None], values1.shape[1], axis=1)
+    elif isinstance(s2, (int, float)):
+        lower2 = upper2 = np.empty(values1.shape)
+        upper2.fill(s2)
+    elif isinstance(s2, (tuple, list)):
+        l, u = min(s2), max(s2)
+        assert l <= u, 'lower bound must be less than upper bound'
+        lower2, upper2 = np.empty(values1.shape), np.empty(values1.shape)
+        lower2.fill(l)
+        upper2.fill(u)
     else:
-        signal[(df.upper1 < df.upper2) & (df.lower1 > df.lower2)] = 0
-        # special handling when equal, determine where it previously was
-        eq = (df.upper1 == df.upper2)
-        if eq.any():  # Set to prior value
-            tmp = signal[eq]
-            for i in tmp.index:
-                loc = signal.index.get_loc(i)
-                if loc != 0:
-                    u, l = df.upper2.iloc[loc], df.lower2.iloc[loc]
-                    ps = signal.iloc[loc - 1]
-                    if u == l or ps == 1.:  # Line coming from above upper bound if ps == 1
-                        signal[i] = ps
-                    else:
-                        signal[i] = 0
-
-        eq = (df.lower1 == df.lower2)
-        if eq.any():  # Set to prior value
-            tmp = signal[eq]
-            for i in tmp.index:
-                loc = signal.index.get_loc(i)
-                if loc != 0:
-                    u, l = df.upper2.iloc[loc], df.lower2.iloc[loc]
-                    ps = signal.iloc[loc - 1]
-                    if u == l or ps == -1.:  # Line coming from below lower bound if ps == -1
-                        signal[i] = ps
-                    else:
-                        signal[i] = 0
+        raise Exception('unable to handle type %s' % type(s2))
+
+    values = _cross_values(values1, values1, lower2, upper2, continuous=continuous)
+    return pd.DataFrame(values, index=index, columns=s1.columns)
 
-    return signal
+
+class IndicatorPipeline(object):
+    """Evaluate a declared set of indicators over a single OHLC frame. Intermediate results which indicators share,
+    such as moving averages with the same span, the rsi price changes, true range and the directional moves, are
+    computed once and reused.
+
+    pipe = IndicatorPipeline(pxs).add('rsi', 14).add('macd').add('ema', 12).add('dmi', 14).add('atr', 14)
+    pipe.add(talib_wrapper.CCI, 20, name='cci')
+    features = pipe.evaluate()
+    """
+    INDICATORS = ['sma', 'ema', 'wilderma', 'macd', 'rsi', 'true_range', 'atr', 'dmi', 'aroon']
+
+    def __init__(self, frame, high_col='high', low_col='low', close_col='close'):
+        self.frame = frame
+        self.high_col = high_col
+        self.low_col = low_col
+        self.close_col = close_col
+        self.indicators = []
+        self._cache = {}
+
+    def add(self, indicator, *args, **kwargs):
+        """Declare an indicator to evaluate.
+
+        indicator: one of INDICATORS or a function, such as a talib_wrapper function, which is called with the frame
+                   (or the column col when col is specified) followed by args and kwargs
+        name: output column name, or the column prefix for indicators which return a frame. Defaults to the
+              indicator name and args.
+        """
+        name = kwargs.pop('name', None)
+        if isinstance(indicator, basestring):
+            if indicator not in self.INDICATORS:
+                raise ValueError('unknown indicator %s, expected one of %s' % (indicator, ','.join(self.INDICATORS)))
+        elif not callable(indicator):
+            raise ValueError('indicator must be an indicator name or function not %s' % type(indicator))
+        if name is None:
+            label = indicator if isinstance(indicator, basestring) else indicator.__name__
+            name = '_'.join([label] + [str(a) for a in args] + ['%s' % kwargs[k] for k in sorted(kwargs)])
+        self.indicators.append((name, indicator, args, kwargs))
+        return self
+
+    def _get(self, key, fct, *args):
+        if key not in self._cache:
+            self._cache[key] = fct(*args)
+        return self._cache[key]
+
+    def _column(self, col):
+        return self.frame[col or self.close_col]
+
+    def sma(self, n, col=None):
+        return self._get(('sma', col, n), sma, self._column(col), n)
+
+    def ema(self, n, col=None):
+        return self._get(('ema', col, n), ema, self._column(col), n)
+
+    def wilderma(self, n, col=None):
+        return self._get(('wilderma', col, n), wilderma, self._column(col), n)
+
+    def macd(self, nslow=26, nfast=12, nsignal=9, col=None):
+        nslow, nfast, nsignal = int(nslow), int(nfast), int(nsignal)
+
+        def _macd():
+            emafast = self.ema(nfast, col)
+            emaslow = self.ema(nslow, col)
+            line = emafast - emaslow
+            signal = ema(line, nsignal)
+            data = [
+                ('MACD_FAST', emafast),
+                ('MACD_SLOW', emaslow),
+                ('MACD', line),
+                ('MACD_SIGNAL', signal),
+                ('MACD_HIST', line - signal),
+            ]
+            return pd.DataFrame.from_items(data)
+
+        return self._get(('macd', col, nslow, nfast, nsignal), _macd)
+
+    def rsi(self, n, col=None):
+        n = int(n)
+        arg = self._column(col)
+        moves = self._get(('rsi_moves', col), _rsi_moves, np.asarray(arg.values, dtype=float)[:, None])
+        return self._get(('rsi', col, n), lambda: pd.Series(_rsi_from_moves(moves, n)[:, 0], index=arg.index))
+
+    def true_range(self):
+        return self._get(('true_range',), true_range, self.frame, self.high_col, self.low_col, self.close_col)
+
+    def atr(self, n):
+        return self._get(('atr', n), wilderma, self.true_range(), n)
+
+    def dmi(self, n):
+        def _dmi():
+            up_mv, dn_mv = self._get(('directional_moves',), _directional_moves, self.frame[self.high_col],
+                                     self.frame[self.low_col])
+            return _dmi_frame(wilderma(up_mv, n), wilderma(dn_mv, n), self.atr(n), n)
+
+        return self._get(('dmi', n), _dmi)
+
+    def aroon(self, n, up_col=None, dn_col=None):
+        up_col, dn_col = up_col or self.close_col, dn_col or self.close_col
+        return self._get(('aroon', n, up_col, dn_col), aroon, self.frame, n, up_col, dn_col)
+
+    def compute(self, indicator, *args, **kwargs):
+        """Return the result of the indicator, computing it and the intermediate results it needs if not cached"""
+        if isinstance(indicator, basestring):
+            return getattr(self, indicator)(*args, **kwargs)
+        col = kwargs.pop('col', None)
+        key = (indicator, col, args, tuple(sorted(kwargs.items())))
+        arg = self.frame if col is None else self.frame[col]
+        return self._get(key, lambda: indicator(arg, *args, **kwargs))
+
+    def evaluate(self):
+        """Return a frame with a column for each Series indicator and a column per output of each frame indicator"""
+        pieces = []
+        for name, indicator, args, kwargs in self.indicators:
+            res = self.compute(indicator, *args, **kwargs)
+            if isinstance(res, pd.DataFrame):
+                res = pd.DataFrame(res.values, index=res.index, columns=['%s_%s' % (name, c) for c in res.columns])
+            else:
+                res = pd.DataFrame({name: res})
+            pieces.append(res)
+        if not pieces:
+            return pd.DataFrame(index=self.frame.index)
+        return pd.concat(pieces, axis=1)
+
+
+def _raise_first(checks):
+    """checks is a list of (mask, exception factory) in the order they are made for each signal change. Raise the
+    exception of the first change which fails a check."""
+    first = None
+    for mask, exc in checks:
+        hits = np.flatnonzero(mask)
+        if len(hits) and (first is None or hits[0] < first[0]):
+            first = (hits[0], exc)
+    if first is not None:
+        raise first[1](first[0])
+
+
+def _signal_trades(closes, close_tss, close_pxs, opens, open_tss, open_pxs, open_qtys, as_store=0):
+    """Build the trades made at each signal change: a close of the live trade (if any) followed by an open (if any).
+    closes and opens are masks over the changes, the close and open values are for the masked changes only."""
+    nchgs = len(closes)
+    live = np.zeros(nchgs)
+    live[opens] = open_qtys
+    close_qtys = -np.append(0., live)[:-1][closes]
+    # close is made before the open at the same change
+    slots = np.append(2 * np.flatnonzero(closes), 2 * np.flatnonzero(opens) + 1)
+    order = slots.argsort(kind='mergesort')
+    tss = close_tss.append(open_tss)[order]
+    qtys = np.append(close_qtys, open_qtys)[order]
+    pxs = np.append(close_pxs, open_pxs)[order]
+    if as_store:
+        return TradeStore.from_arrays(np.arange(1, len(order) + 1), tss, qtys, pxs)
+    else:
+        return [Trade(tid, ts, qty, px, fees=0) for tid, ts, qty, px in zip(xrange(1, len(order) + 1), tss, qtys, pxs)]
 
 
 class Signal(object):
@@ -282,82 +602,85 @@ class Signal(object):
         self.signal = signal
         self.qtys = qtys
 
-    def _qty_fct(self, index):
+    def _check_qtys(self):
+        qtys = self.qtys
+        if not (qtys is None or isinstance(qtys, pd.Series) or callable(qtys)):
+            raise ValueError('qtys must be one of (scalar, Series, function)')
+
+    def _sizes(self, index, locs, tss):
+        """Return the absolute trade sizes for the trade timestamps tss, which are found at locs in index"""
         qtys = self.qtys
         if qtys is None:
-            qtyfct = lambda ts: 1.
+            return np.ones(len(tss))
         elif isinstance(qtys, pd.Series):
             qtys = qtys.reindex(index, method='ffill').bfill()
-            qtyfct = lambda ts: qtys[ts]
-        elif callable(qtys):
-            qtyfct = qtys
+            return np.abs(qtys.values[locs])
         else:
-            raise ValueError('qtys must be one of (scalar, Series, function)')
-        return qtyfct
+            return np.abs(np.array([qtys(ts) for ts in tss], dtype=float))
 
-    def close_to_close(self, pxs):
+    def _changes(self):
+        """Return the (timestamps, signal, previous signal) of the signal changes which result in trades"""
+        signal = self.signal.dropna()
+        vals = signal.values
+        locs = np.flatnonzero(vals[1:] != vals[:-1]) + 1
+        sigs = vals[locs]
+        prev = np.append(0, sigs)[:-1]
+        keep = sigs != prev
+        return signal.index[locs[keep]], sigs[keep], prev[keep]
+
+    def close_to_close(self, pxs, as_store=0):
         """
-        :param pxs:
+        :param pxs: Series of prices used to close and open at each signal change
+        :param as_store: if True return a TradeStore rather than a list of Trade
         :return:
         """
         if not isinstance(pxs, pd.Series):
             raise ValueError('pxs expected to be Series')
 
-        blotter = TradeBlotter()
-        signal = self.signal.dropna()
-        diff = signal.diff()
-        diff.iloc[0] = 0
-        changes = signal[diff != 0]
-        lsig = 0
-        qtyfct = self._qty_fct(pxs.index)
-        for ts, sig in changes.iteritems():
-            blotter.ts = ts
-            if sig != lsig:
-                px = pxs.get(ts, None)
-                if px is None:
-                    raise Exception('insufficient price data: no data found at %s' % ts)
-                if lsig != 0:  # close open trd
-                    blotter.close(px=px)
-
-                if sig != 0:
-                    size = abs(qtyfct(ts))
-                    qty = sig > 0 and size or -size
-                    blotter.open(qty, px)
-            lsig = sig
-        return blotter.trades
-
-    def open_to_close(self, open_pxs, close_pxs):
-        blotter = TradeBlotter()
-        signal = self.signal.dropna()
-        diff = signal.diff()
-        diff.iloc[0] = 0
-        changes = signal[diff != 0]
-        lsig = 0
-        nopen = len(open_pxs)
-        qtyfct = self._qty_fct(open_pxs.index)
-        for ts, sig in changes.iteritems():
-            blotter.ts = ts
-            if sig != lsig:
-                if lsig != 0:
-                    # close open trd with today's closing price
-                    px = close_pxs.get(ts, None)
-                    if px is None:
-                        raise Exception('insufficient close price data: no data found at %s' % ts)
-                    blotter.close(px)
-
-                if sig != 0:
-                    idx = open_pxs.index.get_loc(ts)
-                    if (idx + 1) != nopen:
-                        ts_plus1 = open_pxs.index[idx + 1]
-                        px = open_pxs.iloc[idx + 1]
-                        size = abs(qtyfct(ts))
-                        qty = sig > 0 and size or -size
-                        blotter.ts = ts_plus1
-                        blotter.open(qty, px)
-                    else:
-                        pass
-            lsig = sig
-        return blotter.trades
+        self._check_qtys()
+        tss, sigs, prev = self._changes()
+        locs = pxs.index.get_indexer(tss)
+        found = locs != -1
+        closes, opens = prev != 0, sigs != 0
+        sizes = np.zeros(len(tss))
+        sizes[opens & found] = self._sizes(pxs.index, locs[opens & found], tss[opens & found])
+        _raise_first([
+            (~found, lambda i: Exception('insufficient price data: no data found at %s' % tss[i])),
+            (opens & found & (sizes == 0), lambda i: Exception('open position failed: qty is 0')),
+        ])
+        chg_pxs = pxs.values[locs]
+        qtys = np.where(sigs > 0, sizes, -sizes)
+        return _signal_trades(closes, tss[closes], chg_pxs[closes], opens, tss[opens], chg_pxs[opens], qtys[opens],
+                              as_store=as_store)
+
+    def open_to_close(self, open_pxs, close_pxs, as_store=0):
+        """
+        :param open_pxs: Series of prices used to open on the bar after each signal change
+        :param close_pxs: Series of prices used to close at each signal change
+        :param as_store: if True return a TradeStore rather than a list of Trade
+        :return:
+        """
+        self._check_qtys()
+        tss, sigs, prev = self._changes()
+        clocs = close_pxs.index.get_indexer(tss)
+        olocs = open_pxs.index.get_indexer(tss)
+        closes, opens = prev != 0, sigs != 0
+        # an open on the last bar has no next bar to trade at and is skipped
+        filled = opens & (olocs != -1) & (olocs + 1 != len(open_pxs))
+        skipped = np.append(False, opens & ~filled)[:-1]
+        sizes = np.zeros(len(tss))
+        sizes[filled] = self._sizes(open_pxs.index, olocs[filled], tss[filled])
+        _raise_first([
+            (closes & (clocs == -1),
+             lambda i: Exception('insufficient close price data: no data found at %s' % tss[i])),
+            (closes & skipped, lambda i: Exception('close position failed: no position currently open')),
+            (opens & (olocs == -1), lambda i: KeyError(tss[i])),
+            (filled & (sizes == 0), lambda i: Exception('open position failed: qty is 0')),
+        ])
+        qtys = np.where(sigs > 0, sizes, -sizes)
+        nxt = olocs[filled] + 1
+        return _signal_trades(closes, tss[closes], close_pxs.values[clocs[closes]], filled, open_pxs.index[nxt],
+                              open_pxs.values[nxt], qtys[filled], as_store=as_store)
 
 
 # make upper case available to match ta-lib wrapper
@@ -2,23 +2,114 @@
 
 help to interface with ta-lib dealing with NaNs and returning timeseries and such
 
+DataFrame arguments are run as a panel: the frame values are viewed as one contiguous float64 row per column (no copy
+for a single float block), talib is called on each row (or on the run of rows sharing a NaN pattern once the NaNs are
+dropped) and the outputs are written back into a single array. The talib calls of a panel are spread across the pool
+set with tia.analysis.util.set_pool, a ThreadPool works well as talib releases the GIL while it computes.
+
 """
+from collections import OrderedDict
+
+import numpy as np
 import talib
 import pandas as pd
 
-from tia.analysis.util import per_series, per_level
+from tia.analysis.util import _pool_map
+
+
+def _call(task):
+    fct, args = task
+    result = fct(*args)
+    return result if isinstance(result, (tuple, list)) else (result,)
+
+
+def _column_buffer(frame):
+    """Return the frame values as a C-contiguous float64 array with a row per column"""
+    return np.ascontiguousarray(frame.values.T, dtype=np.float64)
+
+
+def _scatter(results, cols, locs, noutputs, shape, full):
+    """Write the talib outputs for each column into a single (noutputs, ncols, nrows) array"""
+    if full and results:
+        dtype = np.result_type(*[r for result in results for r in result])
+    else:
+        dtype = np.float64
+    out = np.empty((noutputs,) + shape, dtype=dtype)
+    if not full:
+        out.fill(np.nan)
+    for j, loc, result in zip(cols, locs, results):
+        for k in range(noutputs):
+            out[k, j, loc] = result[k]
+    return out
+
+
+def _panel_series(frame, noutputs, fct, fctargs):
+    """Run fct on the non-null values of each column of the frame, columns with the same NaN pattern are run on
+    slices of one buffer. Return an array of shape (noutputs, ncols, nrows)."""
+    buf = _column_buffer(frame)
+    mask = np.isnan(buf)
+    groups = OrderedDict()
+    for j in range(len(buf)):
+        groups.setdefault(np.packbits(mask[j]).tobytes(), []).append(j)
+
+    full = 1
+    tasks, cols, locs = [], [], []
+    for rows in groups.values():
+        pos = np.flatnonzero(~mask[rows[0]])
+        if len(pos) != buf.shape[1]:
+            full = 0
+        if len(pos) == 0:
+            continue
+        elif pos[-1] - pos[0] + 1 == len(pos):
+            # contiguous run of values (ie leading or trailing NaNs), use views of the buffer
+            loc = slice(pos[0], pos[-1] + 1)
+            values = [buf[j, loc] for j in rows]
+        else:
+            loc = pos
+            values = buf[np.ix_(rows, pos)]
+        for j, vals in zip(rows, values):
+            tasks.append((fct, (vals,) + tuple(fctargs)))
+            cols.append(j)
+            locs.append(loc)
+    return _scatter(_pool_map(_call, tasks), cols, locs, noutputs, buf.shape, full)
+
+
+def _panel_frame(frame, colnames, noutputs, fct, fctargs):
+    """Run fct for each header of a frame with (header..., field) columns. Return the headers and an array of
+    shape (noutputs, nheaders, nrows)."""
+    hdrs = list(OrderedDict((c[:-1], None) for c in frame.columns).keys())
+    locs = dict((c, i) for i, c in enumerate(frame.columns))
+    buf = _column_buffer(frame)
+    # rows of the buffer are contiguous, pass them to talib as views
+    tasks = [(fct, tuple(buf[locs[hdr + (c,)]] for c in colnames) + tuple(fctargs)) for hdr in hdrs]
+    locs = [slice(None)] * len(hdrs)
+    out = _scatter(_pool_map(_call, tasks), range(len(hdrs)), locs, noutputs, (len(hdrs), len(frame.index)), 1)
+    return hdrs, out
 
 
-@per_level()
 def _frame_to_series(frame, colnames, fct, *fctargs):
+    if isinstance(frame, pd.DataFrame) and frame.columns.nlevels > 1:
+        hdrs, out = _panel_frame(frame, colnames, 1, fct, fctargs)
+        if frame.columns.nlevels == 2:
+            columns = pd.Index([hdr[0] for hdr in hdrs], name=frame.columns.names[0])
+        else:
+            columns = pd.MultiIndex.from_tuples(hdrs, names=frame.columns.names[:-1])
+        return pd.DataFrame(out[0].T, index=frame.index, columns=columns)
+
     args = [frame[c].values for c in colnames]
     args.extend(fctargs)
     values = fct(*args)
     return pd.Series(values, index=frame.index)
 
 
-@per_level()
 def _frame_to_frame(frame, input_names, output_names, fct, *fctargs):
+    if isinstance(frame, pd.DataFrame) and frame.columns.nlevels > 1:
+        hdrs, out = _panel_frame(frame, input_names, len(output_names), fct, fctargs)
+        values = out.transpose(2, 1, 0).reshape(len(frame.index), len(hdrs) * len(output_names))
+        columns = pd.MultiIndex.from_tuples([hdr + (n,) for hdr in hdrs for n in output_names],
+                                            names=list(frame.columns.names[:-1]) + [None])
+        return pd.DataFrame(values, index=frame.index, columns=columns)
+
     args = [frame[c].values for c in input_names]
     args.extend(fctargs)
     result = fct(*args)
@@ -27,8 +118,19 @@ def _frame_to_frame(frame, input_names, output_names, fct, *fctargs):
     return f
 
 
-@per_series(result_is_frame=1)
 def _series_to_frame(series, output_names, fct, *fctargs):
+    if isinstance(series, pd.DataFrame):
+        frame = series
+        out = _panel_series(frame, len(output_names), fct, fctargs)
+        values = out.transpose(2, 1, 0).reshape(len(frame.index), len(frame.columns) * len(output_names))
+        if frame.columns.nlevels == 1:
+            arrs = [np.repeat(np.asarray(frame.columns, dtype=object), len(output_names))]
+        else:
+            arrs = [np.repeat(frame.columns.get_level_values(i), len(output_names))
+                    for i in range(frame.columns.nlevels)]
+        arrs.append(list(output_names) * len(frame.columns))
+        return pd.DataFrame(values, index=frame.index, columns=pd.MultiIndex.from_arrays(arrs))
+
     nonulls = series.dropna()
     result = fct(nonulls.values, *fctargs)
     data = {n: result[i] for i, n in enumerate(output_names)}
@@ -36,8 +138,11 @@ def _series_to_frame(series, output_names, fct, *fctargs):
     return f.reindex(series.index)
 
 
-@per_series()
 def _series_to_series(series, fct, *fctargs):
+    if isinstance(series, pd.DataFrame):
+        out = _panel_series(series, 1, fct, fctargs)
+        return pd.DataFrame(out[0].T, index=series.index, columns=series.columns)
+
     nonulls = series.dropna()
     return pd.Series(fct(nonulls.values, *fctargs), index=nonulls.index, name=series.name).reindex(series.index)
 
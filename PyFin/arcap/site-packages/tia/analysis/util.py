@@ -1,4 +1,6 @@
 import functools
+import importlib
+from collections import OrderedDict
 
 import numpy as np
 import pandas as pd
@@ -17,7 +19,56 @@ def has_weekends(index):
     return 5 in index.dayofweek or 6 in index.dayofweek
 
 
-class PerLevel(object):
+# pool used to apply per_series and per_level functions to the columns of a frame, None to apply serially
+_pool = None
+
+
+def set_pool(pool):
+    """Set the pool which per_series and per_level functions use to fan out over the columns or levels of a frame.
+
+    :param pool: object with a map method such as multiprocessing.pool.ThreadPool or None to apply serially. A
+                 process pool requires the function to be defined at module level and its arguments to be picklable.
+    :return: the previous pool
+    """
+    global _pool
+    prev, _pool = _pool, pool
+    return prev
+
+
+def _pool_map(fct, items):
+    """Apply fct to each item, across the pool set by set_pool if there is more than one item"""
+    if _pool is None or len(items) < 2:
+        return [fct(item) for item in items]
+    else:
+        return _pool.map(fct, items)
+
+
+def _load_dispatch(module, name):
+    return getattr(importlib.import_module(module), name)
+
+
+class _Apply(object):
+    """Picklable call of the wrapped function on a single column or sub-frame"""
+
+    def __init__(self, dispatch, args, kwargs):
+        self.dispatch = dispatch
+        self.args = args
+        self.kwargs = kwargs
+
+    def __call__(self, arg):
+        return self.dispatch.fct(arg, *self.args, **self.kwargs)
+
+
+class _Dispatch(object):
+    def _map(self, items, args, kwargs):
+        return _pool_map(_Apply(self, args, kwargs), items)
+
+    def __reduce__(self):
+        # pickle by reference to the decorated module attribute so pool workers can resolve it
+        return _load_dispatch, (self.fct.__module__, self.fct.__name__)
+
+
+class PerLevel(_Dispatch):
     def __init__(self, fct):
         """Provide logic to apply function to each subframe level
 
@@ -32,11 +83,23 @@ class PerLevel(object):
         df_or_series = args[0]
         if isinstance(df_or_series, pd.DataFrame) and df_or_series.columns.nlevels > 1:
             df = df_or_series
+            nlevels = df.columns.nlevels
+            # sub frame column locations by header, in column order
+            locs = OrderedDict()
+            for i, col in enumerate(df.columns):
+                locs.setdefault(col[:-1], []).append(i)
+
+            subs = []
+            for hdr, ilocs in locs.items():
+                if ilocs[-1] - ilocs[0] + 1 == len(ilocs):
+                    sub = df.iloc[:, ilocs[0]:ilocs[-1] + 1]
+                else:
+                    sub = df.iloc[:, ilocs]
+                sub.columns = pd.Index(sub.columns.get_level_values(nlevels - 1), name=df.columns.names[-1])
+                subs.append(sub)
+
             pieces = []
-            hdrs = set(_[:-1] for _ in df.columns)
-            for hdr in hdrs:
-                sub = df[hdr]
-                res = self.fct(sub, *args[1:], **kwargs)
+            for hdr, res in zip(locs.keys(), self._map(subs, args[1:], kwargs)):
                 if isinstance(res, pd.Series):
                     res = res.to_frame()
                 elif not isinstance(res, pd.DataFrame):
@@ -44,7 +107,7 @@ class PerLevel(object):
 
                 arrs = [res.columns.get_level_values(lvl) for lvl in range(res.columns.nlevels)]
                 names = list(res.columns.names)
-                for i in range(df.columns.nlevels - 1):
+                for i in range(nlevels - 1):
                     arrs.insert(i, [hdr[i]] * len(res.columns))
                     names.insert(i, df.columns.names[i])
 
@@ -58,10 +121,31 @@ class PerLevel(object):
             return self.fct(*args, **kwargs)
 
 
-class PerSeries(object):
-    def __init__(self, fct, result_is_frame=0):
+def _combine_columns(results, df):
+    """Combine the per column results of a function into a frame (or Series if the results are scalars)"""
+    if not results:
+        return pd.DataFrame(index=df.index, columns=df.columns)
+    nrows = len(df.index)
+    first = results[0]
+    if all(isinstance(r, np.ndarray) and r.ndim == 1 and len(r) == nrows for r in results):
+        return pd.DataFrame(np.column_stack(results), index=df.index, columns=df.columns)
+    elif all(isinstance(r, pd.Series) for r in results):
+        if all(r.dtype == first.dtype and r.index.equals(first.index) for r in results):
+            # single allocation when all columns share an index
+            return pd.DataFrame(np.column_stack([r.values for r in results]), index=first.index, columns=df.columns)
+        else:
+            res = pd.concat(results, axis=1, keys=range(len(results)))
+            res.columns = df.columns
+            return res
+    else:
+        return pd.Series(results, index=df.columns)
+
+
+class PerSeries(_Dispatch):
+    def __init__(self, fct, result_is_frame=0, array_capable=0):
         self.fct = fct
         self.result_is_frame = result_is_frame
+        self.array_capable = array_capable
         functools.update_wrapper(self, fct)
 
     def __call__(self, *args, **kwargs):
@@ -70,12 +154,16 @@ class PerSeries(object):
             return self.fct(*args, **kwargs)
         elif not isinstance(df_or_series, pd.DataFrame):
             raise ValueError("Expected argument to be Series or DataFrame not %s" % type(df_or_series))
+        elif self.array_capable:
+            # function computes each column of the 2-D block itself
+            return self.fct(*args, **kwargs)
         else:  # assume dataframe
             df = df_or_series
+            columns = [df.iloc[:, i] for i in range(len(df.columns))]
+            results = self._map(columns, args[1:], kwargs)
             if self.result_is_frame:
                 pieces = []
-                for i, hdrs in enumerate(df.columns):
-                    sres = self.fct(df.icol(i), *args[1:], **kwargs)
+                for hdrs, sres in zip(df.columns, results):
                     if df.columns.nlevels == 1:
                         arrs = [[hdrs] * len(sres.columns)]
                     else:
@@ -85,12 +173,16 @@ class PerSeries(object):
                     pieces.append(sres)
                 return pd.concat(pieces, axis=1)
             else:
-                return df.apply(self.fct, args=args[1:], **kwargs)
+                return _combine_columns(results, df)
 
 
-def per_series(result_is_frame=0):
+def per_series(result_is_frame=0, array_capable=0):
+    """
+    :param result_is_frame: function returns a DataFrame for each Series
+    :param array_capable: function handles a DataFrame itself so it receives the whole frame in one call
+    """
     def _ps(fct):
-        return PerSeries(fct, result_is_frame=result_is_frame)
+        return PerSeries(fct, result_is_frame=result_is_frame, array_capable=array_capable)
 
     return _ps
 
@@ -121,4 +213,25 @@ def insert_level(df, label, level=0, copy=0, axis=0, level_name=None):
         df.columns = idx
     else:
         df.index = idx
-    return df
\ No newline at end of file
+    return df
+
+
+def _pack(values):
+    """Move the non-NaN values of each column of the 2-D values to the top of the column, keeping their order.
+    Return the (packed values, row order, non-NaN count per column); _unpack reverses it."""
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=0)
+    if valid.all():
+        return values, None, counts
+    order = np.argsort(~valid, axis=0, kind='mergesort')
+    return values[order, np.arange(values.shape[1])], order, counts
+
+
+def _unpack(packed, order, counts):
+    if order is None:
+        return packed
+    result = np.empty(packed.shape)
+    result.fill(np.nan)
+    keep = np.arange(len(packed))[:, None] < counts
+    result[order[keep], np.nonzero(keep)[1]] = packed[keep]
+    return result
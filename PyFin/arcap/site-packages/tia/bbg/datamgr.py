@@ -3,6 +3,7 @@ Provide a simple way to interfacing with the Bloomberg API. Provide functions fo
 """
 import os
 from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 import pandas as pd
 
@@ -184,6 +185,15 @@ class Storage(object):
         else:
             return _to_str(key)
 
+    def get_many(self, keys):
+        """Return the list of (frame, userdata) for the keys"""
+        return [self.get(key) for key in keys]
+
+    def set_many(self, items):
+        """Store each of the (key, frame, userdata) items"""
+        for key, frame, userdata in items:
+            self.set(key, frame, **userdata)
+
 
 class MemoryStorage(Storage):
     def __init__(self):
@@ -244,6 +254,28 @@ class HDFStorage(Storage):
                     store.close()
         return None, None
 
+    def _with_store(self, fct, write):
+        """Call fct with the store held open, so a batch of gets or sets opens the file once"""
+        if self._store is not None:
+            return fct()
+        self._store = self.get_store(write=write)
+        try:
+            return fct()
+        finally:
+            self._store.close()
+            self._store = None
+
+    def get_many(self, keys):
+        if not self.file_exists:
+            return [(None, None)] * len(keys)
+        return self._with_store(lambda: Storage.get_many(self, keys), write=0)
+
+    def set_many(self, items):
+        if self.readonly:
+            raise Exception('storage is read-only')
+        items = list(items)
+        items and self._with_store(lambda: Storage.set_many(self, items), write=1)
+
     def set(self, key, frame, **userdata):
         if self.readonly:
             raise Exception('storage is read-only')
@@ -294,16 +326,19 @@ class CacheOnlyDataManager(DataManager):
 
 
 class CachedDataManager(DataManager):
-    def __init__(self, dm, storage, ts=None):
+    def __init__(self, dm, storage, ts=None, threads=None):
         """
         :param dm: DataManager, if not available in cache then use dm to request data
         :param storage: Storage for the cached data
         :param ts:
+        :param threads: number of threads used to run the historical requests which fill the cache, None to run them
+                        one after the other
         """
         DataManager.__init__(self)
         self.dm = dm
         self.storage = storage
         self.ts = ts or pd.datetime.now()
+        self.threads = threads
         self.logger = log.instance_logger('cachemgr', self)
 
     @staticmethod
@@ -318,30 +353,43 @@ class CachedDataManager(DataManager):
     def sid_result_mode(self, value):
         self.dm.sid_result_mode = value
 
+    @staticmethod
+    def _cached_columns(vframe, flds):
+        if vframe is not None:
+            # do this to keep order
+            matches = [c for c in flds if c in vframe.columns]
+            if matches:
+                return vframe[matches]
+
     def _cache_get_attribute(self, sids, flds, **overrides):
         if isinstance(sids, basestring):
             key = (sids, 'attributes', overrides)
             vframe, userdata = self.storage.get(key)
-            if vframe is not None:
-                # do this to keep order
-                matches = [c for c in flds if c in vframe.columns]
-                if matches:
-                    return vframe[matches]
+            return self._cached_columns(vframe, flds)
         else:
-            matches = [self._cache_get_attribute(sid, flds, **overrides) for sid in sids]
+            keys = [(sid, 'attributes', overrides) for sid in sids]
             # Keep order so don't have to sort after the fact
             res = OrderedDict()
-            for sid, match in zip(sids, matches):
+            for sid, (vframe, userdata) in zip(sids, self.storage.get_many(keys)):
+                match = self._cached_columns(vframe, flds)
                 if match is not None:
                     res[sid] = match
             return res
 
+    def _cache_update_attributes(self, frames, **overrides):
+        """Merge the frames (dict of sid to frame) into the cache, reading and writing the storage in one batch"""
+        sids = list(frames.keys())
+        keys = [(sid, 'attributes', overrides) for sid in sids]
+        items = []
+        for sid, key, (oframe, data) in zip(sids, keys, self.storage.get_many(keys)):
+            frame = frames[sid]
+            if oframe is not None:
+                frame = pd.concat([oframe, frame], axis=1)
+            items.append((key, frame, overrides))
+        self.storage.set_many(items)
+
     def _cache_update_attribute(self, sid, frame, **overrides):
-        key = (sid, 'attributes', overrides)
-        oframe, data = self.storage.get(key)
-        if oframe is not None:
-            frame = pd.concat([oframe, frame], axis=1)
-        self.storage.set(key, frame, **overrides)
+        self._cache_update_attributes({sid: frame}, **overrides)
 
     def get_attributes(self, sids, flds, **overrides):
         """Check cache first, then defer to data manager
@@ -350,21 +398,28 @@ class CachedDataManager(DataManager):
         :param overrides: key-value pairs to pass to the mgr get_attributes method
         :return: DataFrame with flds as columns and sids as the row indices
         """
-        # Unfortunately must be inefficient with request
         flds = _force_array(flds)
         sids = _force_array(sids)
         cached = self._cache_get_attribute(sids, flds, **overrides)
         if not cached:  # build get
             df = self.dm.get_attributes(sids, flds, **overrides)
-            [self._cache_update_attribute(sid, df.ix[sid:sid], **overrides) for sid in sids]
+            self._cache_update_attributes(OrderedDict((sid, df.ix[sid:sid]) for sid in sids), **overrides)
             return df
         else:
-            # Retrieve all missing and merge with existing cache
-            for sid in sids:
-                missed = flds if sid not in cached else set(flds) - set(cached[sid].columns)
+            # Retrieve all missing with a request per set of missing fields and merge with existing cache
+            groups = OrderedDict()
+            for sid in OrderedDict.fromkeys(sids):
+                missed = flds if sid not in cached else [c for c in flds if c not in cached[sid].columns]
                 if missed:
-                    df = self.dm.get_attributes(sid, missed, **overrides)
-                    self._cache_update_attribute(sid, df, **overrides)
+                    groups.setdefault(tuple(missed), []).append(sid)
+
+            updates = OrderedDict()
+            for missed, msids in groups.items():
+                self.logger.info('%s not in cache for %s sids' % (','.join(missed), len(msids)))
+                df = self.dm.get_attributes(msids, list(missed), **overrides)
+                for sid in msids:
+                    updates[sid] = df.ix[sid:sid]
+            updates and self._cache_update_attributes(updates, **overrides)
 
             # now just retrieve from cache
             data = self._cache_get_attribute(sids, flds, **overrides)
@@ -379,6 +434,31 @@ class CachedDataManager(DataManager):
             ts = pd.to_datetime(ts_or_period)
             return ts.to_period('D').to_timestamp()
 
+    def _fetch_historical(self, requests, period=None, **overrides):
+        """Run the historical requests, a dict of (flds, start, end) to sids, and return a dict of request to dict of
+        sid to frame. Rows with no data are dropped so a sid gets the same frame whether or not it shared a request."""
+        def _fetch(item):
+            (flds, start, end), sids = item
+            if len(sids) == 1:
+                frame = self.dm.get_historical(sids[0], list(flds), start, end, period, **overrides)
+                return {sids[0]: frame.dropna(how='all')}
+            else:
+                frame = self.dm.get_historical(sids, list(flds), start, end, period, **overrides)
+                # the dates are the union for all sids, so drop those with no data for the sid
+                return dict((sid, frame[sid].dropna(how='all')) for sid in sids)
+
+        items = list(requests.items())
+        if self.threads and len(items) > 1:
+            pool = ThreadPool(min(self.threads, len(items)))
+            try:
+                results = pool.map(_fetch, items)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_fetch(item) for item in items]
+        return dict(zip([req for req, _ in items], results))
+
     def get_historical(self, sids, flds, start, end, period=None, **overrides):
         # TODO - Revisit date handling for caching
         is_str = isinstance(sids, basestring)
@@ -387,61 +467,82 @@ class CachedDataManager(DataManager):
         sids = _force_array(sids)
         end = (end and self._date_only(end)) or self._date_only(self.ts)
         start = self._date_only(start)
-        frames = {}
+        sids = list(OrderedDict.fromkeys(sids))
 
+        keys = []
         for sid in sids:
             key = (sid, 'historical', dict(period=period))
             if overrides:
                     for k, v in overrides.iteritems():
                         key[2][k] = v
+            keys.append(key)
 
-            cached_frame, userdata = self.storage.get(key)
+        # Plan the requests which fill the gaps in the cache of each sid, sids with the same gap share a request
+        plans = []
+        requests = OrderedDict()
+        for sid, key, (cached_frame, userdata) in zip(sids, keys, self.storage.get_many(keys)):
+            gaps = OrderedDict()
             if cached_frame is None:
-                frame = self.dm.get_historical(sid, flds, start, end, **overrides)
-                self.storage.set(key, frame, start=start, end=end)
-                frames[sid] = frame
+                gaps['all'] = (tuple(flds), start, end)
+                cache_start, cache_end = start, end
             else:
                 cache_start = userdata.get('start', cached_frame.index[0])
                 cache_end = userdata.get('end', cached_frame.index[-1])
                 cache_columns = cached_frame.columns
-                requested_columns = pd.Index(flds)
-                missing_columns = requested_columns - cache_columns
-                dirty = 0
+                missing_columns = [c for c in flds if c not in cache_columns]
                 # Ensure any currently stored fields are kept in synch with dates
                 if start < cache_start:
                     self.logger.info('%s request for %s is older than data in cache %s' % (sid, ','.join(cache_columns),
                                                                                            cache_start))
-                    previous = self.dm.get_historical(sid, cache_columns, start, cache_start)
-                    # Easy way to ensure we don't dup data
-                    previous = previous.ix[previous.index < cache_start]
-                    if len(previous.index) > 0:
-                        cached_frame = pd.concat([previous, cached_frame])
-                        dirty = 1
+                    gaps['previous'] = (tuple(cache_columns), start, cache_start)
                 if end > cache_end:
                     ccols = ','.join(cache_columns)
                     self.logger.info('%s request for %s is more recent than data in cache %s' % (sid, ccols, cache_end))
-                    post = self.dm.get_historical(sid, cache_columns, cache_end, end)
-                    # Easy way to ensure we don't dup data
-                    post = post.ix[post.index > cache_end]
-                    if len(post.index) > 0:
-                        cached_frame = pd.concat([cached_frame, post])
-                        dirty = 1
-
-                if dirty:
-                    cached_frame.sort_index()
-
-                if len(missing_columns) > 0:
+                    gaps['post'] = (tuple(cache_columns), cache_end, end)
+                if missing_columns:
                     # For missing need to get maximum range to match cache. Don't want to manage pieces
                     self.logger.info('%s: %s not in cache, requested for dates %s to %s' % (sid,
                                                                                             ','.join(missing_columns),
                                                                                             min(cache_start, start),
                                                                                             max(cache_end, end)))
-                    newdata = self.dm.get_historical(sid, missing_columns, min(cache_start, start), max(end, cache_end))
-                    cached_frame = pd.concat([cached_frame, newdata], axis=1)
-                    dirty = 1
-
-                dirty and self.storage.set(key, cached_frame, start=min(cache_start, start), end=max(cache_end, end))
-                frames[sid] = cached_frame.ix[start:end, flds]
+                    gaps['columns'] = (tuple(missing_columns), min(cache_start, start), max(end, cache_end))
+            for req in gaps.values():
+                requests.setdefault(req, []).append(sid)
+            plans.append((sid, key, cached_frame, cache_start, cache_end, gaps))
+
+        results = self._fetch_historical(requests, period=period, **overrides)
+
+        # Merge the fetched pieces with the cache, sorting once per sid, and store the updates in a single batch
+        frames = OrderedDict()
+        updates = []
+        for sid, key, cached_frame, cache_start, cache_end, gaps in plans:
+            fetched = dict((kind, results[req][sid]) for kind, req in gaps.items())
+            if cached_frame is None:
+                frame = fetched['all']
+                updates.append((key, frame, dict(start=start, end=end)))
+                frames[sid] = frame
+                continue
+
+            rows = [cached_frame]
+            if 'previous' in fetched:
+                # Easy way to ensure we don't dup data
+                previous = fetched['previous']
+                previous = previous.ix[previous.index < cache_start]
+                if len(previous.index) > 0:
+                    rows.insert(0, previous)
+            if 'post' in fetched:
+                post = fetched['post']
+                post = post.ix[post.index > cache_end]
+                if len(post.index) > 0:
+                    rows.append(post)
+            if len(rows) > 1:
+                cached_frame = pd.concat(rows).sort_index()
+            if 'columns' in fetched:
+                cached_frame = pd.concat([cached_frame, fetched['columns']], axis=1)
+            if gaps:
+                updates.append((key, cached_frame, dict(start=min(cache_start, start), end=max(cache_end, end))))
+            frames[sid] = cached_frame.ix[start:end, flds]
+        updates and self.storage.set_many(updates)
 
         if is_str:
             return frames[sids[0]]
@@ -450,7 +551,3 @@ class CachedDataManager(DataManager):
             if is_fld_str:
                 result.columns = result.columns.droplevel(1)
             return result
-
-
-
-
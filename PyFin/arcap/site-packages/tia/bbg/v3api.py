@@ -1,5 +1,8 @@
-from collections import defaultdict, namedtuple
-from datetime import datetime
+from collections import defaultdict, namedtuple, OrderedDict, deque
+from datetime import datetime, date
+import copy
+import itertools
+import threading
 
 import blpapi
 import pandas as pd
@@ -15,7 +18,7 @@ FieldError = namedtuple('FieldError', FieldErrorAttrs)
 
 logger = log.get_logger(__name__)
 
-__all__ = ['Terminal']
+__all__ = ['Terminal', 'PooledTerminal']
 
 
 class XmlHelper(object):
@@ -190,6 +193,164 @@ def debug_event(evt):
             print msg.Print
 
 
+# int64 value of NaT
+_NAT = np.iinfo(np.int64).min
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def _datetime_ns(v):
+    """Return the date or datetime as int64 nanoseconds since the epoch (UTC if the datetime has a timezone)"""
+    secs = (date(v.year, v.month, v.day).toordinal() - _EPOCH_ORDINAL) * 86400
+    if isinstance(v, datetime):
+        offset = v.utcoffset()
+        secs += v.hour * 3600 + v.minute * 60 + v.second - (offset and int(offset.total_seconds()) or 0)
+        return secs * 1000000000 + v.microsecond * 1000
+    return secs * 1000000000
+
+
+class ColumnBuffer(object):
+    """Growable typed array holding the values of a single field.
+
+    The type is set by the blpapi datatype of the first value appended: integers are stored as int64 (promoted to
+    float64 once a value is missing), other numbers as float64, dates and datetimes as int64 nanoseconds and
+    anything else as object.
+    """
+    # blpapi datatype to buffer kind
+    KINDS = {3: 'i', 4: 'i', 5: 'i', 6: 'f', 7: 'f', 12: 'f', 10: 'M', 13: 'M'}
+    MISSING = {'i': np.nan, 'f': np.nan, 'M': _NAT, 'O': np.nan}
+    DTYPES = {'i': np.int64, 'f': np.float64, 'M': np.int64, 'O': object}
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.kind = None
+        self.values = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, n):
+        if self.values is not None and self.size + n > len(self.values):
+            capacity = max(2 * len(self.values), self.size + n)
+            values = np.empty(capacity, dtype=self.values.dtype)
+            values[:self.size] = self.values[:self.size]
+            self.values = values
+
+    def _set_kind(self, kind):
+        """Allocate the buffer or convert it to hold values of kind"""
+        if self.kind is None:
+            # values appended before the type was known are all missing
+            if self.size:
+                kind = 'f' if kind == 'i' else kind
+            self.values = np.empty(max(self.capacity, self.size), dtype=self.DTYPES[kind])
+            self.size and self.values[:self.size].fill(self.MISSING[kind])
+        elif kind == 'f' and self.kind == 'i':
+            self.values = self.values.astype(np.float64)
+        else:
+            kind = 'O'
+            values = self.as_array()
+            values = list(pd.DatetimeIndex(values)) if self.kind == 'M' else values.tolist()
+            self.values = np.array(values + [None] * (len(self.values) - self.size), dtype=object)
+        self.kind = kind
+
+    def append(self, ele):
+        """Append the value of the blpapi element"""
+        dtype = ele.datatype()
+        kind = self.KINDS.get(dtype, 'O')
+        if kind == 'M' and ele.isNull():
+            return self.append_missing()
+        if kind != self.kind and self.kind != 'O' and not (kind == 'i' and self.kind == 'f'):
+            self._set_kind(kind)
+
+        self._reserve(1)
+        if self.kind == 'M':
+            v = ele.getValue()
+            if v and not isinstance(v, date):
+                # datetime with only the time set
+                self._set_kind('O')
+                return self.append(ele)
+            self.values[self.size] = _datetime_ns(v) if v else _NAT
+        elif self.kind == 'O':
+            self.values[self.size] = XmlHelper.as_value(ele)
+        else:
+            self.values[self.size] = ele.getValue()
+        self.size += 1
+
+    def append_missing(self, n=1):
+        if self.kind == 'i':
+            self._set_kind('f')
+        if self.kind is not None:
+            self._reserve(n)
+            self.values[self.size:self.size + n] = self.MISSING[self.kind]
+        self.size += n
+
+    def as_array(self):
+        """Return a copy of the values, dates and datetimes as datetime64[ns]"""
+        if self.kind is None:
+            return np.repeat(np.nan, self.size)
+        values = self.values[:self.size].copy()
+        return values.view('M8[ns]') if self.kind == 'M' else values
+
+    def reset(self):
+        """Remove the values but keep the allocated buffer"""
+        self.size = 0
+
+
+class ColumnarBuilder(object):
+    """Builds a frame from rows of blpapi elements by appending each child element to a ColumnBuffer per field
+    rather than building a python object per value.
+
+    fields: ordered field names, further fields are added as they are seen
+    sort_columns: if True, frames have their columns sorted by name rather than in the order the fields were seen
+    """
+
+    def __init__(self, fields=None, capacity=1024, sort_columns=0):
+        self.capacity = capacity
+        self.sort_columns = sort_columns
+        self.columns = OrderedDict((f, ColumnBuffer(capacity)) for f in fields or [])
+        self.nrows = 0
+
+    def __len__(self):
+        return self.nrows
+
+    def _column(self, name):
+        column = self.columns.get(name)
+        if column is None:
+            column = self.columns[name] = ColumnBuffer(self.capacity)
+            column.append_missing(self.nrows)
+        return column
+
+    def append_row(self, node, names=None):
+        """Append the child elements of node, names restricts the row to those children"""
+        if names is None:
+            for i in range(node.numElements()):
+                ele = node.getElement(i)
+                self._column(str(ele.name())).append(ele)
+        else:
+            for name in names:
+                if node.hasElement(name):
+                    self._column(name).append(node.getElement(name))
+        self.nrows += 1
+        for column in self.columns.values():
+            if column.size < self.nrows:
+                column.append_missing()
+
+    def as_frame(self, index=None):
+        """Return the rows as a DataFrame, index is an optional field to use as the index"""
+        data = OrderedDict((name, column.as_array()) for name, column in self.columns.items())
+        idx = None if index is None else pd.Index(data.pop(index), name=index)
+        columns = sorted(data.keys()) if self.sort_columns else list(data.keys())
+        return pd.DataFrame(data, index=idx, columns=columns)
+
+    def pop_frame(self, index=None):
+        """Return the rows as a DataFrame and remove them from the builder"""
+        frame = self.as_frame(index=index)
+        for column in self.columns.values():
+            column.reset()
+        self.nrows = 0
+        return frame
+
+
 class Request(object):
     def __init__(self, svcname, ignore_security_error=0, ignore_field_error=0):
         self.field_errors = []
@@ -266,6 +427,15 @@ class HistoricalDataResponse(object):
         frame = pd.concat(frames, keys=sids, axis=1)
         return frame
 
+    def pop_chunk(self, chunksize, final=0):
+        """Return the securities completed so far as a Multi-Index DataFrame, once they hold chunksize rows or on
+        the final chunk, and remove them from the response"""
+        nrows = sum(len(frame) for frame in self.response_map.values())
+        if self.response_map and (final or nrows >= chunksize):
+            frame = self.as_frame()
+            self.response_map = {}
+            return frame
+
 
 class HistoricalDataRequest(Request):
     """A class which manages the creation of the Bloomberg HistoricalDataRequest and
@@ -366,17 +536,15 @@ class HistoricalDataRequest(Request):
         """process a securityData node - FIXME: currently not handling relateDate node """
         sid = XmlHelper.get_child_value(node, 'security')
         farr = node.getElement('fieldData')
-        dmap = defaultdict(list)
+        names = ['date'] + self.fields
+        builder = ColumnarBuilder(names, capacity=max(farr.numValues(), 1))
         for i in range(farr.numValues()):
-            pt = farr.getValue(i)
-            [dmap[f].append(XmlHelper.get_child_value(pt, f, allow_missing=1)) for f in ['date'] + self.fields]
+            builder.append_row(farr.getValue(i), names)
 
-        if not dmap:
+        if not len(builder):
             frame = pd.DataFrame(columns=self.fields)
         else:
-            idx = dmap.pop('date')
-            frame = pd.DataFrame(dmap, columns=self.fields, index=idx)
-            frame.index.name = 'date'
+            frame = builder.as_frame(index='date')
         self.response.on_security_complete(sid, frame)
 
     def on_event(self, evt, is_final):
@@ -467,11 +635,18 @@ class ReferenceDataRequest(Request):
 class IntradayTickResponse(object):
     def __init__(self, request):
         self.request = request
-        self.ticks = []  # array of dicts
+        # columns sorted by name as DataFrame.from_records did with the tick dicts
+        self.ticks = ColumnarBuilder(capacity=16384, sort_columns=1)
 
     def as_frame(self):
         """Return a data frame with no set index"""
-        return pd.DataFrame.from_records(self.ticks)
+        return self.ticks.as_frame()
+
+    def pop_chunk(self, chunksize, final=0):
+        """Return the ticks received so far as a DataFrame, once there are chunksize ticks or on the final chunk,
+        and remove them from the response"""
+        if len(self.ticks) and (final or len(self.ticks) >= chunksize):
+            return self.ticks.pop_frame()
 
 
 class IntradayTickRequest(Request):
@@ -523,10 +698,9 @@ class IntradayTickRequest(Request):
 
     def on_tick_data(self, ticks):
         """Process the incoming tick data array"""
+        builder = self.response.ticks
         for tick in XmlHelper.node_iter(ticks):
-            names = [str(tick.getElement(_).name()) for _ in range(tick.numElements())]
-            tickmap = {n: XmlHelper.get_child_value(tick, n) for n in names}
-            self.response.ticks.append(tickmap)
+            builder.append_row(tick)
 
     def on_event(self, evt, is_final):
         for msg in XmlHelper.message_iter(evt):
@@ -682,10 +856,25 @@ class EQSRequest(Request):
                     self.on_security_node(node)
 
 
+class SessionFailure(Exception):
+    """Raised when a session is terminated or loses its connection while requests are outstanding, or when it fails
+    to open a service or send a request"""
+
+
+# session status messages which mean the session can no longer be used
+_SESSION_DOWN = ('SessionTerminated', 'SessionConnectionDown', 'SessionStartupFailure')
+
+
+def _is_session_down(evt):
+    """Return True if the event reports the session can no longer be used"""
+    return evt.eventType() == blpapi.Event.SESSION_STATUS and any(m.messageType() in _SESSION_DOWN for m in evt)
+
+
 class Terminal(object):
     """Submits requests to the Bloomberg Terminal and dispatches the events back to the request
     object for processing.
     """
+    _cids = itertools.count(1)
 
     def __init__(self, host, port):
         self.host = host
@@ -702,35 +891,145 @@ class Terminal(object):
         opts.setServerPort(self.port)
         return blpapi.Session(opts)
 
+    @staticmethod
+    def _get_service(session, svcname, services):
+        """Return the service from services (dict of name to service), opening it on the session if needed"""
+        if svcname not in services:
+            try:
+                opened = session.openService(svcname)
+            except blpapi.Exception as e:
+                raise SessionFailure('failed to open service %s: %s' % (svcname, e))
+            if not opened:
+                raise Exception('failed to open service %s' % svcname)
+            services[svcname] = session.getService(svcname)
+        return services[svcname]
+
+    def _run(self, session, requests, services, max_pending=None):
+        for _ in self._iter_run(session, requests, services, max_pending=max_pending):
+            pass
+
+    def _iter_run(self, session, requests, services, max_pending=None):
+        """Send the requests on the session, each with its own correlation id, and dispatch the response messages to
+        the request they correlate to until every request has its final response. If max_pending is set, no more
+        than max_pending requests are outstanding at a time. Yields after each response event is dispatched."""
+        todo = deque(requests)
+        pending = {}
+        while todo or pending:
+            while todo and not (max_pending and len(pending) >= max_pending):
+                request = todo.popleft()
+                svc = self._get_service(session, request.svcname, services)
+                asbbg = request.get_bbg_request(svc, session)
+                # setup response capture
+                request.new_response()
+                del request.security_errors[:]
+                del request.field_errors[:]
+                cid = next(self._cids)
+                pending[cid] = request
+                try:
+                    session.sendRequest(asbbg, correlationId=blpapi.CorrelationId(cid))
+                except blpapi.Exception as e:
+                    raise SessionFailure('failed to send request: %s' % e)
+
+            evt = session.nextEvent(500)
+            etype = evt.eventType()
+            if etype in (blpapi.Event.RESPONSE, blpapi.Event.PARTIAL_RESPONSE):
+                msgs = OrderedDict()
+                for msg in evt:
+                    cids = [c.value() for c in msg.correlationIds() if c.value() in pending]
+                    cids and msgs.setdefault(cids[0], []).append(msg)
+                for cid, cmsgs in msgs.items():
+                    is_final = etype == blpapi.Event.RESPONSE
+                    pending[cid].on_event(cmsgs, is_final=is_final)
+                    is_final and pending.pop(cid)
+                yield evt
+            elif _is_session_down(evt):
+                raise SessionFailure(', '.join(str(m.messageType()) for m in evt))
+            else:
+                for request in pending.values():
+                    request.on_admin_event(evt)
+
+    def _execute(self, requests, max_pending=None):
+        """Run the requests on a new session"""
+        session = self._create_session()
+        if not session.start():
+            raise Exception('failed to start session')
+
+        try:
+            self._run(session, requests, {}, max_pending=max_pending)
+        finally:
+            session.stop()
+
     def execute(self, request):
+        self.logger.info('executing request: %s' % repr(request))
+        self._execute([request])
+        request.has_exception and request.raise_exception()
+        return request.response
+
+    def iter_chunks(self, request, chunksize=100000):
+        """Execute the request on a new session and yield the response in DataFrame chunks of at least chunksize
+        rows as it arrives, rather than holding all of it until the request completes. Supported for
+        HistoricalDataRequest (chunks of completed securities) and IntradayTickRequest.
+        """
         session = self._create_session()
         if not session.start():
             raise Exception('failed to start session')
 
         try:
-            self.logger.info('executing request: %s' % repr(request))
-            if not session.openService(request.svcname):
-                raise Exception('failed to open service %s' % request.svcname)
-
-            svc = session.getService(request.svcname)
-            asbbg = request.get_bbg_request(svc, session)
-            # setup response capture
-            request.new_response()
-            session.sendRequest(asbbg)
-            while True:
-                evt = session.nextEvent(500)
-                if evt.eventType() == blpapi.Event.RESPONSE:
-                    request.on_event(evt, is_final=True)
-                    break
-                elif evt.eventType() == blpapi.Event.PARTIAL_RESPONSE:
-                    request.on_event(evt, is_final=False)
-                else:
-                    request.on_admin_event(evt)
+            self.logger.info('executing request in chunks: %s' % repr(request))
+            for _ in self._iter_run(session, [request], {}):
+                chunk = request.response.pop_chunk(chunksize)
+                if chunk is not None:
+                    yield chunk
             request.has_exception and request.raise_exception()
-            return request.response
+            chunk = request.response.pop_chunk(chunksize, final=1)
+            if chunk is not None:
+                yield chunk
         finally:
             session.stop()
 
+    @staticmethod
+    def _split(request, max_sids):
+        """Return the requests to send in place of request so that none has more than max_sids sids"""
+        sids = getattr(request, 'sids', None)
+        if not max_sids or not sids or len(sids) <= max_sids:
+            return [request]
+
+        chunks = []
+        for i in range(0, len(sids), max_sids):
+            chunk = copy.copy(request)
+            chunk.sids = sids[i:i + max_sids]
+            chunk.field_errors, chunk.security_errors = [], []
+            chunks.append(chunk)
+        return chunks
+
+    def execute_many(self, requests, max_sids=100, max_pending=16):
+        """Execute the requests concurrently on one session and return the list of responses.
+
+        :param requests: list of Request
+        :param max_sids: requests with more than max_sids sids are sent as several requests of at most max_sids sids
+                         and their responses combined. None to never split a request.
+        :param max_pending: maximum number of requests outstanding on the session at a time, None for no limit
+        """
+        requests = list(requests)
+        chunks = [self._split(request, max_sids) for request in requests]
+        self.logger.info('executing %s requests as %s' % (len(requests), sum(len(c) for c in chunks)))
+        self._execute([chunk for c in chunks for chunk in c], max_pending=max_pending)
+
+        for request, rchunks in zip(requests, chunks):
+            if rchunks[0] is not request:
+                # requests with sids keep their results keyed by sid in response_map
+                request.new_response()
+                del request.security_errors[:]
+                del request.field_errors[:]
+                for chunk in rchunks:
+                    request.response.response_map.update(chunk.response.response_map)
+                    request.security_errors.extend(chunk.security_errors)
+                    request.field_errors.extend(chunk.field_errors)
+
+        for request in requests:
+            request.has_exception and request.raise_exception()
+        return [request.response for request in requests]
+
     def get_historical(self, sids, flds, start=None, end=None, period=None, ignore_security_error=0,
                        ignore_field_error=0, **overrides):
         req = HistoricalDataRequest(sids, flds, start=start, end=end, period=period,
@@ -772,6 +1071,105 @@ class Terminal(object):
         return self.execute(req)
 
 
+class _PooledSession(object):
+    def __init__(self, session):
+        self.session = session
+        # services already opened on the session
+        self.services = {}
+
+
+class PooledTerminal(Terminal):
+    """Terminal which keeps up to size started sessions, with their services opened, and reuses them across requests
+    rather than starting a session per request. Each request is sent with its own correlation id. If a session
+    fails, it is stopped and the request is retried on a new session up to retries times.
+    """
+
+    def __init__(self, host, port, size=1, retries=1):
+        Terminal.__init__(self, host, port)
+        self.size = size
+        self.retries = retries
+        self._idle = []
+        self._nsessions = 0
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def _is_alive(session):
+        """Drain the events queued on an idle session, return False if one of them reports the session is down"""
+        evt = session.tryNextEvent()
+        while evt is not None:
+            if _is_session_down(evt):
+                return False
+            evt = session.tryNextEvent()
+        return True
+
+    def _acquire(self):
+        while True:
+            with self._cond:
+                while not self._idle and self._nsessions >= self.size:
+                    self._cond.wait()
+                pooled = self._idle.pop() if self._idle else None
+                if pooled is None:
+                    self._nsessions += 1
+
+            if pooled is None:
+                break
+            elif self._is_alive(pooled.session):
+                return pooled
+            self.logger.warn('pooled session is down, discarding it')
+            self._release(pooled, discard=1)
+
+        try:
+            session = self._create_session()
+            if not session.start():
+                raise Exception('failed to start session')
+            return _PooledSession(session)
+        except Exception:
+            self._release(None, discard=1)
+            raise
+
+    def _release(self, pooled, discard=0):
+        with self._cond:
+            if discard:
+                self._nsessions -= 1
+            else:
+                self._idle.append(pooled)
+            self._cond.notify()
+
+        if discard and pooled is not None:
+            try:
+                pooled.session.stop()
+            except Exception:
+                self.logger.exception('failed to stop session')
+
+    def _execute(self, requests, max_pending=None):
+        """Run the requests on a pooled session, retrying on a new session if the session fails"""
+        attempt = 0
+        while True:
+            pooled = self._acquire()
+            try:
+                self._run(pooled.session, requests, pooled.services, max_pending=max_pending)
+            except SessionFailure as e:
+                self._release(pooled, discard=1)
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                self.logger.warn('session failed (%s), retrying on a new session' % e)
+                continue
+            except Exception:
+                # unknown state, responses may still be outstanding on the session
+                self._release(pooled, discard=1)
+                raise
+            self._release(pooled)
+            return
+
+    def close(self):
+        """Stop the idle sessions"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            self._release(pooled, discard=1)
+
+
 class SyncSubscription(object):
     def __init__(self, tickers, fields, interval=None, host='localhost', port=8194):
         self.fields = isinstance(fields, basestring) and [fields] or fields
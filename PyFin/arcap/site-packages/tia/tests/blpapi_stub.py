@@ -0,0 +1,260 @@
+"""
+Local stand-in for the parts of blpapi used by tia.bbg.v3api.Terminal, so session handling can be tested without a
+Bloomberg connection.
+
+Session.responder(request) returns the list of responses for a request, each response a list of message payloads. All
+but the last response are delivered as PARTIAL_RESPONSE events and the last as a RESPONSE event. Events for
+different correlation ids are interleaved. Setting Session.fail_next makes the next request get a SessionTerminated
+status event instead of its responses. Session.kill() terminates a session: it queues a SessionTerminated status
+event (unless notify is false) and later calls to openService and sendRequest raise InvalidStateException, which
+like the blpapi exceptions derives from Exception.
+
+Message payloads built with element(name, value) are returned by Message.asElement/getElement. A dict (use an
+OrderedDict to keep the order) becomes an element with a child per item and a list becomes an array element.
+"""
+import threading
+from datetime import date, datetime
+
+
+class Exception(Exception):
+    pass
+
+
+class InvalidStateException(Exception):
+    pass
+
+
+class Event(object):
+    ADMIN = 1
+    SESSION_STATUS = 2
+    SUBSCRIPTION_STATUS = 3
+    REQUEST_STATUS = 4
+    RESPONSE = 5
+    PARTIAL_RESPONSE = 6
+    SUBSCRIPTION_DATA = 8
+    SERVICE_STATUS = 9
+    TIMEOUT = 10
+
+    def __init__(self, etype, msgs=None):
+        self.etype = etype
+        self.msgs = list(msgs or [])
+
+    def eventType(self):
+        return self.etype
+
+    def __iter__(self):
+        return iter(self.msgs)
+
+
+class CorrelationId(object):
+    def __init__(self, value=None):
+        self._value = value
+
+    def value(self):
+        return self._value
+
+
+def _datatype(value):
+    if isinstance(value, bool):
+        return 1
+    elif isinstance(value, int):
+        return 5
+    elif isinstance(value, float):
+        return 7
+    elif isinstance(value, datetime):
+        return 13
+    elif isinstance(value, date):
+        return 10
+    return 8
+
+
+class Element(object):
+    def __init__(self, name, value=None, datatype=None, elements=None, values=None):
+        self._name = name
+        self.value = value
+        self.elements = elements
+        self.values = values
+        if datatype is None:
+            datatype = 15 if elements is not None else _datatype(value)
+        self._datatype = datatype
+
+    def name(self):
+        return self._name
+
+    def datatype(self):
+        return self._datatype
+
+    def isNull(self):
+        return self.value is None and self.elements is None and self.values is None
+
+    def isArray(self):
+        return self.values is not None
+
+    def numValues(self):
+        return len(self.values) if self.values is not None else 1
+
+    def getValue(self, index=0):
+        return self.values[index] if self.values is not None else self.value
+
+    def numElements(self):
+        return len(self.elements or [])
+
+    def hasElement(self, name):
+        return any(e.name() == name for e in self.elements or [])
+
+    def getElement(self, key):
+        if isinstance(key, int):
+            return self.elements[key]
+        for e in self.elements or []:
+            if e.name() == key:
+                return e
+        raise KeyError(key)
+
+
+def element(name, value, datatype=None):
+    """Build an Element from a python value"""
+    if isinstance(value, dict):
+        return Element(name, elements=[element(k, v) for k, v in value.items()])
+    elif isinstance(value, list):
+        return Element(name, values=[element(name, v) for v in value], datatype=15)
+    return Element(name, value, datatype=datatype)
+
+
+class Message(object):
+    def __init__(self, msgtype, data=None, cids=None):
+        self.msgtype = msgtype
+        self.data = data
+        self.cids = list(cids or [])
+
+    def messageType(self):
+        return self.msgtype
+
+    def correlationIds(self):
+        return self.cids
+
+    def asElement(self):
+        return self.data if isinstance(self.data, Element) else Element(self.msgtype, elements=[])
+
+    def getElement(self, name):
+        return self.asElement().getElement(name)
+
+    def toString(self):
+        return '%s = %s' % (self.msgtype, self.data)
+
+
+class Request(dict):
+    def __init__(self, name):
+        dict.__init__(self)
+        self.name = name
+
+    def set(self, name, value):
+        self[name] = value
+
+    def append(self, name, value):
+        self.setdefault(name, []).append(value)
+
+
+class Service(object):
+    def __init__(self, name):
+        self.name = name
+
+    def createRequest(self, name):
+        return Request(name)
+
+
+class SessionOptions(object):
+    def setServerHost(self, host):
+        self.host = host
+
+    def setServerPort(self, port):
+        self.port = port
+
+
+class Session(object):
+    # every Session created, in order
+    instances = []
+    responder = staticmethod(lambda request: [[dict(request)]])
+    fail_next = 0
+    _lock = threading.Lock()
+
+    def __init__(self, options=None):
+        self.options = options
+        self.started = 0
+        self.stopped = 0
+        self.opened = []
+        self.requests = []
+        self.queues = []
+        # session status events not tied to a request
+        self.status = []
+        self.dead = 0
+        # most requests outstanding at once
+        self.max_outstanding = 0
+        with Session._lock:
+            Session.instances.append(self)
+
+    @classmethod
+    def reset(cls):
+        cls.instances = []
+        cls.responder = staticmethod(lambda request: [[dict(request)]])
+        cls.fail_next = 0
+
+    def start(self):
+        self.started = 1
+        return True
+
+    def stop(self):
+        self.stopped = 1
+        return True
+
+    def kill(self, notify=1):
+        self.dead = 1
+        notify and self.status.append(Event(Event.SESSION_STATUS, [Message('SessionTerminated')]))
+
+    def _check_alive(self):
+        if self.dead:
+            raise InvalidStateException('session is terminated')
+
+    def openService(self, name):
+        self._check_alive()
+        self.opened.append(name)
+        return True
+
+    def getService(self, name):
+        return Service(name)
+
+    def sendRequest(self, request, identity=None, correlationId=None, eventQueue=None, requestLabel=''):
+        self._check_alive()
+        self.requests.append(request)
+        with Session._lock:
+            fail, Session.fail_next = Session.fail_next, 0
+        if fail:
+            msg = Message('SessionTerminated')
+            self.queues.append([Event(Event.SESSION_STATUS, [msg])])
+        else:
+            responses = Session.responder(request)
+            events = []
+            for i, payloads in enumerate(responses):
+                etype = Event.RESPONSE if i == len(responses) - 1 else Event.PARTIAL_RESPONSE
+                msgs = [Message(request.name, data, [correlationId]) for data in payloads]
+                events.append(Event(etype, msgs))
+            self.queues.append(events)
+        self.max_outstanding = max(self.max_outstanding, len(self.queues))
+        return correlationId
+
+    def tryNextEvent(self):
+        if self.status:
+            return self.status.pop(0)
+        evt = self.nextEvent()
+        return None if evt.eventType() == Event.TIMEOUT else evt
+
+    def nextEvent(self, timeout=0):
+        if self.status:
+            return self.status.pop(0)
+        # round robin across the outstanding requests
+        while self.queues:
+            queue = self.queues.pop(0)
+            if queue:
+                evt = queue.pop(0)
+                queue and self.queues.append(queue)
+                return evt
+        return Event(Event.TIMEOUT)
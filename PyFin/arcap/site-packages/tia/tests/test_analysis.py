@@ -3,6 +3,8 @@ import pandas as pd
 import pandas.util.testing as pdtest
 import numpy as np
 from tia.analysis.model import *
+from tia.analysis.model.pl import OpenAverageProfitAndLossCalculator
+from tia.analysis.model.ret import return_on_initial_capital
 
 
 class TestAnalysis(unittest.TestCase):
@@ -121,3 +123,259 @@ class TestAnalysis(unittest.TestCase):
         pdtest.assert_series_equal(port.pl.ltd_dly, port.long.pl.ltd_dly + port.short.pl.ltd_dly)
         pdtest.assert_series_equal(port.pl.monthly, port.long.pl.monthly + port.short.pl.monthly)
         pdtest.assert_series_equal(port.pl.ltd_monthly, port.long.pl.ltd_monthly + port.short.pl.ltd_monthly)
+
+    def test_batch_pl(self):
+        t1 = Trade(1, '12/8/2014', 5., 10., -1.)
+        t2 = Trade(2, '12/10/2014', -3., 5., -1.)
+        t3 = Trade(3, '12/12/2014', -6., 20., -1.)
+        t4 = Trade(4, '12/17/2014', 4., 15., 0)
+        s1 = PortfolioPricer(multiplier=2., closing_pxs=self.closing_pxs, dvds=self.dvds)
+        s2 = PortfolioPricer(multiplier=1., closing_pxs=self.closing_pxs * 2.)
+        s3 = PortfolioPricer(multiplier=1., closing_pxs=self.closing_pxs)
+        ports = {'A': SingleAssetPortfolio(s1, [t1, t2, t3, t4]),
+                 'B': SingleAssetPortfolio(s2, [t1, t3]),
+                 'C': SingleAssetPortfolio(s3, [])}
+        txns = dict([(k, p.txns) for k, p in ports.iteritems()])
+        results = BatchOpenAverageProfitAndLossCalculator().compute(txns)
+        self.assertEqual(sorted(results.keys()), ['A', 'B', 'C'])
+        for k, p in ports.iteritems():
+            pdtest.assert_frame_equal(results[k], OpenAverageProfitAndLossCalculator().compute(p.txns))
+
+    def test_txns_extend(self):
+        t1 = Trade(1, '12/8/2014', 5., 10., -1.)
+        t2 = Trade(2, '12/8/2014', 2., 15., -1.)
+        t3 = Trade(3, '12/10/2014', -3., 5., -1.)
+        t4 = Trade(4, '12/12/2014', -8., 20., -1.)
+        t5 = Trade(5, '12/16/2014', 4., 10., 0)
+        sec = PortfolioPricer(multiplier=2., closing_pxs=self.closing_pxs, dvds=self.dvds)
+        partial = PortfolioPricer(multiplier=2., closing_pxs=self.closing_pxs.truncate(after='12/11/2014'),
+                                  dvds=self.dvds)
+        full = Txns([t1, t2, t3, t4, t5], sec)
+        txns = Txns([t1, t2, t3], partial)
+        # force the pl and returns to be computed so they are extended
+        txns.pl.txn_frame
+        txns.performance
+        ext = txns.extend([t4, t5], sec)
+        pdtest.assert_frame_equal(ext.frame, full.frame)
+        pdtest.assert_frame_equal(ext.pl.ltd_txn_frame, full.pl.ltd_txn_frame)
+        pdtest.assert_frame_equal(ext.pl.txn_frame, full.pl.txn_frame)
+        pdtest.assert_series_equal(ext.performance.txn, full.performance.txn)
+        self.assertRaises(ValueError, lambda: ext.extend([t1]))
+
+        # columnar txns are extended without building the trades
+        trds = [t1, t2, t3]
+        cols = pd.DataFrame({'tid': [t.tid for t in trds], 'ts': [t.ts for t in trds], 'qty': [t.qty for t in trds],
+                             'px': [t.px for t in trds], 'fees': [t.fees for t in trds]})
+        ext = Txns(cols, sec).extend([t4, t5])
+        self.assertFalse(hasattr(ext, '_trades'))
+        pdtest.assert_frame_equal(ext.frame, full.frame)
+        self.assertRaises(ValueError, lambda: ext.extend([t1]))
+
+    def test_columnar_txns(self):
+        t1 = Trade(1, '12/8/2014', 5., 10., -1.)
+        t2 = Trade(2, '12/8/2014', 2., 15., -1.)
+        t3 = Trade(3, '12/10/2014', -3., 5., -1.)
+        t4 = Trade(4, '12/12/2014', -8., 20., -1.)
+        t5 = Trade(5, '12/16/2014', 4., 10., 0)
+        sec = PortfolioPricer(multiplier=2., closing_pxs=self.closing_pxs, dvds=self.dvds)
+        trds = [t1, t2, t3, t4, t5]
+        cols = pd.DataFrame({'tid': [t.tid for t in trds], 'ts': [t.ts for t in trds], 'qty': [t.qty for t in trds],
+                             'px': [t.px for t in trds], 'fees': [t.fees for t in trds]})
+        expected = Txns(trds, sec)
+        for trades in [cols, cols.to_records(index=False)]:
+            txns = Txns(trades, sec)
+            pdtest.assert_frame_equal(txns.frame, expected.frame)
+            self.assertEqual([t.qty for t in txns.trades], [t.qty for t in expected.trades])
+            self.assertEqual([t.fees for t in txns.trades], [t.fees for t in expected.trades])
+
+    def test_trade_store(self):
+        store = TradeStore(capacity=1)
+        blotter = TradeBlotter(store=store)
+        blotter.ts = pd.to_datetime('12/8/2014')
+        blotter.open(qty=2., px=10.)
+        blotter.ts = pd.to_datetime('12/10/2014')
+        blotter.close(px=11., note='exit')
+        blotter.ts = pd.to_datetime('12/12/2014')
+        blotter.open(qty=-3., px=12., fees=-1.)
+        self.assertEqual(3, len(store))
+        self.assertEqual(-3., store[-1].qty)
+        self.assertEqual({'exit'}, {t.kwargs.get('note') for t in store} - {None})
+        trd = store[0]
+        trd.kwargs = {'note': 'entry'}
+        self.assertEqual('entry', trd.kwargs['note'])
+        trds = list(store)
+        self.assertEqual([1, 2, 3], [t.tid for t in trds])
+        self.assertEqual(pd.to_datetime('12/10/2014'), trds[1].ts)
+        self.assertEqual(-1., trds[2].fees)
+
+        sec = PortfolioPricer(multiplier=2., closing_pxs=self.closing_pxs, dvds=self.dvds)
+        expected = Txns(trds, sec).frame
+        pdtest.assert_frame_equal(Txns(store, sec).frame, expected)
+        bulk = TradeStore.from_arrays(store.tid, store.ts, store.qty, store.px, store.fees)
+        self.assertFalse(bulk.has_kwargs)
+        pdtest.assert_frame_equal(SingleAssetPortfolio(sec, bulk).txns.frame, expected)
+
+    def test_positions_frame(self):
+        t1 = Trade(1, '12/8/2014', 5., 10., -1.)
+        t2 = Trade(2, '12/8/2014', 2., 15., -1.)
+        t3 = Trade(3, '12/10/2014', -3., 5., -1.)
+        t4 = Trade(4, '12/12/2014', -8., 20., -1.)
+        t5 = Trade(5, '12/16/2014', 4., 10., 0)
+        sec = PortfolioPricer(multiplier=2., closing_pxs=self.closing_pxs, dvds=self.dvds)
+        port = SingleAssetPortfolio(sec, [t1, t2, t3, t4, t5])
+        frame = port.positions.frame
+        self.assertEqual([1, 2], list(frame.index))
+        for pid in frame.index:
+            pos = port.positions[pid]
+            row = frame.ix[pid]
+            self.assertEqual(pos.side, row[PositionColumns.SIDE])
+            self.assertEqual(pos.state, row[PositionColumns.STATE])
+            self.assertEqual(pos.open_dt, row[PositionColumns.OPEN_DT])
+            self.assertEqual(pos.close_dt, row[PositionColumns.CLOSE_DT])
+            self.assertEqual(pos.duration, row[PositionColumns.DURATION])
+            self.assertEqual(pos.ntxns, row[PositionColumns.NUM_TXNS])
+            self.assertAlmostEqual(pos.pl.ltd_txn.iloc[-1], row[PositionColumns.PL])
+            self.assertAlmostEqual(pos.performance.ltd_txn.iloc[-1], row[PositionColumns.RET])
+
+    def test_roii_leverage(self):
+        t1 = Trade(1, '12/8/2014', 5., 10., -1.)
+        t2 = Trade(2, '12/10/2014', -5., 12., -1.)
+        t3 = Trade(3, '12/12/2014', -4., 14., -1.)
+        t4 = Trade(4, '12/16/2014', 4., 10., 0)
+        sec = PortfolioPricer(multiplier=2., closing_pxs=self.closing_pxs, dvds=self.dvds)
+        lev = pd.Series([2., 3.], index=[pd.to_datetime('12/1/2014'), pd.to_datetime('12/11/2014')])
+        port = SingleAssetPortfolio(sec, [t1, t2, t3, t4], ret_calc=RoiiRetCalculator(leverage=lev))
+        txnpl = port.pl.txn_frame
+        rets = port.performance.txn
+        for pid, cost, lvg in [(1, 100., 2.), (2, 112., 3.)]:
+            mask = (txnpl.pid == pid).values
+            expected = return_on_initial_capital(cost, txnpl.pl[mask], lvg)
+            self.assertTrue(np.allclose(expected.values, rets.values[mask]))
+        self.assertTrue((rets.values[(txnpl.pid == 0).values] == 0).all())
+
+    def test_aum_rets(self):
+        t1 = Trade(1, '12/8/2014', 5., 10., -1.)
+        t2 = Trade(2, '12/12/2014', -5., 12., -1.)
+        t3 = Trade(3, '12/16/2014', 4., 14., -1.)
+        sec = PortfolioPricer(multiplier=2., closing_pxs=self.closing_pxs, dvds=self.dvds)
+        port = SingleAssetPortfolio(sec, [t1, t2, t3])
+        ltd = port.pl.ltd_txn
+        # weekly resets
+        calc = FixedAumRetCalculator(1000., reset_freq='W')
+        rets = calc.compute(port.txns).txn
+        eod = 1000. + ltd
+        weeks = ltd.index.to_period('W').asi8
+        starts = np.append(True, weeks[1:] != weeks[:-1])
+        sod = np.where(starts, 1000., eod.shift(1))
+        self.assertTrue(np.allclose(rets.values, eod.values / sod - 1.))
+        self.assertTrue(np.allclose(calc.external_cash_flows.values, eod.values[np.append(starts[1:], True)] - 1000.))
+
+        calc = AumRetCalculator(1000., freq='W')
+        rets = calc.compute(port.txns).txn
+        sops = 1000. + np.append(0, ltd.values[np.append(starts[1:], True)][:-1]).cumsum()
+        eod = sops[starts.cumsum() - 1] + ltd.values
+        sod = np.where(starts, sops[starts.cumsum() - 1], np.append(np.nan, eod[:-1]))
+        self.assertTrue(np.allclose(calc.txn_aum.values, sod))
+        self.assertTrue(np.allclose(rets.values, eod / sod - 1.))
+
+    def test_portfolio_view(self):
+        t1 = Trade(1, '12/8/2014', 5., 10., -1.)
+        t2 = Trade(2, '12/10/2014', -8., 12., -1.)
+        t3 = Trade(3, '12/12/2014', 5., 14., -1.)
+        t4 = Trade(4, '12/16/2014', 2., 10., 0)
+        sec = PortfolioPricer(multiplier=2., closing_pxs=self.closing_pxs, dvds=self.dvds)
+        port = SingleAssetPortfolio(sec, [t1, t2, t3, t4])
+        view = PortfolioView(port)
+        for sub, vsub in [(port.long, view.long), (port.short, view.short), (port.winner, view.winner)]:
+            pdtest.assert_series_equal(sub.pl.dly, vsub.pl.dly)
+            pdtest.assert_series_equal(sub.performance.dly, vsub.performance.dly)
+            pdtest.assert_frame_equal(sub.positions.frame, vsub.positions.frame)
+            pdtest.assert_frame_equal(sub.pl.txn_frame, vsub.pl.txn_frame)
+            pdtest.assert_series_equal(sub.performance.txn, vsub.performance.txn)
+
+        # excluded rows are cleared and reduced to a mark row per date as in the subset
+        for pids in [[1], [2], [3], [1, 3]]:
+            pdtest.assert_frame_equal(port.subset(pids).pl.txn_frame, view.subset(pids).pl.txn_frame)
+
+        summary = PortfolioSummary().include_long_short()(port, PortfolioSummary.analyze_pl)
+        self.assertEqual(['lvl1'], list(summary.index.names))
+        self.assertEqual(['All', 'long', 'short'], list(summary.index.get_level_values(0)))
+        self.assertAlmostEqual(port.short.pl.monthly_details.ltd_frame.pl.iloc[-1], summary[('port', 'ltd')].iloc[2])
+
+        # custom analyses and splits get the portfolios
+        seen = []
+
+        def analyze(p):
+            seen.append(type(p))
+            return PortfolioSummary.analyze_pl(p)
+
+        def split(p):
+            seen.append(type(p))
+            yield 'all', p
+
+        PortfolioSummary().include_long_short()(port, analyze)
+        summary = PortfolioSummary().add_iter_fct(split)(port, PortfolioSummary.analyze_pl)
+        self.assertEqual([SingleAssetPortfolio] * 4, seen)
+        self.assertEqual(['all'], list(summary.index.get_level_values(0)))
+
+    def test_percentileofscore(self):
+        from tia.analysis.perf import rolling_percentileofscore, expanding_percentileofscore
+
+        s = pd.Series([1., 3., 2., np.nan, 2., 5.])
+        pdtest.assert_series_equal(expanding_percentileofscore(s),
+                                   pd.Series([np.nan, 100., 50., np.nan, 200. / 3., 100.]))
+        pdtest.assert_series_equal(rolling_percentileofscore(s, 3, min_periods=2),
+                                   pd.Series([np.nan, 100., 50., np.nan, 50., 100.]))
+        pdtest.assert_series_equal(rolling_percentileofscore(s, 3),
+                                   pd.Series([np.nan, np.nan, 50., np.nan, 50., 100.]))
+        # columns are computed independently
+        df = pd.DataFrame({'a': s, 'b': s[::-1].values})
+        res = expanding_percentileofscore(df)
+        pdtest.assert_series_equal(res['a'], expanding_percentileofscore(s), check_names=False)
+        pdtest.assert_series_equal(res['b'], expanding_percentileofscore(df['b']), check_names=False)
+
+    def test_drawdown_info(self):
+        from tia.analysis.perf import drawdown_info, drawdowns, max_drawdown
+
+        idx = pd.date_range('1/1/2015', periods=8, freq='B')
+        rets = pd.DataFrame({'a': [.1, -.1, -.1, .3, -.2, .1, 0, 0], 'b': [.1, .1, .1, .1, .1, .1, .1, -.1]}, index=idx)
+        info = drawdown_info(rets)
+        a = info['a'].dropna(how='all')
+        self.assertEqual([idx[1], idx[4]], list(a['dd start']))
+        self.assertEqual([idx[3], idx[7]], list(a['dd end']))
+        self.assertEqual([idx[2], idx[4]], list(a['maxdd dt']))
+        self.assertTrue(np.allclose([.9 * .9 - 1., -.2], a['maxdd'].values))
+        pdtest.assert_frame_equal(a, drawdown_info(rets['a']))
+        self.assertEqual(1, len(info['b'].dropna(how='all')))
+
+        mdd = max_drawdown(rets, inc_date=1)
+        self.assertEqual(['maxdd', 'maxdd_dt'], list(mdd.columns))
+        self.assertAlmostEqual(-.2, mdd.maxdd['a'])
+        self.assertEqual(idx[7], mdd.maxdd_dt['b'])
+        pdtest.assert_series_equal(mdd.maxdd, max_drawdown(rets))
+        mdd, dt = max_drawdown(dd=drawdowns(rets['a']), inc_date=1)
+        self.assertAlmostEqual(-.2, mdd)
+        self.assertEqual(idx[4], dt)
+
+    def test_summarize_returns(self):
+        from tia.analysis.perf import summarize_returns
+
+        idx = pd.period_range('2014-11-03', periods=6, freq='M')
+        rets = pd.DataFrame({'b': [.1, -.1, .2, np.nan, -.2, .1], 'a': [.01, .02, .03, .04, .05, .06]}, index=idx)
+        res = summarize_returns(rets, rollup='Q')
+        self.assertEqual([(2014, 'a'), (2014, 'b'), (2015, 'a'), (2015, 'b'), ('LTD', 'a'), ('LTD', 'b')],
+                         list(res.index))
+        # quarterly roll up within the year
+        self.assertAlmostEqual(1.01 * 1.02 - 1., res.loc[(2014, 'a'), 'quarterly_ret_avg'])
+        self.assertAlmostEqual(1.2 * .8 * 1.1 - 1., res.loc[(2015, 'b'), 'quarterly_ret_cum'])
+        self.assertAlmostEqual(-.2, res.loc[('LTD', 'b'), 'monthly_maxdd'])
+        self.assertEqual(idx[4], res.loc[('LTD', 'b'), 'monthly_maxdd_dt'])
+        self.assertAlmostEqual(0, res.loc[('LTD', 'a'), 'monthly_maxdd'])
+        pdtest.assert_frame_equal(res.xs('b', level=1), summarize_returns(rets['b'], rollup='Q'), check_names=False)
+
+        # sortino matches sortino_ratio, which is NaN without negative returns
+        from tia.analysis.perf import sortino_ratio
+        res = summarize_returns(rets, rollup='M')
+        self.assertAlmostEqual(sortino_ratio(rets['b'].dropna()), res.loc[('LTD', 'b'), 'monthly_sortino'])
+        self.assertTrue(np.isnan(sortino_ratio(rets['a'])))
+        self.assertTrue(res.xs('a', level=1)['monthly_sortino'].isnull().all())
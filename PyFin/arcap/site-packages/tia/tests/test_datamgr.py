@@ -33,9 +33,13 @@ class MockDataManager(object):
         self.access_cnt += 1
         return self.df.ix[sids, flds]
 
-    def get_historical(self, sid, flds, start, end, **overrides):
+    def get_historical(self, sid, flds, start, end, period=None, **overrides):
         self.access_cnt += 1
-        return self.hist[sid].ix[start:end, flds]
+        self.period = period
+        if isinstance(sid, basestring):
+            return self.hist[sid].ix[start:end, flds]
+        else:
+            return pd.concat([self.hist[s].ix[start:end, flds] for s in sid], keys=sid, axis=1)
 
 
 class TestDataManager(unittest.TestCase):
@@ -87,6 +91,20 @@ class TestDataManager(unittest.TestCase):
         # should be since each sid must be made whjole individually
         self.assertEquals(6, self.dm.access_cnt)
 
+    def test_cache_batch_misses(self):
+        cdm = CachedDataManager(self.dm, MemoryStorage(), pd.datetime.now())
+        sids = ['SID1', 'SID2', 'SID3']
+        cdm.get_attributes(sids, 'FLDA')
+        self.assertEquals(1, self.dm.access_cnt)
+        # the sids missing the same fields are requested together
+        res = cdm.get_attributes(sids, ['FLDA', 'FLDC'])
+        pdtest.assert_frame_equal(res, self.dm.df.ix[sids, ['FLDA', 'FLDC']])
+        self.assertEquals(2, self.dm.access_cnt)
+        cdm.get_attributes('SID2', 'FLDB')
+        res = cdm.get_attributes(sids, ['FLDA', 'FLDB', 'FLDC'])
+        pdtest.assert_frame_equal(res, self.dm.df.ix[sids, ['FLDA', 'FLDB', 'FLDC']])
+        self.assertEquals(4, self.dm.access_cnt)
+
     def _do_historical_cache_test(self, storage):
         # Cache pieces and then request entire and ensure cache is built properly
         cdm = CachedDataManager(self.dm, storage, pd.datetime.now())
@@ -112,6 +130,43 @@ class TestDataManager(unittest.TestCase):
         pdtest.assert_frame_equal(res['SID2'], self.dm.hist['SID2'])
         pdtest.assert_frame_equal(res['SID3'], self.dm.hist['SID3'])
 
+    def test_historical_batch_gaps(self):
+        cdm = CachedDataManager(self.dm, MemoryStorage(), pd.datetime.now(), threads=2)
+        sids = ['SID1', 'SID2', 'SID3']
+        start, end = as_date('1/2/2014'), as_date('1/3/2014')
+        res = cdm.get_historical(sids, ['FLDA'], start, end)
+        self.assertEquals(1, self.dm.access_cnt)
+        pdtest.assert_frame_equal(res['SID2'], self.dm.hist['SID2'].ix[start:end, ['FLDA']])
+
+        # sids with the same gaps share requests: one older, one newer and one for the missing column
+        start, end = as_date('1/1/2014'), as_date('1/4/2014')
+        res = cdm.get_historical(sids, ['FLDA', 'FLDC'], start, end)
+        self.assertEquals(4, self.dm.access_cnt)
+        for sid in sids:
+            pdtest.assert_frame_equal(res[sid], self.dm.hist[sid][['FLDA', 'FLDC']])
+
+        res = cdm.get_historical(sids, ['FLDC', 'FLDA'], start, end)
+        self.assertEquals(4, self.dm.access_cnt)
+        pdtest.assert_frame_equal(res['SID3'], self.dm.hist['SID3'][['FLDC', 'FLDA']])
+
+    def test_historical_period_and_empty_rows(self):
+        # SID1 has no data on 1/2
+        self.dm.hist['SID1'].ix['1/2/2014', :] = np.nan
+        start, end = as_date('1/1/2014'), as_date('1/4/2014')
+        key = ('SID1', 'historical', dict(period='WEEKLY'))
+
+        # SID1 fetched alone or sharing a request is cached the same way, with the period passed through
+        single = MemoryStorage()
+        CachedDataManager(self.dm, single, pd.datetime.now()).get_historical('SID1', ['FLDA'], start, end,
+                                                                               period='WEEKLY')
+        self.assertEquals('WEEKLY', self.dm.period)
+        shared = MemoryStorage()
+        CachedDataManager(self.dm, shared, pd.datetime.now()).get_historical(['SID1', 'SID2'], ['FLDA'], start, end,
+                                                                               period='WEEKLY')
+        self.assertEquals('WEEKLY', self.dm.period)
+        pdtest.assert_frame_equal(single.get(key)[0], shared.get(key)[0])
+        self.assertEquals(3, len(single.get(key)[0]))
+
     def test_historical_memory_cache(self):
         self._do_historical_cache_test(MemoryStorage())
 
@@ -0,0 +1,53 @@
+import unittest
+import pandas as pd
+import pandas.util.testing as pdtest
+import numpy as np
+
+import tia.analysis.ta as ta
+import tia.analysis.streaming as st
+
+
+class StreamingTest(unittest.TestCase):
+    def setUp(self):
+        idx = pd.date_range('1/1/2014', periods=120, freq='B')
+        rng = np.random.RandomState(7)
+        close = pd.Series(100. + rng.normal(0, 1, len(idx)).cumsum(), index=idx)
+        close.iloc[[10, 50, 51]] = np.nan
+        self.close = close
+        self.pxs = pd.DataFrame({'close': close, 'high': close + rng.rand(len(idx)),
+                                 'low': close - rng.rand(len(idx))}).ffill()
+
+    def test_moving_averages(self):
+        close = self.close
+        pdtest.assert_series_equal(ta.sma(close, 5), st.replay(st.Sma(5), close))
+        pdtest.assert_series_equal(ta.sma(close, 0), st.replay(st.Sma(0), close))
+        pdtest.assert_series_equal(ta.ema(close, 5), st.replay(st.Ema(5), close))
+        pdtest.assert_series_equal(ta.wilderma(close, 5), st.replay(st.WilderMa(5), close))
+        pdtest.assert_frame_equal(ta.macd(close.dropna()), st.replay(st.Macd(), close.dropna()))
+        self.assertRaises(ValueError, st.Ema, 0)
+
+    def test_oscillators(self):
+        pdtest.assert_series_equal(ta.rsi(self.close, 14), st.replay(st.Rsi(14), self.close))
+        pdtest.assert_series_equal(ta.true_range(self.pxs), st.replay(st.TrueRange(), self.pxs), check_names=False)
+        pdtest.assert_frame_equal(ta.dmi(self.pxs, 14), st.replay(st.Dmi(14), self.pxs))
+
+    def test_cross_signal(self):
+        frame = pd.DataFrame({'fast': ta.sma(self.close, 3).round(0), 'slow': ta.sma(self.close, 10).round(0)})
+        for continuous in [0, 1]:
+            exp = ta.cross_signal(frame.fast, frame.slow, continuous)
+            res = st.replay(st.CrossSignal('fast', 'slow', continuous), frame)
+            pdtest.assert_series_equal(exp, res)
+            exp = ta.cross_signal(frame.fast, (99, 101), continuous)
+            res = st.replay(st.CrossSignal('fast', (99, 101), continuous), frame)
+            pdtest.assert_series_equal(exp, res)
+
+    def test_snapshot_restore(self):
+        ind = st.Dmi(14)
+        rows = [dict(zip(self.pxs.columns, row)) for row in self.pxs.values]
+        for row in rows[:60]:
+            ind.update(row)
+        state = ind.snapshot()
+        exp = [ind.update(row) for row in rows[60:]]
+        ind.restore(state)
+        res = [ind.update(row) for row in rows[60:]]
+        np.testing.assert_array_equal(np.array(exp), np.array(res))
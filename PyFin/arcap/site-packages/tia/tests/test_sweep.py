@@ -0,0 +1,79 @@
+import unittest
+import pandas as pd
+import numpy as np
+
+import tia.analysis.ta as ta
+from tia.analysis.model import Instrument, InstrumentPrices
+from tia.analysis.sweep import param_grid, SharedPrices, run_signal, sweep
+
+
+def sma_cross(frame, fast, slow):
+    return ta.cross_signal(ta.sma(frame.close, fast), ta.sma(frame.close, slow))
+
+
+def _instrument(sid, seed):
+    idx = pd.date_range('1/1/2013', periods=400, freq='B')
+    rng = np.random.RandomState(seed)
+    close = pd.Series(100. * np.exp(np.cumsum(rng.normal(0, .01, len(idx)))), index=idx)
+    frame = pd.DataFrame({'open': close.shift(1).fillna(100.), 'high': close * 1.01, 'low': close * .99,
+                          'close': close})
+    return Instrument(sid, InstrumentPrices(frame), multiplier=1.)
+
+
+class SpreadInstrument(Instrument):
+    """Instrument which pays a spread on every transaction"""
+
+    def __init__(self, sid, pxs, spread):
+        Instrument.__init__(self, sid, pxs, multiplier=1.)
+        self.spread = spread
+
+    def get_premium(self, qty, px, ts=None):
+        return Instrument.get_premium(self, qty, px, ts) - abs(qty) * self.spread
+
+    def get_premiums(self, qtys, pxs, tss=None):
+        return Instrument.get_premiums(self, qtys, pxs, tss) - np.abs(qtys) * self.spread
+
+
+class SweepTest(unittest.TestCase):
+    def setUp(self):
+        self.instruments = [_instrument('A', 1), _instrument('B', 2)]
+
+    def test_param_grid(self):
+        grid = param_grid(slow=[20, 50], fast=[5, 10])
+        self.assertEqual(4, len(grid))
+        self.assertEqual({'fast': 5, 'slow': 20}, grid[0])
+        self.assertEqual({'fast': 10, 'slow': 50}, grid[-1])
+
+    def test_shared_prices(self):
+        frame = self.instruments[0].pxs.frame
+        shared = SharedPrices(frame)
+        res = shared.frame
+        self.assertTrue(np.array_equal(frame.values, res.values))
+        self.assertTrue(frame.index.equals(res.index))
+        self.assertEqual(list(frame.columns), list(res.columns))
+
+    def test_sweep(self):
+        params = {'fast': [5, 10], 'slow': [20, 50]}
+        res = sweep(self.instruments, sma_cross, params, processes=0)
+        self.assertEqual(8, len(res))
+        self.assertEqual(['sid', 'fast', 'slow'], list(res.index.names))
+        res = res.drop([('port', 'maxdd dt')], axis=1)
+        exp = run_signal(self.instruments[1], sma_cross, {'fast': 10, 'slow': 20}).drop([('port', 'maxdd dt')])
+        np.testing.assert_allclose(exp.values.astype(float), res.loc[('B', 10, 20)].values.astype(float))
+
+        # pool results match the in process results
+        pres = sweep(self.instruments, sma_cross, params, processes=2).drop([('port', 'maxdd dt')], axis=1)
+        self.assertTrue(res.index.equals(pres.index))
+        np.testing.assert_allclose(res.values.astype(float), pres.values.astype(float))
+
+    def test_sweep_subclass(self):
+        # workers price with the instrument's own class and state
+        ins = self.instruments[0]
+        spread = SpreadInstrument(ins.sid, ins.pxs, 2.)
+        params = {'fast': [5, 10], 'slow': [20]}
+        res = sweep([spread], sma_cross, params, processes=0).drop([('port', 'maxdd dt')], axis=1)
+        pres = sweep([spread], sma_cross, params, processes=2).drop([('port', 'maxdd dt')], axis=1)
+        np.testing.assert_allclose(res.values.astype(float), pres.values.astype(float))
+        base = sweep([ins], sma_cross, params, processes=0).drop([('port', 'maxdd dt')], axis=1)
+        self.assertFalse(np.allclose(base.values.astype(float), pres.values.astype(float)))
+        self.assertTrue(spread.pxs.frame is ins.pxs.frame)
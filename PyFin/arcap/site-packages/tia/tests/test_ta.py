@@ -39,3 +39,125 @@ class TATest(unittest.TestCase):
 
 
 
+
+    def test_signal_trade_store(self):
+        sig = pd.Series([0, 1, 0, -1, 0, 1, -1, 1], index=pd.date_range('12/1/2014', periods=8, freq='B'))
+        pxs = pd.Series(range(1, len(sig)+1), index=sig.index, dtype=float)
+        qtys = pd.Series([2., 3.], index=[sig.index[0], sig.index[4]])
+        trds = ta.Signal(sig, qtys).close_to_close(pxs)
+        store = ta.Signal(sig, qtys).close_to_close(pxs, as_store=1)
+        self.assertEqual(len(trds), len(store))
+        self.assertEqual([t.qty for t in trds], list(store.qty))
+        self.assertEqual([t.px for t in trds], list(store.px))
+        self.assertEqual([2., -2., -2., 2., 3., -3., -3., 3., 3.], list(store.qty))
+
+        opens = pxs + .5
+        trds = ta.Signal(sig).open_to_close(opens, pxs)
+        self.assertEqual(8, len(trds))
+        # opened on the next bar's open, closed on the signal bar's close
+        self.assertEqual((trds[0].ts, trds[0].px), (sig.index[2], 3.5))
+        self.assertEqual((trds[1].ts, trds[1].px), (sig.index[2], 3.))
+        self.assertRaises(Exception, ta.Signal(sig).close_to_close, pxs.iloc[:-1])
+
+    def test_wilderma_rsi_panel(self):
+        s = pd.Series([np.nan, 1., 2., 3., np.nan, 4., 5., 4., 3., 2., 6.])
+        res = ta.wilderma(s, 3)
+        exp = pd.Series(np.nan, index=s.index)
+        exp[3] = 2.
+        for i, last in zip([5, 6, 7, 8, 9, 10], [3, 5, 6, 7, 8, 9]):
+            exp[i] = s[i] / 3. + (1. - 1. / 3.) * exp[last]
+        pdtest.assert_series_equal(res, exp)
+
+        # columns with different missing values are computed in a single call and match the per series results
+        df = pd.DataFrame({'a': s, 'b': s[::-1].values, 'c': np.arange(len(s), dtype=float) ** 1.5})
+        for fct in [ta.wilderma, ta.rsi]:
+            res = fct(df, 3)
+            for col in df.columns:
+                pdtest.assert_series_equal(res[col], fct(df[col], 3), check_names=False)
+
+    def test_rolling_argmax(self):
+        s = pd.Series([1., 3., 2., 3., np.nan, 1., 0., 4., 4.])
+        res = ta.rolling_argmax(s, 3)
+        exp = pd.Series([np.nan, np.nan, 1., 2., np.nan, 1., 0., 2., 2.])
+        pdtest.assert_series_equal(res, exp)
+        res = ta.rolling_argmin(s, 3)
+        exp = pd.Series([np.nan, np.nan, 0., 1., np.nan, 2., 2., 1., 0.])
+        pdtest.assert_series_equal(res, exp)
+
+        # aroon up is the position of the max in a window of n + 1
+        res = ta.aroon(s, 2)
+        pdtest.assert_series_equal(res['UP'], 100. * ta.rolling_argmax(s, 3) / 2, check_names=False)
+        pdtest.assert_series_equal(res['DOWN'], 100. * ta.rolling_argmin(s, 3) / 2, check_names=False)
+
+    def test_cross_signals(self):
+        # equal values take the prior signal
+        s = pd.Series([1., 3., 2., 2., 3., 1., 2., 2., 2., 3.])
+        res = ta.cross_signal(s, 2)
+        exp = pd.Series([-1., 1., 1., 1., 1., -1., -1., -1., -1., 1.])
+        pdtest.assert_series_equal(res, exp)
+        res = ta.cross_signal(s, (2, 3))
+        exp = pd.Series([-1., 0., 0., 0., 0., -1., -1., -1., -1., 0.])
+        pdtest.assert_series_equal(res, exp)
+
+        # each column of the panel matches the single series result
+        df = pd.DataFrame({'a': s, 'b': s[::-1].values, 'c': s.shift(2)})
+        for continuous in [0, 1]:
+            res = ta.cross_signals(df, 2, continuous=continuous)
+            for col in df.columns:
+                pdtest.assert_series_equal(res[col], ta.cross_signal(df[col], 2, continuous=continuous),
+                                           check_names=False)
+            res = ta.cross_signals(df, df.a, continuous=continuous)
+            pdtest.assert_series_equal(res['b'], ta.cross_signal(df.b, df.a, continuous=continuous),
+                                       check_names=False)
+
+    def test_indicator_pipeline(self):
+        idx = pd.date_range('1/1/2014', periods=100, freq='B')
+        close = pd.Series(100. + np.sin(np.arange(len(idx)) / 5.) * 10 + np.arange(len(idx)) * .1, index=idx)
+        close.iloc[[20, 21]] = np.nan
+        pxs = pd.DataFrame({'close': close, 'high': close + 1., 'low': close - 1.5})
+
+        pipe = ta.IndicatorPipeline(pxs).add('ema', 12).add('macd').add('rsi', 14).add('rsi', 7).add('atr', 14)
+        pipe.add('dmi', 14).add(ta.sma, 5, col='close', name='sma5')
+        res = pipe.evaluate()
+        pdtest.assert_series_equal(res['ema_12'], ta.ema(close, 12), check_names=False)
+        pdtest.assert_series_equal(res['rsi_14'], ta.rsi(close, 14), check_names=False)
+        pdtest.assert_series_equal(res['rsi_7'], ta.rsi(close, 7), check_names=False)
+        pdtest.assert_series_equal(res['sma5'], ta.sma(close, 5), check_names=False)
+        pdtest.assert_series_equal(res['atr_14'], ta.wilderma(ta.true_range(pxs), 14), check_names=False)
+        pdtest.assert_series_equal(res['macd_MACD_SIGNAL'], ta.macd(close)['MACD_SIGNAL'], check_names=False)
+        pdtest.assert_series_equal(res['dmi_14_ADX'], ta.dmi(pxs, 14)['ADX'], check_names=False)
+        # shared intermediate results are computed once
+        self.assertEqual(set([('ema', None, 12), ('ema', None, 26)]), set(k for k in pipe._cache if k[0] == 'ema'))
+        self.assertTrue(pipe.atr(14) is pipe.atr(14))
+        self.assertEqual(1, len([k for k in pipe._cache if k[0] == 'rsi_moves']))
+
+    def test_per_series_dispatch(self):
+        from multiprocessing.pool import ThreadPool
+        from tia.analysis.util import set_pool
+
+        idx = pd.date_range('1/1/2014', periods=60, freq='B')
+        rng = np.random.RandomState(3)
+        df = pd.DataFrame(rng.normal(size=(len(idx), 6)).cumsum(axis=0), index=idx, columns=list('fedcba'))
+        df.iloc[:10, 2] = np.nan
+
+        # array capable functions receive the whole frame
+        pdtest.assert_series_equal(ta.sma(df, 5)['d'], ta.sma(df['d'], 5))
+        pdtest.assert_series_equal(ta.ema(df, 5)['a'], ta.ema(df['a'], 5))
+
+        pool = ThreadPool(3)
+        try:
+            for p in (None, pool):
+                prev = set_pool(p)
+                try:
+                    res = ta.rolling_argmax(df, 4)
+                    self.assertEqual(list(df.columns), list(res.columns))
+                    pdtest.assert_series_equal(res['d'], ta.rolling_argmax(df['d'], 4), check_names=False)
+
+                    res = ta.macd(df)
+                    self.assertEqual(list('fedcba'), list(res.columns.get_level_values(0).unique()))
+                    pdtest.assert_frame_equal(res['c'], ta.macd(df['c']))
+                finally:
+                    set_pool(prev)
+        finally:
+            pool.close()
+            pool.join()
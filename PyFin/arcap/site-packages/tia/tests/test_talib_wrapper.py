@@ -0,0 +1,83 @@
+import unittest
+from multiprocessing.pool import ThreadPool
+
+import pandas as pd
+import pandas.util.testing as pdtest
+import numpy as np
+
+from tia.analysis.util import set_pool
+
+try:
+    import talib
+    import tia.analysis.talib_wrapper as tw
+except ImportError:
+    talib = None
+
+
+@unittest.skipIf(talib is None, 'talib is not installed')
+class TalibWrapperTest(unittest.TestCase):
+    def setUp(self):
+        idx = pd.date_range('1/1/2014', periods=30, freq='B')
+        rng = np.random.RandomState(1)
+        vals = 100. + np.cumsum(rng.normal(0, 1, (len(idx), 8)), axis=0)
+        self.frame = frame = pd.DataFrame(vals, index=idx, columns=list('abcdefgh'))
+        # a is full, b and g share leading NaNs, c has trailing NaNs, d and e share interior NaNs, f is all NaN
+        frame.iloc[:4, [1, 6]] = np.nan
+        frame.iloc[-3:, 2] = np.nan
+        frame.iloc[[5, 9, 10, 20], 3:5] = np.nan
+        frame.iloc[:, 5] = np.nan
+        frame.iloc[2, 7] = np.nan
+
+        # 2 level ohlc frame
+        cols = pd.MultiIndex.from_product([['x', 'y', 'z'], ['open', 'high', 'low', 'close']])
+        close = 100. + np.cumsum(rng.normal(0, 1, (len(idx), 3)), axis=0)
+        data = np.hstack([np.column_stack([c - .5, c + 1., c - 1., c]) for c in close.T])
+        self.ohlc = pd.DataFrame(data, index=idx, columns=cols)
+
+    def tearDown(self):
+        pool = set_pool(None)
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def check_panel(self):
+        frame = self.frame
+        res = tw.MOM(frame, 3)
+        self.assertEqual(list(frame.columns), list(res.columns))
+        for c in frame.columns:
+            pdtest.assert_series_equal(tw.MOM(frame[c], 3), res[c], check_names=False)
+
+        # full frame keeps the talib output dtype
+        res = tw.MOM(frame[['a']], 3)
+        self.assertEqual(tw.MOM(frame['a'], 3).dtype, res['a'].dtype)
+
+        res = tw.BBANDS(frame, 3)
+        self.assertEqual([(c, n) for c in frame.columns for n in ['UpperBand', 'MiddleBand', 'LowerBand']],
+                         list(res.columns))
+        for c in frame.columns:
+            pdtest.assert_frame_equal(tw.BBANDS(frame[c], 3), res[c])
+
+        ohlc = self.ohlc
+        res = tw.ADX(ohlc, 3)
+        self.assertEqual(['x', 'y', 'z'], list(res.columns))
+        for hdr in ['x', 'y', 'z']:
+            pdtest.assert_series_equal(tw.ADX(ohlc[hdr], 3), res[hdr], check_names=False)
+
+        res = tw.CDLDOJI(ohlc)
+        for hdr in ['x', 'y', 'z']:
+            exp = tw.CDLDOJI(ohlc[hdr])
+            self.assertEqual(exp.dtype, res[hdr].dtype)
+            pdtest.assert_series_equal(exp, res[hdr], check_names=False)
+
+        res = tw.AROON(ohlc, 3)
+        self.assertEqual([(h, n) for h in ['x', 'y', 'z'] for n in ['AroonDown', 'AroonUp']], list(res.columns))
+        for hdr in ['x', 'y', 'z']:
+            pdtest.assert_frame_equal(tw.AROON(ohlc[hdr], 3), res[hdr])
+
+    def test_panel(self):
+        set_pool(None)
+        self.check_panel()
+
+    def test_panel_threads(self):
+        set_pool(ThreadPool(3))
+        self.check_panel()
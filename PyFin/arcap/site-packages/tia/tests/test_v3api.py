@@ -0,0 +1,274 @@
+import sys
+import threading
+import unittest
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from tia.tests import blpapi_stub
+
+try:
+    import blpapi
+except ImportError:
+    sys.modules['blpapi'] = blpapi_stub
+
+import tia.bbg.v3api as v3api
+from tia.bbg.v3api import Request, Terminal, PooledTerminal, SessionFailure, ColumnBuffer, HistoricalDataRequest, \
+    IntradayTickRequest
+
+
+class EchoRequest(Request):
+    """Request whose response is the list of message payloads received"""
+
+    def __init__(self, value, svcname='//blp/refdata'):
+        Request.__init__(self, svcname)
+        self.value = value
+
+    def new_response(self):
+        self.response = []
+
+    def get_bbg_request(self, svc, session):
+        request = svc.createRequest('EchoRequest')
+        request.set('value', self.value)
+        return request
+
+    def on_event(self, evt, is_final):
+        self.response.extend(msg.data for msg in evt)
+
+
+class SidsResponse(object):
+    def __init__(self, request):
+        self.request = request
+        self.response_map = {}
+
+
+class SidsRequest(Request):
+    """Request whose response maps each sid to the payloads received for it"""
+
+    def __init__(self, sids):
+        Request.__init__(self, '//blp/refdata')
+        self.sids = sids
+
+    def new_response(self):
+        self.response = SidsResponse(self)
+
+    def get_bbg_request(self, svc, session):
+        request = svc.createRequest('SidsRequest')
+        [request.append('securities', sid) for sid in self.sids]
+        return request
+
+    def on_event(self, evt, is_final):
+        for msg in evt:
+            sid, value = msg.data
+            self.response.response_map.setdefault(sid, []).append(value)
+
+
+class V3ApiTest(unittest.TestCase):
+    def setUp(self):
+        self.blpapi = v3api.blpapi
+        v3api.blpapi = blpapi_stub
+        blpapi_stub.Session.reset()
+        blpapi_stub.Session.responder = staticmethod(lambda req: [[req['value']]])
+
+    def tearDown(self):
+        v3api.blpapi = self.blpapi
+        blpapi_stub.Session.reset()
+
+    def test_terminal(self):
+        blpapi_stub.Session.responder = staticmethod(lambda req: [[1, 2], [req['value']]])
+        res = Terminal('localhost', 8194).execute(EchoRequest('a'))
+        self.assertEqual([1, 2, 'a'], res)
+        self.assertEqual(1, len(blpapi_stub.Session.instances))
+        self.assertTrue(blpapi_stub.Session.instances[0].stopped)
+
+    def test_pooled_session_reuse(self):
+        term = PooledTerminal('localhost', 8194)
+        self.assertEqual(['a'], term.execute(EchoRequest('a')))
+        self.assertEqual(['b'], term.execute(EchoRequest('b')))
+        self.assertEqual(['c'], term.execute(EchoRequest('c', svcname='//blp/apiflds')))
+        self.assertEqual(1, len(blpapi_stub.Session.instances))
+        session = blpapi_stub.Session.instances[0]
+        self.assertEqual(['//blp/refdata', '//blp/apiflds'], session.opened)
+        self.assertFalse(session.stopped)
+        term.close()
+        self.assertTrue(session.stopped)
+
+    def test_pooled_reconnect(self):
+        term = PooledTerminal('localhost', 8194, retries=1)
+        term.execute(EchoRequest('a'))
+        blpapi_stub.Session.fail_next = 1
+        self.assertEqual(['b'], term.execute(EchoRequest('b')))
+        first, second = blpapi_stub.Session.instances
+        self.assertTrue(first.stopped)
+        self.assertFalse(second.stopped)
+        self.assertEqual(['//blp/refdata'], second.opened)
+
+        term = PooledTerminal('localhost', 8194, retries=0)
+        blpapi_stub.Session.fail_next = 1
+        self.assertRaises(SessionFailure, term.execute, EchoRequest('c'))
+
+    def test_pooled_dead_idle_session(self):
+        # idle session reported as terminated is discarded before it is used
+        term = PooledTerminal('localhost', 8194)
+        term.execute(EchoRequest('a'))
+        blpapi_stub.Session.instances[0].kill()
+        self.assertEqual(['b'], term.execute(EchoRequest('b')))
+        first, second = blpapi_stub.Session.instances
+        self.assertTrue(first.stopped)
+        self.assertEqual(1, len(first.requests))
+        self.assertEqual(1, len(second.requests))
+
+        # idle session which died without a status event fails to send and the request is retried
+        second.kill(notify=0)
+        self.assertEqual(['c'], term.execute(EchoRequest('c')))
+        self.assertEqual(3, len(blpapi_stub.Session.instances))
+        self.assertTrue(second.stopped)
+        self.assertEqual(['//blp/refdata'], blpapi_stub.Session.instances[2].opened)
+
+        # with no retries the send error is raised
+        term = PooledTerminal('localhost', 8194, retries=0)
+        term.execute(EchoRequest('d'))
+        blpapi_stub.Session.instances[-1].kill(notify=0)
+        self.assertRaises(SessionFailure, term.execute, EchoRequest('e'))
+
+    def test_pooled_request_error(self):
+        # errors other than session failures are raised without a retry and the session is discarded
+        class BadRequest(EchoRequest):
+            def get_bbg_request(self, svc, session):
+                raise ValueError('bad request')
+
+        class ErrorResponse(EchoRequest):
+            def on_event(self, evt, is_final):
+                raise RuntimeError('response error')
+
+        term = PooledTerminal('localhost', 8194, retries=2)
+        term.execute(EchoRequest('a'))
+        self.assertRaises(ValueError, term.execute, BadRequest('b'))
+        self.assertEqual(1, len(blpapi_stub.Session.instances))
+        self.assertTrue(blpapi_stub.Session.instances[0].stopped)
+
+        self.assertRaises(RuntimeError, term.execute, ErrorResponse('c'))
+        self.assertEqual(2, len(blpapi_stub.Session.instances))
+        self.assertEqual(1, len(blpapi_stub.Session.instances[1].requests))
+        self.assertEqual(['d'], term.execute(EchoRequest('d')))
+
+    def test_pooled_concurrent(self):
+        term = PooledTerminal('localhost', 8194, size=2)
+        results = {}
+
+        def run(value):
+            results[value] = term.execute(EchoRequest(value))
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(20)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+        self.assertEqual(dict((i, [i]) for i in range(20)), results)
+        self.assertTrue(len(blpapi_stub.Session.instances) <= 2)
+
+    def test_execute_many(self):
+        # each sid gets a partial and a final response
+        def responder(req):
+            sids = req.get('securities', [req.get('value')])
+            return [[(sid, 1) for sid in sids], [(sid, 2) for sid in sids]]
+
+        blpapi_stub.Session.responder = staticmethod(responder)
+        sids = ['SID%s' % i for i in range(25)]
+        requests = [SidsRequest(sids), SidsRequest(['A', 'B']), SidsRequest(['C'])]
+        res = Terminal('localhost', 8194).execute_many(requests, max_sids=10, max_pending=2)
+        self.assertEqual(3, len(res))
+        self.assertEqual(dict((sid, [1, 2]) for sid in sids), res[0].response_map)
+        self.assertEqual({'A': [1, 2], 'B': [1, 2]}, res[1].response_map)
+        self.assertEqual({'C': [1, 2]}, res[2].response_map)
+        self.assertTrue(res[0] is requests[0].response)
+
+        # single session, 3 chunks of the first request plus 2 requests, at most 2 outstanding
+        self.assertEqual(1, len(blpapi_stub.Session.instances))
+        session = blpapi_stub.Session.instances[0]
+        self.assertEqual([10, 10, 5, 2, 1], [len(r['securities']) for r in session.requests])
+        self.assertEqual(2, session.max_outstanding)
+
+        # pooled terminal reuses its session across calls
+        term = PooledTerminal('localhost', 8194)
+        term.execute_many([SidsRequest(['A'])])
+        res = term.execute_many([SidsRequest(['B']), EchoRequest('x')], max_pending=None)
+        self.assertEqual({'B': [1, 2]}, res[0].response_map)
+        self.assertEqual([('x', 1), ('x', 2)], res[1])
+        self.assertEqual(2, len(blpapi_stub.Session.instances))
+
+    def test_column_buffer(self):
+        element = blpapi_stub.element
+        buf = ColumnBuffer(capacity=2)
+        [buf.append(element('x', i)) for i in range(3)]
+        self.assertEqual('i', buf.kind)
+        buf.append_missing()
+        self.assertEqual('f', buf.kind)
+        np.testing.assert_array_equal([0, 1, 2, np.nan], buf.as_array())
+
+        # missing values before the first integer
+        buf = ColumnBuffer()
+        buf.append_missing(2)
+        buf.append(element('x', 1))
+        np.testing.assert_array_equal([np.nan, np.nan, 1], buf.as_array())
+
+        buf = ColumnBuffer()
+        buf.append(element('x', datetime(2014, 1, 2, 3, 4, 5, 6)))
+        buf.append(element('x', None, datatype=13))
+        exp = pd.DatetimeIndex([datetime(2014, 1, 2, 3, 4, 5, 6), pd.NaT])
+        self.assertTrue(exp.equals(pd.DatetimeIndex(buf.as_array())))
+        # mixed types fall back to objects
+        buf.append(element('x', 'a'))
+        self.assertEqual('O', buf.kind)
+        self.assertEqual(pd.Timestamp('2014-01-02 03:04:05.000006'), buf.as_array()[0])
+        self.assertEqual('a', buf.as_array()[2])
+
+    def test_historical_response(self):
+        def point(i):
+            pt = OrderedDict([('date', datetime(2014, 1, 1 + i)), ('PX_LAST', 100. + i)])
+            i % 2 and pt.update(NAME='n%s' % i)
+            return pt
+
+        def responder(req):
+            events = []
+            for sid in req['securities']:
+                node = OrderedDict([('security', sid), ('fieldData', [point(i) for i in range(5)])])
+                events.append([blpapi_stub.element('HistoricalDataResponse', {'securityData': node})])
+            return events
+
+        blpapi_stub.Session.responder = staticmethod(responder)
+        req = HistoricalDataRequest(['A', 'B', 'C'], ['PX_LAST', 'NAME'], start='1/1/2014', end='1/5/2014')
+        frame = Terminal('localhost', 8194).execute(req).as_map()['B']
+        self.assertEqual(['PX_LAST', 'NAME'], list(frame.columns))
+        self.assertTrue(pd.date_range('1/1/2014', '1/5/2014', name='date').equals(frame.index))
+        np.testing.assert_array_equal(100. + np.arange(5), frame['PX_LAST'].values)
+        self.assertEqual(['n1', 'n3'], list(frame['NAME'].dropna()))
+
+        chunks = list(Terminal('localhost', 8194).iter_chunks(req, chunksize=10))
+        self.assertEqual([['A', 'B'], ['C']], [list(c.columns.levels[0]) for c in chunks])
+
+    def test_tick_chunks(self):
+        def tick(i):
+            data = OrderedDict([('time', datetime(2014, 1, 2, 10, 0, i)), ('type', 'TRADE'), ('value', 10. + i),
+                                ('size', 100 + i)])
+            i % 3 or data.update(conditionCodes='X')
+            return data
+
+        def responder(req):
+            return [[blpapi_stub.element('IntradayTickResponse', {'tickData': {'tickData': [tick(i + j) for j in
+                                                                                             range(4)]}})]
+                    for i in range(0, 12, 4)]
+
+        blpapi_stub.Session.responder = staticmethod(responder)
+        req = IntradayTickRequest('A', start='1/2/2014', end='1/3/2014')
+        frame = Terminal('localhost', 8194).execute(req).as_frame()
+        # columns are sorted by name
+        self.assertEqual(['conditionCodes', 'size', 'time', 'type', 'value'], list(frame.columns))
+        self.assertEqual(np.int64, frame['size'].dtype)
+        self.assertTrue(pd.date_range('1/2/2014 10:00', periods=12, freq='s').equals(pd.DatetimeIndex(frame['time'])))
+        self.assertEqual(['X', 'X', 'X', 'X'], list(frame['conditionCodes'].dropna()))
+
+        chunks = list(Terminal('localhost', 8194).iter_chunks(req, chunksize=5))
+        self.assertEqual([8, 4], [len(c) for c in chunks])
+        res = pd.concat(chunks, ignore_index=True)
+        self.assertTrue(frame.equals(res))